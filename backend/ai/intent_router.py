@@ -0,0 +1,201 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+import os
+import numpy as np
+from ai.memory_index import Embedder, HashingEmbedder
+from ai.response_cache import normalize_input
+
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "false").lower() == "true"
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.75"))  # Report the input as the action; it is still answered by the model
+INTENT_DIRECT_CONFIDENCE = float(os.getenv("INTENT_DIRECT_CONFIDENCE", "0.9"))  # Apply the action's effects and answer with the rule-based reply
+INTENT_COVERAGE_WEIGHT = 0.5  # Share of the confidence from keyword coverage; the rest is example similarity
+INTENT_SIMILARITY_FLOOR = 0.6  # Similarity credited to any keyword match, so short inputs unlike every example still count
+
+# Phrases that on their own name a rule action
+INTENT_KEYWORDS: Dict[str, Sequence[str]] = {
+    "greet": (
+        "hello", "hi", "hey", "greetings", "howdy", "good morning", "good afternoon", "good evening",
+        "good day", "nice to meet you", "how are you", "well met"
+    ),
+    "ask_about_murder": (
+        "murder", "murdered", "murderer", "killer", "killed", "killing", "who did it", "the body",
+        "the crime", "the victim", "who died"
+    ),
+    "investigate": (
+        "investigate", "search", "look around", "have a look", "take a look", "examine", "inspect",
+        "snoop", "clues", "evidence", "poke around"
+    )
+}
+
+# Example phrasings the n-gram model generalises from
+INTENT_EXAMPLES: Dict[str, Sequence[str]] = {
+    "greet": (
+        "hello", "hi", "hey", "hi there", "hello there how are you", "good morning", "good morning to you",
+        "good afternoon", "good evening friend", "good day", "greetings traveler", "howdy", "hey how are you",
+        "nice to meet you", "how are you today", "how do you do", "well met stranger"
+    ),
+    "ask_about_murder": (
+        "what do you know about the murder", "who killed him", "who is the killer", "who is the murderer",
+        "tell me about the murder", "did you see who did it", "what happened last night", "who was murdered",
+        "do you know anything about the death", "have you heard about the killing", "who would want him dead"
+    ),
+    "investigate": (
+        "investigate", "search", "let me look around", "i want to investigate", "i want to search this place",
+        "can i investigate here", "examine the room", "inspect the forge", "search for clues", "look for evidence",
+        "mind if i have a look around", "can i take a look", "i will check behind the counter"
+    )
+}
+
+# Words that carry no intent; ignored when judging how much of the input the keywords explain
+FILLER_WORDS = frozenset((
+    "a", "an", "the", "to", "of", "in", "on", "at", "for", "with", "and", "or", "so", "then",
+    "i", "me", "my", "we", "us", "you", "your", "him", "her", "them", "it", "its", "this", "that", "here", "there",
+    "is", "are", "was", "were", "be", "do", "does", "did", "can", "could", "would", "will", "may", "might",
+    "please", "just", "about", "anything", "something", "know", "tell", "let", "what", "who", "want", "again", "now",
+    "sir", "madam", "friend", "traveler", "stranger", "oh", "well", "yes", "ok", "okay"
+))
+
+class Intent(NamedTuple):
+    """The rule action an input most likely asks for"""
+    action: Optional[str]
+    confidence: float
+    # Whether the rule-based reply can stand in for a generated one
+    direct: bool
+
+    @property
+    def rule_action(self) -> Optional[str]:
+        """The action whose time cost and trust change apply; only confident matches count"""
+        return self.action if self.direct else None
+
+    def to_dict(self) -> Dict:
+        return {"action": self.action, "confidence": round(self.confidence, 3)}
+
+class KeywordTrie:
+    """Phrases as token paths, matched longest first anywhere in an input"""
+    _END = ""
+
+    def __init__(self):
+        self._root: Dict = {}
+
+    def add(self, phrase: str, action: str):
+        node = self._root
+        for token in normalize_input(phrase).split():
+            node = node.setdefault(token, {})
+        node[self._END] = action
+
+    def matches(self, tokens: Sequence[str]) -> List[Tuple[str, int, int]]:
+        """Non-overlapping (action, start, stop) matches, scanning left to right"""
+        found = []
+        start = 0
+        while start < len(tokens):
+            node = self._root
+            longest = None
+            for position in range(start, len(tokens)):
+                node = node.get(tokens[position])
+                if node is None:
+                    break
+                if self._END in node:
+                    longest = (node[self._END], start, position + 1)
+            if longest is not None:
+                found.append(longest)
+                start = longest[2]
+            else:
+                start += 1
+        return found
+
+class IntentRouter:
+    """
+    Maps free-form player input onto the rule actions, with a confidence score
+
+    Two signals have to agree. A keyword trie finds phrases that name an
+    action, and measures how much of the input those phrases explain. A
+    TF-IDF model over hashed word n-grams compares the whole input to example
+    phrasings of each action, scored by the closest one. The confidence blends
+    the two, with the similarity floored for any keyword match: an input the
+    keywords fully explain ("hey") is always reported even when it resembles
+    no example, and only skips the model when it also reads like one, while
+    a keyword inside an unrelated request ("can you search for my lost
+    dog?") stays low. Inputs that name several actions, or none, are left
+    to the model.
+    """
+
+    def __init__(
+        self,
+        keywords: Dict[str, Iterable[str]] = INTENT_KEYWORDS,
+        examples: Dict[str, Iterable[str]] = INTENT_EXAMPLES,
+        embedder: Optional[Embedder] = None,
+        min_confidence: float = INTENT_MIN_CONFIDENCE,
+        direct_confidence: float = INTENT_DIRECT_CONFIDENCE
+    ):
+        self.min_confidence = min_confidence
+        self.direct_confidence = direct_confidence
+        self.embedder = embedder or HashingEmbedder(dim=512)
+        self.actions: Tuple[str, ...] = tuple(examples)
+        self.trie = KeywordTrie()
+        for action, phrases in keywords.items():
+            for phrase in phrases:
+                self.trie.add(phrase, action)
+
+        # Inverse document frequency per hashed feature, over every example
+        texts = [normalize_input(text) for action in self.actions for text in examples[action]]
+        vectors = self.embedder.embed(texts)
+        document_frequency = np.count_nonzero(vectors, axis=0)
+        self._idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        self._examples = self._weigh(vectors)
+        # Row ranges of each action's examples
+        self._spans: List[Tuple[str, int, int]] = []
+        row = 0
+        for action in self.actions:
+            count = len(examples[action])
+            self._spans.append((action, row, row + count))
+            row += count
+
+    def route(self, player_input: str) -> Intent:
+        """
+        Classify player input
+
+        Returns:
+            Intent: The action, or None when the input doesn't map onto one
+            with at least min_confidence; direct when the rule-based reply
+            is confident enough to skip the model
+        """
+        text = normalize_input(player_input)
+        if text.replace(" ", "_") in self.actions:
+            # The action names themselves, as sent by the game's buttons
+            return self._intent(text.replace(" ", "_"), 1.0)
+        tokens = text.split()
+        if not tokens:
+            return Intent(None, 0.0, False)
+
+        similarities = self.similarities(text)
+        matches = self.trie.matches(tokens)
+        matched_actions: Set[str] = {action for action, _, _ in matches}
+        if len(matched_actions) != 1:
+            action = max(self.actions, key=lambda name: similarities[name])
+            return Intent(None, 0.0, False) if matched_actions else Intent(None, similarities[action] / 2, False)
+        action = matches[0][0]
+        covered = {position for _, start, stop in matches for position in range(start, stop)}
+        content = [position for position, token in enumerate(tokens) if token not in FILLER_WORDS or position in covered]
+        coverage = len(covered) / len(content)
+        similarity = max(similarities[action], INTENT_SIMILARITY_FLOOR)
+        return self._intent(action, INTENT_COVERAGE_WEIGHT * coverage + (1 - INTENT_COVERAGE_WEIGHT) * similarity)
+
+    def similarities(self, text: str) -> Dict[str, float]:
+        """Cosine similarity of normalized text to each action's closest example phrasing"""
+        vector = self._weigh(self.embedder.embed([text]))[0]
+        scores = self._examples @ vector
+        return {action: max(0.0, float(scores[start:stop].max())) for action, start, stop in self._spans}
+
+    def _intent(self, action: str, confidence: float) -> Intent:
+        confidence = min(1.0, confidence)
+        if confidence < self.min_confidence:
+            return Intent(None, confidence, False)
+        return Intent(action, confidence, confidence >= self.direct_confidence)
+
+    def _weigh(self, vectors: np.ndarray) -> np.ndarray:
+        return self._normalize(vectors * self._idf)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
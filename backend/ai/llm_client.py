@@ -0,0 +1,174 @@
+import os
+import asyncio
+import time
+from typing import AsyncIterator, Dict, List, Optional
+from dotenv import load_dotenv
+import httpx
+from openai import AsyncOpenAI
+from ai.model_provider import ModelProvider
+from metrics import (
+    LLM_FIRST_TOKEN_SECONDS,
+    LLM_QUEUE_SECONDS,
+    LLM_REQUEST_SECONDS,
+    LLM_REQUESTS,
+    LLM_TOKENS,
+    span
+)
+
+load_dotenv()
+
+# Connection and concurrency settings for the model API
+LLM_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+LLM_BASE_URL = os.getenv("OPENAI_BASE_URL")  # Point at a local OpenAI-compatible server for testing
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "16"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+
+class LLMClient(ModelProvider):
+    """Shared async OpenAI client on a pooled, keep-alive HTTP connection pool"""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: str = LLM_MODEL,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.model = model
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        # One pooled HTTP client shared by every request on this worker
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+            transport=transport
+        )
+        self.client = AsyncOpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            base_url=base_url or LLM_BASE_URL,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=self.http_client
+        )
+        # Caps the number of in-flight model calls
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Calls holding a slot, and calls queued for one
+        self.in_flight = 0
+        self.waiting = 0
+
+    async def _acquire_slot(self):
+        """Wait for a concurrency slot, recording how long that took"""
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            with span("llm_queue"):
+                await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        LLM_QUEUE_SECONDS.observe(time.perf_counter() - start)
+        self.in_flight += 1
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def create_chat_completion(self, messages: List[Dict], timeout: Optional[float] = None, **kwargs):
+        """
+        Run a chat completion under the concurrency cap
+
+        Args:
+            messages: Chat messages to send to the model
+            timeout: Per-call timeout in seconds, defaults to the client timeout
+            **kwargs: Extra completion parameters (temperature, max_tokens, ...)
+
+        Returns:
+            The chat completion returned by the API
+        """
+        await self._acquire_slot()
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            with span("llm_call"):
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    timeout=timeout or self.timeout,
+                    **kwargs
+                )
+            outcome = "ok"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            self._release_slot()
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, mode="completion")
+            LLM_REQUESTS.inc(mode="completion", outcome=outcome)
+        if response.usage is not None:
+            LLM_TOKENS.observe(response.usage.prompt_tokens, type="prompt")
+            LLM_TOKENS.observe(response.usage.completion_tokens, type="completion")
+        return response
+
+    async def stream_chat_completion(self, messages: List[Dict], timeout: Optional[float] = None, **kwargs) -> AsyncIterator[str]:
+        """
+        Stream a chat completion under the concurrency cap
+
+        Args:
+            messages: Chat messages to send to the model
+            timeout: Per-call timeout in seconds, defaults to the client timeout
+            **kwargs: Extra completion parameters (temperature, max_tokens, ...)
+
+        Yields:
+            str: Content deltas in the order the model produces them
+        """
+        await self._acquire_slot()
+        start = time.perf_counter()
+        outcome = "error"
+        chunks = 0
+        try:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                timeout=timeout or self.timeout,
+                stream=True,
+                **kwargs
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if chunks == 0:
+                        LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                    chunks += 1
+                    yield chunk.choices[0].delta.content
+            outcome = "ok"
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "cancelled"
+            raise
+        finally:
+            self._release_slot()
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, mode="stream")
+            LLM_REQUESTS.inc(mode="stream", outcome=outcome)
+            # Streamed content arrives about one token per chunk
+            LLM_TOKENS.observe(chunks, type="completion")
+
+    async def complete(self, messages: List[Dict], timeout: Optional[float] = None, **kwargs) -> str:
+        """Generate a reply's text with a chat completion"""
+        response = await self.create_chat_completion(messages, timeout, **kwargs)
+        # Refusals and tool calls come back without content
+        return response.choices[0].message.content or ""
+
+    async def stream(self, messages: List[Dict], timeout: Optional[float] = None, **kwargs) -> AsyncIterator[str]:
+        """Stream a reply's text with a chat completion"""
+        async for delta in self.stream_chat_completion(messages, timeout, **kwargs):
+            yield delta
+
+    async def aclose(self):
+        """Close the underlying connection pool"""
+        await self.http_client.aclose()
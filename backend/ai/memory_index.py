@@ -0,0 +1,127 @@
+from typing import Dict, List, Optional
+import math
+import re
+import zlib
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+class Embedder:
+    """Turns texts into L2-normalised vectors; subclass to plug in another model"""
+    dim: int = 0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of texts
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            np.ndarray: float32 matrix of shape (len(texts), dim) with unit-length rows
+        """
+        raise NotImplementedError
+
+class HashingEmbedder(Embedder):
+    """Offline embedder hashing word unigrams and bigrams into a fixed number of buckets"""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: Dict[int, float] = {}
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                # The top hash bit picks the sign so collisions tend to cancel out
+                bucket = (h & 0x7FFFFFFF) % self.dim
+                sign = -1.0 if h & 0x80000000 else 1.0
+                counts[bucket] = counts.get(bucket, 0.0) + sign
+            for bucket, count in counts.items():
+                # Sublinear term frequency
+                vectors[row, bucket] = math.copysign(1.0 + math.log(abs(count)), count) if count else 0.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _features(self, text: str) -> List[str]:
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+class MemoryIndex:
+    """Per-NPC memory store keeping one embedding per memory in a contiguous matrix"""
+
+    def __init__(self, embedder: Embedder, initial_capacity: int = 64, max_items: Optional[int] = None):
+        self.embedder = embedder
+        self.max_items = max_items
+        if max_items is not None:
+            initial_capacity = min(initial_capacity, max_items)
+        self._vectors = np.zeros((initial_capacity, embedder.dim), dtype=np.float32)
+        # Insertion sequence per row, used for recency and ring-buffer order
+        self._sequence = np.zeros(initial_capacity, dtype=np.int64)
+        self._items: List[Dict] = []
+        self._added = 0
+
+    def add(self, text: str, item: Dict):
+        """Embed a memory and add it to the index, replacing the oldest one when full"""
+        count = len(self._items)
+        if self.max_items is not None and count >= self.max_items:
+            # Full: overwrite the oldest row in place
+            row = self._added % self.max_items
+            self._items[row] = item
+        else:
+            if count == self._vectors.shape[0]:
+                # Grow geometrically so appends stay amortised O(1)
+                capacity = max(1, count) * 2
+                if self.max_items is not None:
+                    capacity = min(capacity, self.max_items)
+                grown = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+                grown[:count] = self._vectors[:count]
+                self._vectors = grown
+                sequence = np.zeros(capacity, dtype=np.int64)
+                sequence[:count] = self._sequence[:count]
+                self._sequence = sequence
+            row = count
+            self._items.append(item)
+        self._vectors[row] = self.embedder.embed([text])[0]
+        self._sequence[row] = self._added
+        self._added += 1
+
+    def search(self, query: str, k: int = 3) -> List[Dict]:
+        """
+        Find the memories most similar to a query
+
+        Args:
+            query: Text to compare memories against
+            k: Maximum number of memories to return
+
+        Returns:
+            List of memory items, most similar first
+        """
+        count = len(self._items)
+        if count == 0 or k <= 0:
+            return []
+        query_vector = self.embedder.embed([query])[0]
+        # Rows are unit length, so the dot product is the cosine similarity
+        scores = self._vectors[:count] @ query_vector
+        if count > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(count)
+        # Most similar first; newer memories win ties
+        order = sorted(top.tolist(), key=lambda i: (-scores[i], -self._sequence[i]))
+        return [self._items[i] for i in order]
+
+    @property
+    def revision(self) -> int:
+        """Changes with every added memory"""
+        return self._added
+
+    def items(self) -> List[Dict]:
+        """All memories in insertion order"""
+        order = np.argsort(self._sequence[:len(self._items)], kind="stable")
+        return [self._items[i] for i in order.tolist()]
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,65 @@
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+from abc import ABC, abstractmethod
+import asyncio
+import os
+
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openai")  # "openai" (any OpenAI-compatible server) or "stub"
+STUB_MODEL_LATENCY_SECONDS = float(os.getenv("STUB_MODEL_LATENCY_SECONDS", "0"))
+
+class ModelProvider(ABC):
+    """Source of NPC dialogue completions; swap implementations to use a local model or a stub"""
+
+    # Calls holding and waiting for a concurrency slot, for providers that limit them
+    in_flight = 0
+    waiting = 0
+
+    @abstractmethod
+    async def complete(self, messages: List[Dict], timeout: Optional[float] = None, **kwargs) -> str:
+        """
+        Generate a reply to chat messages
+
+        Args:
+            messages: Chat messages to send to the model
+            timeout: Per-call timeout in seconds
+            **kwargs: Completion parameters (temperature, max_tokens, ...)
+
+        Returns:
+            str: The reply text
+        """
+
+    async def stream(self, messages: List[Dict], timeout: Optional[float] = None, **kwargs) -> AsyncIterator[str]:
+        """Generate a reply as text deltas; by default the whole reply arrives at once"""
+        yield await self.complete(messages, timeout, **kwargs)
+
+    async def aclose(self):
+        """Release any connections held by the provider"""
+
+class StubProvider(ModelProvider):
+    """Canned replies after a fixed delay, for local development and load tests without a model"""
+
+    DEFAULT_REPLIES = (
+        "Hm. What do you want?",
+        "Not now, traveler. Come back later.",
+        "Strange days in this village."
+    )
+
+    def __init__(self, replies: Sequence[str] = DEFAULT_REPLIES, latency: float = STUB_MODEL_LATENCY_SECONDS):
+        self.replies = tuple(replies)
+        self.latency = latency
+        self.calls = 0
+
+    async def complete(self, messages: List[Dict], timeout: Optional[float] = None, **kwargs) -> str:
+        reply = self.replies[self.calls % len(self.replies)]
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return reply
+
+def create_provider(name: str = MODEL_PROVIDER) -> ModelProvider:
+    """Build the configured model provider"""
+    if name == "openai":
+        from ai.llm_client import LLMClient
+        return LLMClient()
+    if name == "stub":
+        return StubProvider()
+    raise ValueError(f"Unknown model provider: {name}")
@@ -1,27 +1,82 @@
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+from collections import deque
+import asyncio
 import os
-from openai import OpenAI
-from typing import Dict, List, Optional
-from dotenv import load_dotenv
-import httpx
+import time
 from game.npc_manager import NPCManager, NPC
+from ai.model_provider import ModelProvider, create_provider
+from ai.memory_index import Embedder, HashingEmbedder, MemoryIndex
+from ai.response_cache import ResponseCache
+from ai.prompt_builder import PromptBuilder
+from ai.prefetcher import prefetch_key
+from game.retention import NPC_DIALOGUE_MEMORY_LIMIT
+from game.work_queue import run_now
+from metrics import REGISTRY, span
 
-load_dotenv()
+INTERACTION_DEADLINE_SECONDS = float(os.getenv("INTERACTION_DEADLINE_SECONDS", "6"))  # 0 waits for the model indefinitely
+HEDGE_AFTER_SECONDS = float(os.getenv("HEDGE_AFTER_SECONDS", "0"))  # Send a second model request after this long; 0 disables
+
+FALLBACKS = REGISTRY.counter("rere_dialogue_fallbacks_total", "Interactions answered by rule-based dialogue", ("reason",))
+HEDGES = REGISTRY.counter("rere_dialogue_hedges_total", "Hedged second model requests", ("winner",))
 
 class NPCHandler:
-    def __init__(self):
-        # Create a custom HTTP client without proxies
-        http_client = httpx.Client()
-        # Initialize OpenAI client with the custom HTTP client
-        self.client = OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            http_client=http_client
-        )
+    COMPLETION_PARAMS = {
+        "temperature": 0.8,  # Slightly higher temperature for more varied responses
+        "max_tokens": 50,    # Limit response length
+        "presence_penalty": 0.5,  # Encourage more focused responses
+        "frequency_penalty": 0.5  # Discourage repetition
+    }
+
+    MEMORY_TOP_K = 8  # Memory candidates retrieved per interaction; the prompt budget decides how many are used
+
+    def __init__(
+        self,
+        model_provider: Optional[ModelProvider] = None,
+        npc_manager: Optional[NPCManager] = None,
+        embedder: Optional[Embedder] = None,
+        response_cache: Optional[ResponseCache] = None,
+        prompt_builder: Optional[PromptBuilder] = None,
+        deadline: float = INTERACTION_DEADLINE_SECONDS,
+        hedge_after: float = HEDGE_AFTER_SECONDS
+    ):
+        # Shared model provider, e.g. the pooled OpenAI client
+        self.model_provider = model_provider or create_provider()
+        # Latency budget for generated dialogue before the rule-based reply is used
+        self.deadline = deadline
+        self.hedge_after = hedge_after
         # Simple in-memory storage for NPC memories
-        self.npc_memories: Dict[str, List[Dict]] = {}
-        # Initialize NPC manager to get NPC information
-        self.npc_manager = NPCManager()
+        self.npc_memories: Dict[str, Deque[Dict]] = {}
+        # Id of the newest memory; ids increase across NPCs so stores can take only the new ones
+        self.last_memory_id = 0
+        # Per-NPC vector index over the same memories
+        self.embedder = embedder or HashingEmbedder()
+        self.memory_indexes: Dict[str, MemoryIndex] = {}
+        # ((index, query, index revision), memories) of the latest search
+        self._last_retrieval: Optional[Tuple[Tuple, List[str]]] = None
+        # NPC manager to get NPC information, shared with the owning session
+        self.npc_manager = npc_manager or NPCManager()
+        # Optional response cache, usually shared by every session
+        self.response_cache = response_cache
+        # Precompiled per-NPC prompts, shareable across sessions
+        self.prompt_builder = prompt_builder or PromptBuilder(self.npc_manager.registry)
+        # Speculatively generated openers: prefetch key -> (expires_at, task)
+        self.prefetched: Dict[Tuple, Tuple[float, asyncio.Task]] = {}
+        self.prefetch_location: Optional[str] = None
+        self.prefetch_loop: Optional[int] = None
+        self.prefetch_budget = 0
+        self.prefetch_hits = 0
+        # Runs memory indexing after the reply; the owning session defers it to its work queue
+        # and stores the result with the rest of its state
+        self.defer = run_now
 
-    def get_npc_response(self, npc_id: str, player_input: str, context: Dict) -> str:
+    async def get_npc_response(
+        self,
+        npc_id: str,
+        player_input: str,
+        context: Dict,
+        timeout: Optional[float] = None,
+        fallback: Optional[str] = None
+    ) -> str:
         """
         Generate an NPC response using OpenAI, considering their memory and context
         
@@ -29,117 +84,390 @@ class NPCHandler:
             npc_id: Unique identifier for the NPC
             player_input: Player's message to the NPC
             context: Current game context including previous interactions
+            timeout: Optional per-call timeout in seconds
+            fallback: Reply to use if the model misses the deadline, defaults to the rule-based one
             
         Returns:
             str: Generated response from the NPC
         """
+        content, _ = await self.get_npc_reply(npc_id, player_input, context, timeout, fallback)
+        return content
+
+    async def get_npc_reply(
+        self,
+        npc_id: str,
+        player_input: str,
+        context: Dict,
+        timeout: Optional[float] = None,
+        fallback: Optional[str] = None
+    ) -> Tuple[str, str]:
+        """
+        Like get_npc_response, but also says where the reply came from
+
+        Returns:
+            Tuple[str, str]: The reply, and its source: "model", "hedge",
+            "prefetch", "cache", "fallback" or "unknown_npc"
+        """
         # Get NPC information
         npc = self.npc_manager.get_npc(npc_id)
         if not npc:
-            return "I'm sorry, I don't know who I am."
-            
-        # Get relevant memories from in-memory storage
-        memories = self._get_relevant_memories(npc_id, player_input)
-        
-        # Construct the prompt with context and memories
-        prompt = self._construct_prompt(npc, player_input, context, memories)
-        
-        # Generate response using OpenAI
-        response = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",  # Using GPT-3.5-turbo for cost efficiency
-            messages=[
-                {"role": "system", "content": f"""You are {npc.name}, a character in a time loop game.
-You are currently in the {npc.location.replace('_', ' ')}.
-Your personality traits are: {', '.join(npc.personality['traits'])}.
-Your goals are: {', '.join(npc.personality['goals'])}.
-Your fears are: {', '.join(npc.personality['fears'])}.
-You know these secrets: {', '.join(npc.personality['secrets'])}."""},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.8,  # Slightly higher temperature for more varied responses
-            max_tokens=50,    # Limit response length
-            presence_penalty=0.5,  # Encourage more focused responses
-            frequency_penalty=0.5  # Discourage repetition
+            return "I'm sorry, I don't know who I am.", "unknown_npc"
+
+        deadline_at = self._deadline_at()
+        content = await self._take_prefetch(npc_id, player_input, context, self._remaining(deadline_at))
+        source = "prefetch"
+        if content is None:
+            cache_key = self._cache_key(npc, player_input, context)
+            with span("cache_lookup"):
+                content = self.response_cache.get(cache_key) if cache_key else None
+            source = "cache"
+            if content is None:
+                # Generate response using the model, within the deadline
+                content, source = await self._generate_by_deadline(npc, player_input, context, timeout, deadline_at)
+                if not content:
+                    FALLBACKS.inc(reason=source if content is None else "empty")
+                    content = fallback if fallback is not None else self._rule_response(npc, player_input, context)
+                    source = "fallback"
+                elif cache_key:
+                    self.response_cache.put(cache_key, content)
+
+        # Index the interaction in memory once the reply is on its way
+        await self.record_response(npc_id, player_input, content, context)
+
+        return content, source
+
+    async def stream_npc_response(
+        self,
+        npc_id: str,
+        player_input: str,
+        context: Dict,
+        timeout: Optional[float] = None,
+        fallback: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream an NPC response token by token
+
+        The memory is not stored here; call record_response with the full text
+        once the stream has finished. The deadline applies to the first token;
+        if the model misses it, the fallback reply is sent instead.
+
+        Args:
+            npc_id: Unique identifier for the NPC
+            player_input: Player's message to the NPC
+            context: Current game context including previous interactions
+            timeout: Optional per-call timeout in seconds
+            fallback: Reply to use if the model misses the deadline, defaults to the rule-based one
+
+        Yields:
+            str: Response text deltas as the model produces them
+        """
+        npc = self.npc_manager.get_npc(npc_id)
+        if not npc:
+            yield "I'm sorry, I don't know who I am."
+            return
+
+        deadline_at = self._deadline_at()
+        cached = await self._take_prefetch(npc_id, player_input, context, self._remaining(deadline_at))
+        cache_key = self._cache_key(npc, player_input, context)
+        if cached is None and cache_key:
+            cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        stream = self.model_provider.stream(
+            self._build_messages(npc, player_input, context),
+            timeout,
+            **self.COMPLETION_PARAMS
         )
-        
-        # Store the interaction in memory
-        self._store_memory(npc_id, player_input, response.choices[0].message.content, context)
-        
-        return response.choices[0].message.content
+        try:
+            first = await asyncio.wait_for(stream.__anext__(), self._remaining(deadline_at))
+        except StopAsyncIteration:
+            first = ""
+        except Exception as e:
+            if deadline_at is None:
+                raise
+            await stream.aclose()
+            FALLBACKS.inc(reason="deadline" if isinstance(e, asyncio.TimeoutError) else "error")
+            yield fallback if fallback is not None else self._rule_response(npc, player_input, context)
+            return
+
+        chunks = [first]
+        yield first
+        async for delta in stream:
+            chunks.append(delta)
+            yield delta
+        if cache_key:
+            self.response_cache.put(cache_key, "".join(chunks))
+
+    async def generate_response(self, npc_id: str, player_input: str, context: Dict, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Generate a response without touching memory, e.g. to prefetch it
+
+        The result is also added to the response cache.
+
+        Returns:
+            Optional[str]: Generated response, or None for an unknown NPC
+        """
+        npc = self.npc_manager.get_npc(npc_id)
+        if not npc:
+            return None
+        content = await self._generate(npc, player_input, context, timeout)
+        cache_key = self._cache_key(npc, player_input, context)
+        if cache_key:
+            self.response_cache.put(cache_key, content)
+        return content
+
+    def has_prefetch(self, npc_id: str, player_input: str, context: Dict) -> bool:
+        """Whether a live prefetch exists for this interaction"""
+        entry = self.prefetched.get(prefetch_key(npc_id, player_input, context))
+        return entry is not None and entry[0] > time.monotonic()
+
+    def add_prefetch(self, npc_id: str, player_input: str, context: Dict, task: asyncio.Task, expires_at: float):
+        """Register a background generation for this interaction"""
+        # Mark failures as retrieved; a failed prefetch just falls back to a normal call
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        key = prefetch_key(npc_id, player_input, context)
+        previous = self.prefetched.pop(key, None)
+        if previous is not None:
+            previous[1].cancel()
+        self.prefetched[key] = (expires_at, task)
+
+    def cancel_prefetches(self) -> int:
+        """Drop every prefetch, cancelling those still running; returns how many were cancelled"""
+        cancelled = 0
+        for _, task in self.prefetched.values():
+            if not task.done():
+                task.cancel()
+                cancelled += 1
+        self.prefetched.clear()
+        return cancelled
+
+    async def _take_prefetch(self, npc_id: str, player_input: str, context: Dict, timeout: Optional[float] = None) -> Optional[str]:
+        """Claim a prefetched response, waiting up to timeout for it if it is still being generated"""
+        if not self.prefetched:
+            return None
+        entry = self.prefetched.pop(prefetch_key(npc_id, player_input, context), None)
+        if entry is None:
+            return None
+        expires_at, task = entry
+        if expires_at <= time.monotonic():
+            task.cancel()
+            return None
+        try:
+            # Shielded so a cancelled request doesn't throw away a nearly finished generation
+            content = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            return None
+        except Exception:
+            return None
+        if not content:
+            return None
+        self.prefetch_hits += 1
+        return content
+
+    async def _generate(self, npc: NPC, player_input: str, context: Dict, timeout: Optional[float]) -> str:
+        """Call the model for one response"""
+        return await self.model_provider.complete(
+            self._build_messages(npc, player_input, context),
+            timeout,
+            **self.COMPLETION_PARAMS
+        )
+
+    async def _generate_by_deadline(
+        self,
+        npc: NPC,
+        player_input: str,
+        context: Dict,
+        timeout: Optional[float],
+        deadline_at: Optional[float]
+    ) -> Tuple[Optional[str], str]:
+        """
+        Call the model, hedging with a second request if configured, and give up at the deadline
+
+        Returns:
+            Tuple: (reply, "model" or "hedge") on success, or (None, "deadline" or "error")
+        """
+        messages = self._build_messages(npc, player_input, context)
+        if deadline_at is None and not self.hedge_after:
+            # No latency budget; errors propagate to the caller
+            content = await self.model_provider.complete(messages, timeout, **self.COMPLETION_PARAMS)
+            return content, "model"
+
+        loop = asyncio.get_running_loop()
+        primary = asyncio.ensure_future(self.model_provider.complete(messages, timeout, **self.COMPLETION_PARAMS))
+        pending = {primary}
+        hedge_at = loop.time() + self.hedge_after if self.hedge_after else None
+        failure = "deadline"
+        try:
+            while pending:
+                wake_times = [at for at in (deadline_at, hedge_at) if at is not None]
+                wait = max(0.0, min(wake_times) - loop.time()) if wake_times else None
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if hedge_at is None and self.hedge_after:
+                            HEDGES.inc(winner="primary" if task is primary else "hedge")
+                        return task.result(), "model" if task is primary else "hedge"
+                    failure = "error"
+                if deadline_at is not None and loop.time() >= deadline_at:
+                    failure = "deadline"
+                    break
+                if hedge_at is not None and loop.time() >= hedge_at and pending:
+                    # The first request is slow; race a second one against it
+                    hedge_at = None
+                    pending.add(asyncio.ensure_future(self.model_provider.complete(messages, timeout, **self.COMPLETION_PARAMS)))
+        finally:
+            for task in pending:
+                task.cancel()
+        return None, failure
+
+    def _deadline_at(self) -> Optional[float]:
+        """Event loop time by which an interaction's reply is due, or None without a deadline"""
+        if not self.deadline:
+            return None
+        return asyncio.get_running_loop().time() + self.deadline
+
+    @staticmethod
+    def _remaining(deadline_at: Optional[float]) -> Optional[float]:
+        if deadline_at is None:
+            return None
+        return max(0.0, deadline_at - asyncio.get_running_loop().time())
+
+    def _rule_response(self, npc: NPC, player_input: str, context: Dict) -> str:
+        """Rule-based reply for when no generated one is available"""
+        current_hour = int(str(context.get("time", "06:00")).split(":")[0])
+        return self.npc_manager.rule_response(npc.id, player_input, current_hour)
+
+    async def record_response(self, npc_id: str, player_input: str, npc_response: str, context: Dict):
+        """Store a completed interaction in the NPC's memory, in the background when the session defers work"""
+        def store():
+            with span("memory_store"):
+                self._store_memory(npc_id, player_input, npc_response, context)
+
+        await self.defer("memory_index", store)
+
+    def _cache_key(self, npc: NPC, player_input: str, context: Dict) -> Optional[str]:
+        """Response cache key for an interaction, or None when caching is off"""
+        if self.response_cache is None:
+            return None
+        world = self.npc_manager.world
+        return ResponseCache.make_key(
+            npc.id, player_input, npc.state.trust_level, context, npc.location, f"{world.id}@{world.content_hash}",
+            self._get_relevant_memories(npc.id, player_input)
+        )
+
+    def _build_messages(self, npc: NPC, player_input: str, context: Dict) -> List[Dict]:
+        """Build the chat messages for an interaction"""
+        # Get relevant memories from in-memory storage
+        memories = self._get_relevant_memories(npc.id, player_input)
+
+        # Fit them into the NPC's precompiled prompt within the token budget
+        with span("prompt_build"):
+            return self.prompt_builder.build_messages(
+                npc, player_input, context, memories, context.get("recent_events")
+            )
 
     def _get_relevant_memories(self, npc_id: str, query: str) -> List[str]:
         """
-        Get relevant memories from in-memory storage
+        Get the memories most similar to the current interaction
         
         Args:
             npc_id: NPC identifier
             query: Current interaction to find relevant memories for
             
         Returns:
-            List of relevant memory texts
+            List of relevant memory texts, most relevant first
         """
-        if npc_id not in self.npc_memories:
+        index = self.memory_indexes.get(npc_id)
+        if index is None:
             return []
-        
-        # For MVP, just return the last 3 memories
-        memories = self.npc_memories[npc_id][-3:]
-        return [memory["content"] for memory in memories]
+        # The cache key and the prompt both need them; search once per index revision
+        key = (index, query, index.revision)
+        if self._last_retrieval is not None and self._last_retrieval[0] == key:
+            return self._last_retrieval[1]
+        with span("memory_search"):
+            memories = [memory["content"] for memory in index.search(query, self.MEMORY_TOP_K)]
+        self._last_retrieval = (key, memories)
+        return memories
+
+    def export_memories(self) -> Dict[str, List[Dict]]:
+        """Every NPC's dialogue memories, oldest first, in a serializable form"""
+        return {npc_id: list(memories) for npc_id, memories in self.npc_memories.items()}
+
+    def import_memories(self, data: Dict[str, List[Dict]]):
+        """Replace the dialogue memories with ones from export_memories(), re-indexing only NPCs whose memories changed"""
+        for npc_id in list(self.npc_memories):
+            if npc_id not in data:
+                del self.npc_memories[npc_id]
+                del self.memory_indexes[npc_id]
+        for npc_id, memories in data.items():
+            if list(self.npc_memories.get(npc_id, ())) == memories:
+                continue
+            self._new_memory(npc_id)
+            for memory in memories:
+                self._index_memory(npc_id, memory)
+        self.last_memory_id = max(
+            (memories[-1].get("id", 0) for memories in self.npc_memories.values() if memories), default=0
+        )
+
+    def memories_after(self, memory_id: int) -> List[List]:
+        """Memories newer than an id as [id, npc_id, memory], oldest first"""
+        entries = []
+        for npc_id, memories in self.npc_memories.items():
+            for memory in reversed(memories):
+                if memory.get("id", 0) <= memory_id:
+                    break
+                entries.append([memory["id"], npc_id, memory])
+        entries.sort(key=lambda entry: entry[0])
+        return entries
+
+    def oldest_memory_id(self, npc_id: str) -> int:
+        """Id of the oldest memory still kept for an NPC; older ones have been dropped"""
+        memories = self.npc_memories.get(npc_id)
+        return memories[0].get("id", 0) if memories else 0
+
+    def extend_memories(self, entries: List[List]):
+        """Append entries from memories_after() that are newer than every memory held"""
+        for memory_id, npc_id, memory in entries:
+            if memory_id <= self.last_memory_id:
+                continue
+            if npc_id not in self.npc_memories:
+                self._new_memory(npc_id)
+            self._index_memory(npc_id, memory)
+            self.last_memory_id = memory_id
+
+    def discard_memories_after(self, memory_id: int):
+        """Drop the memories newer than an id, re-indexing the NPCs that had them"""
+        if self.last_memory_id <= memory_id:
+            return
+        self.import_memories({
+            npc_id: [memory for memory in memories if memory.get("id", 0) <= memory_id]
+            for npc_id, memories in self.npc_memories.items()
+        })
+        self.last_memory_id = memory_id
 
     def _store_memory(self, npc_id: str, player_input: str, npc_response: str, context: Dict):
         """Store an interaction in memory"""
         if npc_id not in self.npc_memories:
-            self.npc_memories[npc_id] = []
-            
-        self.npc_memories[npc_id].append({
+            self._new_memory(npc_id)
+
+        self.last_memory_id += 1
+        memory = {
+            "id": self.last_memory_id,
             "player_input": player_input,
             "content": npc_response,
             "timestamp": context.get('time', 'unknown')
-        })
+        }
+        self._index_memory(npc_id, memory)
 
-    def _construct_prompt(self, npc: NPC, player_input: str, context: Dict, memories: List[str]) -> str:
-        """
-        Construct the prompt for the AI model
-        
-        Args:
-            npc: The NPC object
-            player_input: Player's message
-            context: Current game context
-            memories: Relevant memories from previous interactions
-            
-        Returns:
-            str: Constructed prompt
-        """
-        memory_context = "\n".join([f"- {memory}" for memory in memories])
-        
-        return f"""
-        You are {npc.name}, a character in a time loop game. You are NOT the player. You are an NPC that the player interacts with.
-
-        Current situation:
-        - Loop #{context.get('current_loop', 1)}
-        - Time: {context.get('time', 'morning')}
-        - You're in the {npc.location.replace('_', ' ')}
-        - The player is in the {context.get('location', 'unknown').replace('_', ' ')}
-        
-        Your personality:
-        - Traits: {', '.join(npc.personality['traits'])}
-        - Goals: {', '.join(npc.personality['goals'])}
-        - Fears: {', '.join(npc.personality['fears'])}
-        - Secrets: {', '.join(npc.personality['secrets'])}
-        
-        Recent interactions:
-        {memory_context}
-        
-        The player says to you: "{player_input}"
-        
-        Respond as {npc.name} would respond. Remember:
-        - You are the NPC, not the player
-        - Keep responses brief and natural
-        - Stay in character based on your personality
-        - Don't break the fourth wall or acknowledge being an AI
-        - Don't explain your thoughts or feelings unless asked
-        - Keep responses under 20 words when possible
-        - Only respond with what {npc.name} would say, nothing else
-        - Do not include the player's words in your response
-        - Do not use phrases like "Player:" or "NPC:" in your response
-        - Do not quote or repeat what the player said
-        """ 
\ No newline at end of file
+    def _new_memory(self, npc_id: str):
+        self.npc_memories[npc_id] = deque(maxlen=NPC_DIALOGUE_MEMORY_LIMIT)
+        self.memory_indexes[npc_id] = MemoryIndex(self.embedder, max_items=NPC_DIALOGUE_MEMORY_LIMIT)
+
+    def _index_memory(self, npc_id: str, memory: Dict):
+        self.npc_memories[npc_id].append(memory)
+        # Index the exchange as a whole so either side of it can be recalled
+        self.memory_indexes[npc_id].add(f"{memory['player_input']} {memory['content']}", memory)
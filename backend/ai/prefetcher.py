@@ -0,0 +1,76 @@
+from typing import Dict, Iterable, Optional, Tuple
+import asyncio
+import os
+import time
+from ai.response_cache import normalize_input
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "false").lower() == "true"
+PREFETCH_MAX_WORKERS = int(os.getenv("PREFETCH_MAX_WORKERS", "4"))  # Prefetch generations in flight across all sessions
+PREFETCH_SESSION_BUDGET = int(os.getenv("PREFETCH_SESSION_BUDGET", "12"))  # Prefetches per session per loop
+PREFETCH_TTL_SECONDS = float(os.getenv("PREFETCH_TTL_SECONDS", "120"))
+PREFETCH_OPENERS = tuple(
+    opener.strip() for opener in os.getenv("PREFETCH_OPENERS", "greet").split(",") if opener.strip()
+)
+
+class Prefetcher:
+    """Generates likely opening lines in the background for NPCs the player has just looked up"""
+
+    def __init__(
+        self,
+        max_workers: int = PREFETCH_MAX_WORKERS,
+        session_budget: int = PREFETCH_SESSION_BUDGET,
+        ttl_seconds: float = PREFETCH_TTL_SECONDS,
+        openers: Iterable[str] = PREFETCH_OPENERS
+    ):
+        self.session_budget = session_budget
+        self.ttl_seconds = ttl_seconds
+        self.openers = tuple(openers)
+        # Prefetching must never crowd out requests a player is waiting on
+        self._workers = asyncio.Semaphore(max_workers)
+        self.scheduled = 0
+        self.cancelled = 0
+
+    def on_location(self, handler, location_id: str, contexts: Dict[str, Dict]):
+        """
+        Start prefetching openers for the NPCs at a location
+
+        Looking up a different location than last time means the player has
+        moved on, so anything still pending for the old one is cancelled.
+
+        Args:
+            handler: The session's NPCHandler, which holds the prefetched responses
+            location_id: Location the player looked up
+            contexts: Game context for each NPC at the location, by NPC id
+        """
+        if handler.prefetch_location != location_id:
+            self.cancelled += handler.cancel_prefetches()
+            handler.prefetch_location = location_id
+
+        expires_at = time.monotonic() + self.ttl_seconds
+        for npc_id, context in contexts.items():
+            loop = context.get("current_loop", 1)
+            if handler.prefetch_loop != loop:
+                # The budget refills every loop
+                handler.prefetch_loop = loop
+                handler.prefetch_budget = self.session_budget
+            for opener in self.openers:
+                if handler.prefetch_budget <= 0:
+                    return
+                if handler.has_prefetch(npc_id, opener, context):
+                    continue
+                task = asyncio.ensure_future(self._generate(handler, npc_id, opener, context))
+                handler.add_prefetch(npc_id, opener, context, task, expires_at)
+                handler.prefetch_budget -= 1
+                self.scheduled += 1
+
+    async def _generate(self, handler, npc_id: str, opener: str, context: Dict) -> Optional[str]:
+        async with self._workers:
+            return await handler.generate_response(npc_id, opener, context)
+
+    def stats(self) -> Dict:
+        """Counters for scheduled and cancelled prefetches"""
+        return {"scheduled": self.scheduled, "cancelled": self.cancelled}
+
+def prefetch_key(npc_id: str, player_input: str, context: Dict) -> Tuple:
+    """Identity of a prefetched response: valid only for the same input at the same moment of the same loop"""
+    return (npc_id, normalize_input(player_input), context.get("current_loop", 1), context.get("time"))
@@ -0,0 +1,105 @@
+from typing import Dict, List, Optional
+import math
+import os
+from game.npc_registry import NPCDefinition, NPCRegistry
+
+PROMPT_INPUT_TOKEN_BUDGET = int(os.getenv("PROMPT_INPUT_TOKEN_BUDGET", "700"))
+CHARS_PER_TOKEN = 4  # Rough average for English text with OpenAI tokenizers
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token count estimate, good enough for budgeting"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+class PromptTemplate:
+    """An NPC's static system prompt, compiled once from its definition"""
+
+    def __init__(self, definition: NPCDefinition):
+        personality = definition.personality
+        # Everything here is identical on every call for this NPC, so it forms a
+        # stable prefix that provider-side prompt caching can reuse
+        self.system_prompt = f"""You are {definition.name}, a character in a time loop game. You are NOT the player. You are an NPC that the player interacts with.
+
+Your personality:
+- Traits: {', '.join(personality['traits'])}
+- Goals: {', '.join(personality['goals'])}
+- Fears: {', '.join(personality['fears'])}
+- Secrets: {', '.join(personality['secrets'])}
+
+Respond as {definition.name} would respond. Remember:
+- You are the NPC, not the player
+- Keep responses brief and natural
+- Stay in character based on your personality
+- Don't break the fourth wall or acknowledge being an AI
+- Don't explain your thoughts or feelings unless asked
+- Keep responses under 20 words when possible
+- Only respond with what {definition.name} would say, nothing else
+- Do not include the player's words in your response
+- Do not use phrases like "Player:" or "NPC:" in your response
+- Do not quote or repeat what the player said"""
+        self.system_tokens = estimate_tokens(self.system_prompt)
+
+class PromptBuilder:
+    """Assembles chat messages from precompiled NPC templates within an input token budget"""
+
+    def __init__(self, registry: NPCRegistry, input_token_budget: int = PROMPT_INPUT_TOKEN_BUDGET):
+        self.input_token_budget = input_token_budget
+        self.templates: Dict[str, PromptTemplate] = {
+            definition.id: PromptTemplate(definition) for definition in registry.definitions()
+        }
+
+    def build_messages(
+        self,
+        npc,
+        player_input: str,
+        context: Dict,
+        memories: List[str],
+        events: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """
+        Build the chat messages for an interaction
+
+        Args:
+            npc: The NPC object
+            player_input: Player's message
+            context: Current game context
+            memories: Relevant memories, most relevant first
+            events: Recent world events, most recent first
+
+        Returns:
+            List[Dict]: System and user messages
+        """
+        template = self.templates[npc.id]
+        situation = f"""Current situation:
+- Loop #{context.get('current_loop', 1)}
+- Time: {context.get('time', 'morning')}
+- You're in the {npc.location.replace('_', ' ')}
+- The player is in the {context.get('location', 'unknown').replace('_', ' ')}"""
+        request = f'The player says to you: "{player_input}"'
+
+        remaining = self.input_token_budget - template.system_tokens - estimate_tokens(situation) - estimate_tokens(request)
+        memory_lines, remaining = self._fit_lines(memories, remaining)
+        event_lines, remaining = self._fit_lines(events or [], remaining)
+
+        sections = [situation]
+        if memory_lines:
+            sections.append("Recent interactions:\n" + "\n".join(memory_lines))
+        if event_lines:
+            sections.append("Recent events:\n" + "\n".join(event_lines))
+        sections.append(request)
+
+        return [
+            {"role": "system", "content": template.system_prompt},
+            {"role": "user", "content": "\n\n".join(sections)}
+        ]
+
+    def _fit_lines(self, items: List[str], remaining: int):
+        """Take items in order as bullet lines while they fit the remaining budget"""
+        lines = []
+        for item in items:
+            line = f"- {item}"
+            cost = estimate_tokens(line) + 1  # Newline
+            if cost > remaining:
+                continue
+            lines.append(line)
+            remaining -= cost
+        return lines, remaining
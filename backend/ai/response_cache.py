@@ -0,0 +1,136 @@
+from typing import Dict, List, Optional, Sequence
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import random
+import re
+import time
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "900"))
+RESPONSE_CACHE_VARIANTS = int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))
+TRUST_BAND_SIZE = 25  # Trust levels 0-24, 25-49, ... share cached responses
+
+_PUNCTUATION = re.compile(r"[^\w\s']")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_input(player_input: str) -> str:
+    """Canonical form of player input: lowercase, no punctuation, single spaces"""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", player_input.lower())).strip()
+
+class ResponseCache:
+    """Bounded LRU cache with TTL for NPC dialogue, holding a few response variants per key"""
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+        variants_per_key: int = RESPONSE_CACHE_VARIANTS
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.variants_per_key = max(1, variants_per_key)
+        # key -> (created_at, responses), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(
+        npc_id: str,
+        player_input: str,
+        trust_level: int,
+        context: Dict,
+        npc_location: str,
+        world: str = "",
+        memories: Sequence[str] = ()
+    ) -> str:
+        """
+        Canonical hash of the prompt context that shapes a response
+
+        The cache is shared by every session, so everything session-specific
+        that goes into the prompt, the retrieved memories and recent events,
+        is part of the key; only exchanges with the same history are shared,
+        e.g. first meetings.
+
+        Args:
+            npc_id: NPC identifier
+            player_input: Raw player message
+            trust_level: NPC's current trust in the player
+            context: Game context passed to the prompt (loop, time, location)
+            npc_location: Where the NPC currently is
+            world: Version of the world pack the NPC comes from; NPC ids are only unique within one
+            memories: Memory lines retrieved for the prompt
+
+        Returns:
+            str: Hex digest identifying the prompt context
+        """
+        parts = {
+            "npc_id": npc_id,
+            "input": normalize_input(player_input),
+            "trust_band": trust_level // TRUST_BAND_SIZE,
+            "hour": str(context.get("time", "")).split(":")[0],
+            "loop": context.get("current_loop", 1),
+            "location": context.get("location"),
+            "npc_location": npc_location,
+            "world": world,
+            "memories": list(memories),
+            "events": list(context.get("recent_events") or [])
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response
+
+        Keys that have fewer than variants_per_key responses count as misses so
+        the caller generates another variant.
+
+        Returns:
+            Optional[str]: A random cached variant, or None on a miss
+        """
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+            del self._entries[key]
+            self.expirations += 1
+            entry = None
+        if entry is None or len(entry[1]) < self.variants_per_key:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return random.choice(entry[1])
+
+    def put(self, key: str, response: str):
+        """Add a response variant for a key"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = (time.monotonic(), [response])
+        else:
+            variants: List[str] = entry[1]
+            if len(variants) < self.variants_per_key:
+                variants.append(response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+    def clear(self):
+        """Drop every cached response"""
+        self._entries.clear()
@@ -0,0 +1,75 @@
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+import os
+import random
+import time
+
+# Simulated model behaviour
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "0.4"))  # Time to first token
+FAKE_LLM_JITTER_SECONDS = float(os.getenv("FAKE_LLM_JITTER_SECONDS", "0.1"))  # Uniform extra delay, 0 to this
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50"))
+
+REPLIES = [
+    "Welcome, traveler. Mind the road after dark.",
+    "I have work to do. Say what you came to say.",
+    "Strange times in this village. Keep your wits about you.",
+    "I've seen that look before. You know something, don't you?"
+]
+
+app = FastAPI(title="Fake OpenAI-compatible model server")
+stats = {"requests": 0, "streamed": 0}
+
+def _tokens(text: str):
+    """Split a reply into word-sized tokens, keeping the spacing"""
+    words = text.split(" ")
+    return [word + (" " if index < len(words) - 1 else "") for index, word in enumerate(words)]
+
+async def _first_token_delay():
+    await asyncio.sleep(FAKE_LLM_LATENCY_SECONDS + random.uniform(0, FAKE_LLM_JITTER_SECONDS))
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """Answer like the chat completions API, after the configured latency and token rate"""
+    body = await request.json()
+    stats["requests"] += 1
+    reply = random.choice(REPLIES)
+    tokens = _tokens(reply)
+    token_delay = 1 / FAKE_LLM_TOKENS_PER_SECOND if FAKE_LLM_TOKENS_PER_SECOND > 0 else 0
+    created = int(time.time())
+
+    if body.get("stream"):
+        stats["streamed"] += 1
+
+        async def stream():
+            await _first_token_delay()
+            for token in tokens:
+                chunk = {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": body.get("model", "fake"),
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(token_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    await _first_token_delay()
+    await asyncio.sleep(token_delay * len(tokens))
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": created,
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}
+    }
+
+@app.get("/stats")
+async def get_stats():
+    """How many completions have been served"""
+    return stats
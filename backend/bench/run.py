@@ -0,0 +1,375 @@
+"""
+Load test for the ReRe API
+
+Starts the app and a fake OpenAI-compatible model server, drives scripted
+players through the game endpoints at a chosen concurrency, and reports
+throughput and latency percentiles per endpoint. Results can be saved as a
+baseline, and later runs are compared against it.
+
+Absolute latencies depend on the machine, so each run first measures two
+floors with the app idle: an empty request to the app, and a completion
+from the fake model. The baseline stores every latency as a multiple of the
+floor that bounds it (the model floor for endpoints that call the model, the
+HTTP floor for the rest), and throughput per model floor, so a baseline
+recorded on one machine still applies on another. Each metric has its own
+tolerance, kept in the baseline: tail latencies under load vary far more
+between runs than medians do.
+
+Run from the backend directory:
+
+    python -m bench.run --players 50 --duration 30
+    python -m bench.run --save-baseline
+    python -m bench.run                     # Compares against the saved baseline
+"""
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+# Checked in, so every checkout compares against the same numbers
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "bench", "baseline.json")
+
+# Endpoints whose latency is bounded by a model call; the others by the HTTP floor
+MODEL_ENDPOINTS = ("POST /npc/{npc_id}/interact",)
+FLOOR_SAMPLES = 20  # Sequential requests per floor measurement
+PERCENTILES = {"p50": "p50_ms", "p95": "p95_ms", "p99": "p99_ms"}  # Baseline metric -> summary metric
+# Allowed relative slowdown per metric before a run counts as a regression
+TOLERANCES = {"p50": 0.2, "p95": 0.5, "p99": 1.0, "throughput": 0.2}
+MIN_REQUESTS = 100  # Fewer requests than this make an endpoint's latencies too noisy to compare
+
+# What players type, roughly in proportion to how often they say it; free text, so every reply is generated
+PLAYER_INPUTS = [
+    "Hello there, how are you today?",
+    "Good morning! Nice weather for it.",
+    "Who are you, and what do you do here?",
+    "Did you hear about the murder last night?",
+    "Who do you think would want him dead?",
+    "Where were you when it happened?",
+    "Have you seen anyone acting strangely?",
+    "Mind if I have a look around?",
+    "What do you make of the elder?",
+    "Is there anything you're not telling me?"
+]
+RESET_PROBABILITY = 0.05  # Chance a player restarts the loop after each round
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class Recorder:
+    """Latencies and failures per endpoint"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def call(self, label: str, request) -> Optional[httpx.Response]:
+        """Await a request, timing it under an endpoint label"""
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            response = None
+        self.latencies.setdefault(label, []).append(time.perf_counter() - start)
+        if response is None or response.status_code >= 400:
+            self.errors[label] = self.errors.get(label, 0) + 1
+        return response
+
+    def summary(self, wall_seconds: float) -> Dict:
+        """Throughput and latency percentiles (in milliseconds) per endpoint and overall"""
+        endpoints = {}
+        for label, latencies in sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+            endpoints[label] = {
+                "requests": len(ordered),
+                "errors": self.errors.get(label, 0),
+                "throughput": len(ordered) / wall_seconds,
+                "mean_ms": 1000 * sum(ordered) / len(ordered),
+                "p50_ms": 1000 * percentile(ordered, 0.50),
+                "p95_ms": 1000 * percentile(ordered, 0.95),
+                "p99_ms": 1000 * percentile(ordered, 0.99)
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            "wall_seconds": wall_seconds,
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput": total / wall_seconds,
+            "endpoints": endpoints
+        }
+
+async def play(client: httpx.AsyncClient, recorder: Recorder, deadline: float, rng: random.Random):
+    """One player: open a session, then wander between locations talking to whoever is there"""
+    response = await recorder.call("POST /session", client.post("/session"))
+    if response is None or response.status_code != 200:
+        return
+    headers = {"X-Session-Id": response.json()["session_id"]}
+    response = await recorder.call("GET /game/locations", client.get("/game/locations", headers=headers))
+    if response is None or response.status_code != 200:
+        return
+    locations = response.json()["locations"]
+    etag = None
+
+    while time.monotonic() < deadline:
+        location = rng.choice(locations)
+        response = await recorder.call(
+            "GET /game/location/{location_id}/npcs",
+            client.get(f"/game/location/{location}/npcs", headers=headers)
+        )
+        npcs = response.json()["npcs"] if response is not None and response.status_code == 200 else []
+        if npcs:
+            npc_id = rng.choice(npcs)["id"]
+            await recorder.call(
+                "POST /npc/{npc_id}/interact",
+                client.post(f"/npc/{npc_id}/interact", json={"player_input": rng.choice(PLAYER_INPUTS)}, headers=headers)
+            )
+
+        state_headers = dict(headers, **({"If-None-Match": etag} if etag else {}))
+        response = await recorder.call("GET /game/state", client.get("/game/state", headers=state_headers))
+        if response is not None:
+            etag = response.headers.get("ETag", etag)
+
+        if rng.random() < RESET_PROBABILITY:
+            await recorder.call("POST /game/reset", client.post("/game/reset", headers=headers))
+
+async def measure_floors(app_url: str, llm_url: Optional[str], nominal_model_ms: float) -> Dict[str, float]:
+    """
+    Median latency of an empty app request and of a fake model completion, one at a time
+
+    Without a fake model to ask (a benchmark of an already running app), the
+    model floor is the configured fake latency.
+    """
+    async def median_ms(client: httpx.AsyncClient, request) -> float:
+        latencies = []
+        for _ in range(FLOOR_SAMPLES):
+            start = time.perf_counter()
+            (await request(client)).raise_for_status()
+            latencies.append(1000 * (time.perf_counter() - start))
+        return percentile(sorted(latencies), 0.5)
+
+    completion = {"model": "fake", "messages": [{"role": "user", "content": "Hello"}]}
+    async with httpx.AsyncClient(timeout=60) as client:
+        floors = {"http_ms": await median_ms(client, lambda c: c.get(app_url + "/"))}
+        if llm_url is not None:
+            floors["model_ms"] = await median_ms(client, lambda c: c.post(llm_url + "/v1/chat/completions", json=completion))
+        else:
+            floors["model_ms"] = nominal_model_ms
+    return floors
+
+def normalize(summary: Dict) -> Dict:
+    """
+    Machine-independent form of a run's results, for the baseline
+
+    Latencies become multiples of their endpoint's floor, errors a rate, and
+    throughput requests per model floor.
+    """
+    floors = summary["floors"]
+    endpoints = {}
+    for label, result in summary["endpoints"].items():
+        floor = "model" if label in MODEL_ENDPOINTS else "http"
+        endpoints[label] = {
+            "floor": floor,
+            "error_rate": result["errors"] / result["requests"],
+            **{metric: result[source] / floors[f"{floor}_ms"] for metric, source in PERCENTILES.items()}
+        }
+    return {
+        "floors": floors,
+        "tolerances": dict(TOLERANCES),
+        "throughput_per_model_floor": summary["throughput"] * floors["model_ms"] / 1000,
+        "endpoints": endpoints,
+        "config": summary.get("config")
+    }
+
+async def run_load(app_url: str, players: int, duration: float, seed: int) -> Dict:
+    """Run every player concurrently for the given duration"""
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=players, max_keepalive_connections=players)
+    async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=60) as client:
+        start = time.monotonic()
+        deadline = start + duration
+        await asyncio.gather(*(play(client, recorder, deadline, random.Random(seed + index)) for index in range(players)))
+        wall_seconds = time.monotonic() - start
+    return recorder.summary(wall_seconds)
+
+def start_server(app: str, port: int, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    """Start a uvicorn server from the backend directory, logging to a file"""
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT
+    )
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    """Poll a URL until it answers, failing early if the server process exits"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server for {url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server for {url} did not start within {timeout} seconds")
+
+def compare(summary: Dict, baseline: Dict, threshold: Optional[float] = None, min_delta_ms: float = 5) -> List[str]:
+    """
+    Find regressions against a baseline
+
+    Args:
+        summary: Results of this run
+        baseline: A normalize()d earlier run
+        threshold: Allowed relative slowdown for every metric, e.g. 0.2 for 20%; None uses the baseline's tolerances
+        min_delta_ms: Latency changes smaller than this on this machine are treated as noise
+
+    Returns:
+        List[str]: One line per regression, in multiples of the endpoint's floor
+    """
+    tolerances = dict(TOLERANCES, **baseline.get("tolerances", {}))
+    if threshold is not None:
+        tolerances = {metric: threshold for metric in tolerances}
+    current = normalize(summary)
+    regressions = []
+    for label, now in current["endpoints"].items():
+        before = baseline["endpoints"].get(label)
+        if before is None:
+            continue
+        floor_ms = current["floors"][f"{now['floor']}_ms"]
+        for metric in PERCENTILES if summary["endpoints"][label]["requests"] >= MIN_REQUESTS else ():
+            slower_ms = (now[metric] - before[metric]) * floor_ms
+            if slower_ms > min_delta_ms and now[metric] > before[metric] * (1 + tolerances[metric]):
+                regressions.append(f"{label}: {metric} {before[metric]:.2f}x -> {now[metric]:.2f}x {now['floor']} floor")
+        if now["error_rate"] > before["error_rate"]:
+            regressions.append(f"{label}: error rate {before['error_rate']:.2%} -> {now['error_rate']:.2%}")
+    if current["throughput_per_model_floor"] < baseline["throughput_per_model_floor"] * (1 - tolerances["throughput"]):
+        regressions.append(
+            f"throughput {baseline['throughput_per_model_floor']:.1f} -> {current['throughput_per_model_floor']:.1f} requests per model floor"
+        )
+    return regressions
+
+def print_report(summary: Dict):
+    print(f"{'endpoint':<40} {'reqs':>7} {'errs':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, result in summary["endpoints"].items():
+        print(
+            f"{label:<40} {result['requests']:>7} {result['errors']:>5} {result['throughput']:>8.1f}"
+            f" {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+        )
+    print(f"{'total':<40} {summary['requests']:>7} {summary['errors']:>5} {summary['throughput']:>8.1f}")
+    floors = summary["floors"]
+    print(f"floors: http {floors['http_ms']:.1f} ms, model {floors['model_ms']:.1f} ms")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test the ReRe API against a fake model server")
+    parser.add_argument("--players", type=int, default=20, help="Concurrent scripted players")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="Fake model time to first token, seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="Fake model extra random delay, seconds")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=50, help="Fake model token rate")
+    parser.add_argument("--app-port", type=int, default=8100)
+    parser.add_argument("--llm-port", type=int, default=8101)
+    parser.add_argument("--app-url", help="Benchmark an already running app instead of starting one")
+    parser.add_argument("--output", help="Write this run's results to a JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=None,
+        help="Allowed relative slowdown before flagging, for every metric; defaults to the baseline's per-metric tolerances"
+    )
+    parser.add_argument("--min-delta-ms", type=float, default=5, help="Ignore latency changes smaller than this")
+    args = parser.parse_args()
+
+    config = {
+        "players": args.players,
+        "duration": args.duration,
+        "seed": args.seed,
+        "llm_latency": args.llm_latency,
+        "llm_jitter": args.llm_jitter,
+        "llm_tokens_per_second": args.llm_tokens_per_second
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    processes = []
+    try:
+        app_url = args.app_url
+        llm_url = None
+        if app_url is None:
+            llm_env = dict(
+                os.environ,
+                FAKE_LLM_LATENCY_SECONDS=str(args.llm_latency),
+                FAKE_LLM_JITTER_SECONDS=str(args.llm_jitter),
+                FAKE_LLM_TOKENS_PER_SECOND=str(args.llm_tokens_per_second)
+            )
+            llm = start_server("bench.fake_llm:app", args.llm_port, llm_env, os.path.join(RESULTS_DIR, "fake_llm.log"))
+            processes.append(llm)
+            llm_url = f"http://127.0.0.1:{args.llm_port}"
+            wait_until_ready(llm_url + "/stats", llm)
+
+            app_env = dict(
+                os.environ,
+                OPENAI_API_KEY="bench",
+                OPENAI_BASE_URL=f"http://127.0.0.1:{args.llm_port}/v1",
+                PERSISTENCE_DIR=tempfile.mkdtemp(prefix="rere-bench-")
+            )
+            app = start_server("main:app", args.app_port, app_env, os.path.join(RESULTS_DIR, "app.log"))
+            processes.append(app)
+            app_url = f"http://127.0.0.1:{args.app_port}"
+            wait_until_ready(app_url + "/", app)
+
+        floors = asyncio.run(measure_floors(app_url, llm_url, 1000 * (args.llm_latency + args.llm_jitter / 2)))
+        print(f"Running {args.players} players for {args.duration:.0f}s against {app_url}")
+        summary = asyncio.run(run_load(app_url, args.players, args.duration, args.seed))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    summary["floors"] = floors
+    summary["config"] = config
+    print_report(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(normalize(summary), f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against; run with --save-baseline to store one")
+        return 0
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    if "floors" not in baseline:
+        print("The baseline holds absolute numbers from an older version; run with --save-baseline to re-record it")
+        return 0
+    if baseline.get("config") != config:
+        print("Warning: the baseline was recorded with different settings")
+    regressions = compare(summary, baseline, args.threshold, args.min_delta_ms)
+    if not regressions:
+        print(f"No regressions against {args.baseline}")
+        return 0
+    print(f"Regressions against {args.baseline}:")
+    for regression in regressions:
+        print(f"  {regression}")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+from typing import Dict, Hashable, List, Optional, Set
+from collections import OrderedDict
+import asyncio
+import itertools
+import os
+
+FEED_MAX_PENDING = int(os.getenv("FEED_MAX_PENDING", "100"))  # Undelivered messages per subscriber
+
+class Subscription:
+    """One client's queue of pending change messages"""
+
+    def __init__(self, max_pending: int = FEED_MAX_PENDING):
+        self.max_pending = max_pending
+        # Messages with the same coalesce key replace each other, so a slow
+        # client gets the latest NPC state or clock rather than every step
+        self._pending: "OrderedDict[Hashable, Dict]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self._unique_keys = itertools.count()
+        self.dropped = 0
+
+    def push(self, message: Dict, coalesce_key: Optional[Hashable] = None):
+        """Queue a message, replacing any pending one with the same coalesce key"""
+        if coalesce_key is None:
+            coalesce_key = ("unique", next(self._unique_keys))
+        else:
+            self._pending.pop(coalesce_key, None)
+        self._pending[coalesce_key] = message
+        if len(self._pending) > self.max_pending:
+            # The client has fallen too far behind; tell it to refetch instead
+            self.dropped += len(self._pending)
+            self._pending.clear()
+            self._pending[("resync",)] = {"type": "resync"}
+        self._ready.set()
+
+    async def next_batch(self) -> List[Dict]:
+        """Wait for and take every pending message, oldest first"""
+        await self._ready.wait()
+        self._ready.clear()
+        batch = list(self._pending.values())
+        self._pending.clear()
+        return batch
+
+class ChangeFeed:
+    """Fans out a session's change events to its subscribed clients"""
+
+    def __init__(self, max_pending: int = FEED_MAX_PENDING):
+        self.max_pending = max_pending
+        self._subscribers: Set[Subscription] = set()
+
+    def subscribe(self) -> Subscription:
+        """Register a new subscriber"""
+        subscription = Subscription(self.max_pending)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Remove a subscriber"""
+        self._subscribers.discard(subscription)
+
+    def publish(self, event_type: str, data: Dict, version: Optional[int] = None, coalesce_key: Optional[Hashable] = None):
+        """
+        Send a typed change event to every subscriber
+
+        Args:
+            event_type: Kind of change, e.g. "add_event" or "time_advanced"
+            data: Change payload
+            version: Game state version after the change, if it has one
+            coalesce_key: Messages sharing this key may be collapsed to the latest
+        """
+        if not self._subscribers:
+            return
+        message = {"type": event_type, "version": version, "data": data}
+        for subscription in self._subscribers:
+            subscription.push(message, coalesce_key)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
@@ -0,0 +1,227 @@
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from bisect import bisect_left, bisect_right
+from .retention import EVENT_STORE_LIMIT
+
+class StoredEvent:
+    """An event with its position in the session's history"""
+    __slots__ = ("id", "loop", "minute", "event")
+
+    def __init__(self, id: int, loop: int, minute: int, event: Dict):
+        self.id = id
+        self.loop = loop
+        # Minutes since midnight on the game clock when the event was added
+        self.minute = minute
+        self.event = event
+
+    def to_dict(self) -> Dict:
+        return {"id": self.id, "loop": self.loop, **self.event}
+
+# A run of ids from a sorted index, as (ids, start, stop)
+Segment = Tuple[Sequence[int], int, int]
+
+class EventStore:
+    """
+    A session's event history across loops, indexed by NPC, event type, loop and game time
+
+    Ids increase with every event, and every index is a list of ids in that
+    order, so a filter and a cursor resolve to a position with a binary search
+    instead of a scan of the whole history. Within a loop the clock only moves
+    forward, so each loop also keeps its events' minutes in order to answer
+    time ranges the same way.
+    """
+
+    def __init__(self, limit: int = EVENT_STORE_LIMIT):
+        self.limit = limit
+        self.clear()
+
+    def clear(self):
+        """Forget every event"""
+        self._events: List[StoredEvent] = []
+        self._next_id = 1
+        self._by_npc: Dict[str, List[int]] = {}
+        self._by_type: Dict[str, List[int]] = {}
+        # loop -> (ids, minutes), both in id order
+        self._by_loop: Dict[int, Tuple[List[int], List[int]]] = {}
+
+    def add(self, event: Dict, loop: int, minute: int) -> StoredEvent:
+        """
+        Record an event, dropping the oldest beyond the limit
+
+        Args:
+            event: The event, e.g. {"type": "npc_interaction", "npc_id": ..., "timestamp": ...}
+            loop: Loop the event happened in
+            minute: Game clock in minutes since midnight
+
+        Returns:
+            StoredEvent: The event with its id
+        """
+        ids, minutes = self._by_loop.setdefault(loop, ([], []))
+        if minutes and minute < minutes[-1]:
+            # Keep the loop's time index sorted if the clock was ever wound back
+            minute = minutes[-1]
+        stored = StoredEvent(self._next_id, loop, minute, event)
+        self._next_id += 1
+        self._events.append(stored)
+        ids.append(stored.id)
+        minutes.append(minute)
+        if npc_id := event.get("npc_id"):
+            self._by_npc.setdefault(npc_id, []).append(stored.id)
+        if event_type := event.get("type"):
+            self._by_type.setdefault(event_type, []).append(stored.id)
+        while len(self._events) > self.limit:
+            self._evict_oldest()
+        return stored
+
+    def _evict_oldest(self):
+        """Drop the oldest event; it is the first entry of every index it is in"""
+        stored = self._events.pop(0)
+        ids, minutes = self._by_loop[stored.loop]
+        del ids[0], minutes[0]
+        if not ids:
+            del self._by_loop[stored.loop]
+        for index, key in ((self._by_npc, stored.event.get("npc_id")), (self._by_type, stored.event.get("type"))):
+            if key:
+                del index[key][0]
+                if not index[key]:
+                    del index[key]
+
+    def get(self, event_id: int) -> Optional[StoredEvent]:
+        """An event by id, or None if it never existed or has been dropped"""
+        if not self._events:
+            return None
+        position = event_id - self._events[0].id
+        return self._events[position] if 0 <= position < len(self._events) else None
+
+    def query(
+        self,
+        npc_id: Optional[str] = None,
+        event_type: Optional[str] = None,
+        loop: Optional[int] = None,
+        start_minute: Optional[int] = None,
+        end_minute: Optional[int] = None,
+        cursor: Optional[int] = None,
+        limit: int = 50,
+        newest_first: bool = False
+    ) -> Tuple[List[StoredEvent], Optional[int]]:
+        """
+        Find events matching every given filter, one page at a time
+
+        Args:
+            npc_id: Only events involving this NPC
+            event_type: Only events of this type
+            loop: Only events from this loop
+            start_minute: Only events at or after this minute of the day
+            end_minute: Only events at or before this minute of the day
+            cursor: Continue after the event with this id, as returned by the previous page
+            limit: Maximum number of events to return
+            newest_first: Page backwards from the most recent event
+
+        Returns:
+            Tuple: (events in page order, cursor for the next page or None if this is the last)
+        """
+        time_filtered = start_minute is not None or end_minute is not None
+        sources = []
+        if npc_id is not None:
+            sources.append([self._whole(self._by_npc.get(npc_id, []))])
+        if event_type is not None:
+            sources.append([self._whole(self._by_type.get(event_type, []))])
+        if loop is not None or time_filtered:
+            loops = [loop] if loop is not None else sorted(self._by_loop)
+            sources.append([self._time_segment(number, start_minute, end_minute) for number in loops])
+        if not sources:
+            first_id = self._events[0].id if self._events else self._next_id
+            sources.append([self._whole(range(first_id, self._next_id))])
+        # Walk the most selective index and check the other filters per event
+        segments = min(sources, key=lambda source: sum(stop - start for _, start, stop in source))
+
+        page: List[StoredEvent] = []
+        for event_id in self._walk(segments, cursor, newest_first):
+            stored = self.get(event_id)
+            if npc_id is not None and stored.event.get("npc_id") != npc_id:
+                continue
+            if event_type is not None and stored.event.get("type") != event_type:
+                continue
+            if loop is not None and stored.loop != loop:
+                continue
+            if start_minute is not None and stored.minute < start_minute:
+                continue
+            if end_minute is not None and stored.minute > end_minute:
+                continue
+            if len(page) == limit:
+                return page, page[-1].id
+            page.append(stored)
+        return page, None
+
+    @staticmethod
+    def _whole(ids: Sequence[int]) -> Segment:
+        return ids, 0, len(ids)
+
+    def _time_segment(self, loop: int, start_minute: Optional[int], end_minute: Optional[int]) -> Segment:
+        """The ids of a loop's events inside a time range"""
+        ids, minutes = self._by_loop.get(loop, ([], []))
+        start = bisect_left(minutes, start_minute) if start_minute is not None else 0
+        stop = bisect_right(minutes, end_minute) if end_minute is not None else len(ids)
+        return ids, start, max(start, stop)
+
+    @staticmethod
+    def _walk(segments: List[Segment], cursor: Optional[int], newest_first: bool) -> Iterator[int]:
+        """Ids from sorted segments in order, starting past the cursor"""
+        if newest_first:
+            for ids, start, stop in reversed(segments):
+                if cursor is not None:
+                    stop = max(start, min(stop, bisect_left(ids, cursor, start, stop)))
+                for position in range(stop - 1, start - 1, -1):
+                    yield ids[position]
+        else:
+            for ids, start, stop in segments:
+                if cursor is not None:
+                    start = min(stop, max(start, bisect_right(ids, cursor, start, stop)))
+                for position in range(start, stop):
+                    yield ids[position]
+
+    @property
+    def last_id(self) -> int:
+        """Id of the newest event ever added, or 0 if there has been none"""
+        return self._next_id - 1
+
+    @property
+    def first_id(self) -> int:
+        """Id of the oldest event still kept; the next id if there is none"""
+        return self._events[0].id if self._events else self._next_id
+
+    def to_list(self, after_id: int = 0) -> List[List]:
+        """Serializable form, oldest first, as [id, loop, minute, event]; only events after an id if given"""
+        position = max(0, after_id + 1 - self.first_id)
+        return [[stored.id, stored.loop, stored.minute, stored.event] for stored in self._events[position:]]
+
+    def load(self, entries: List[List]):
+        """Replace the history with one from to_list(), keeping its ids"""
+        self.clear()
+        self.extend(entries)
+
+    def extend(self, entries: List[List]):
+        """Append entries from to_list() that are newer than every event held, keeping their ids"""
+        for event_id, loop, minute, event in entries:
+            if event_id <= self.last_id:
+                continue
+            self._next_id = event_id
+            self.add(event, loop, minute)
+
+    def discard_after(self, event_id: int):
+        """Drop the events newer than an id; they are the last entry of every index they are in"""
+        while self._events and self._events[-1].id > event_id:
+            stored = self._events.pop()
+            ids, minutes = self._by_loop[stored.loop]
+            ids.pop()
+            minutes.pop()
+            if not ids:
+                del self._by_loop[stored.loop]
+            for index, key in ((self._by_npc, stored.event.get("npc_id")), (self._by_type, stored.event.get("type"))):
+                if key:
+                    index[key].pop()
+                    if not index[key]:
+                        del index[key]
+        self._next_id = min(self._next_id, event_id + 1)
+
+    def __len__(self) -> int:
+        return len(self._events)
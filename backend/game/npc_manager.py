@@ -1,29 +1,64 @@
-from typing import Dict, List, Optional
-from datetime import datetime
-import json
-import os
+from typing import Callable, Dict, List, Optional
+import re
+import sys
+from .retention import NPC_STATE_MEMORY_LIMIT
+from .npc_registry import NPCDefinition
+from .world_pack import WorldPack, get_catalog
+from .npc_state import NPCState
+
+_MEMORY_ACTION = re.compile(r"^\d+:\d+ - Player (.+)$")
 
 class NPC:
-    def __init__(self, id: str, name: str, description: str, location: str, personality: Dict, initial_state: Dict):
-        self.id = id
-        self.name = name
-        self.description = description
-        self.location = location
-        self.personality = personality
-        self.state = initial_state.copy()
+    """An NPC in one session: the shared definition plus this session's location and state"""
+    __slots__ = ("definition", "location", "state")
+
+    def __init__(self, definition: NPCDefinition, location: Optional[str] = None, state: Optional[NPCState] = None):
+        self.definition = definition
+        self.location = location or definition.location
+        self.state = state or definition.initial_state.copy()
+
+    @property
+    def id(self) -> str:
+        return self.definition.id
+
+    @property
+    def name(self) -> str:
+        return self.definition.name
+
+    @property
+    def description(self) -> str:
+        return self.definition.description
+
+    @property
+    def personality(self) -> Dict:
+        return self.definition.personality
 
     def update_state(self, interaction_result: Dict):
         """Update NPC state based on interaction results"""
         if "mood_change" in interaction_result:
-            self.state["mood"] = interaction_result["mood_change"]
+            self.state.set_mood(interaction_result["mood_change"])
         if "trust_change" in interaction_result:
-            self.state["trust_level"] += interaction_result["trust_change"]
+            self.state.trust_level += interaction_result["trust_change"]
         if "new_secret" in interaction_result:
-            self.state["known_secrets"].append(interaction_result["new_secret"])
+            self.state.add_secret(interaction_result["new_secret"])
         if "new_goal" in interaction_result:
-            self.state["current_goal"] = interaction_result["new_goal"]
+            self.state.set_goal(interaction_result["new_goal"])
         if "memory" in interaction_result:
-            self.state["memories"].append(interaction_result["memory"])
+            self.state.add_memory(interaction_result["memory"])
+
+    def compact_memories(self, loop: int):
+        """Collapse this loop's interaction memories into a single summary line"""
+        counts: Dict[str, int] = {}
+        kept = []
+        for memory in self.state.memories:
+            if match := _MEMORY_ACTION.match(memory):
+                counts[match.group(1)] = counts.get(match.group(1), 0) + 1
+            else:
+                kept.append(memory)
+        if counts:
+            actions = ", ".join(f"{action} x{count}" for action, count in counts.items())
+            kept.append(f"Loop {loop} - Player {actions}")
+        self.state.memories = tuple(kept[-NPC_STATE_MEMORY_LIMIT:])
 
     def get_state(self) -> Dict:
         """Get current NPC state"""
@@ -31,38 +66,35 @@ class NPC:
             "id": self.id,
             "name": self.name,
             "location": self.location,
-            "state": self.state,
+            "state": self.state.to_dict(),
             "personality": self.personality
         }
 
 class NPCManager:
-    def __init__(self):
+    TIME_COSTS = {"greet": 0.5, "ask_about_murder": 2, "investigate": 3}  # Hours per action; others take 1
+
+    def __init__(self, world: Optional[WorldPack] = None):
+        # Definitions are parsed once per world pack and shared; only the states are per manager
+        self.world = world or get_catalog().default()
+        self.registry = self.world.registry
         self.npcs: Dict[str, NPC] = {}
-        self.NPCs_WITH_MEMORY = ["elder"]  # NPCs who retain memories between loops
+        # Called as listener(op, payload) after NPC states change
+        self.change_listeners: List[Callable[[str, Dict], None]] = []
+        # Day-long location timetable shared by every manager on this registry
+        self.schedule = self.registry.schedule()
+        # Live reverse index: location -> NPCs currently there
+        self._npcs_by_location: Dict[str, Dict[str, NPC]] = {}
         self._load_npcs()
 
+    def _notify(self, op: str, payload: Dict):
+        for listener in self.change_listeners:
+            listener(op, payload)
+
     def _load_npcs(self):
-        """Load NPCs from JSON file"""
-        try:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            npc_file = os.path.join(current_dir, "npcs.json")
-            
-            with open(npc_file, 'r') as f:
-                npc_data = json.load(f)
-                
-            for npc_id, npc_info in npc_data.items():
-                self.npcs[npc_id] = NPC(
-                    id=npc_id,
-                    name=npc_info["name"],
-                    description=npc_info["description"],
-                    location=npc_info["location"],
-                    personality=npc_info["personality"],
-                    initial_state=npc_info["initial_state"]
-                )
-        except Exception as e:
-            print(f"Error loading NPCs: {e}")
-            # Initialize with empty NPCs if loading fails
-            self.npcs = {}
+        """Create NPCs from the registry definitions"""
+        for definition in self.registry.definitions():
+            self.npcs[definition.id] = NPC(definition)
+            self._npcs_by_location.setdefault(definition.location, {})[definition.id] = self.npcs[definition.id]
 
     def get_npc(self, npc_id: str) -> Optional[NPC]:
         """Get an NPC by ID"""
@@ -70,54 +102,80 @@ class NPCManager:
 
     def get_npcs_at_location(self, location: str) -> List[NPC]:
         """Get all NPCs at a specific location"""
-        return [npc for npc in self.npcs.values() if npc.location == location]
+        return list(self._npcs_by_location.get(location, {}).values())
+
+    def get_scheduled_npcs_at_location(self, location: str, minute: int) -> List[NPC]:
+        """Get the NPCs the schedule puts at a location at a minute of the day"""
+        return [self.npcs[npc_id] for npc_id in self.schedule.npcs_at(location, minute)]
 
     def update_npc_location(self, npc_id: str, new_location: str):
         """Update an NPC's location"""
         if npc := self.get_npc(npc_id):
-            npc.location = new_location
+            self.set_location(npc_id, new_location)
+            self._notify("npc_moved", {"npc_id": npc_id, "location": new_location})
+
+    def set_location(self, npc_id: str, location: str):
+        """Move an NPC without notifying listeners, e.g. when restoring saved state"""
+        npc = self.npcs[npc_id]
+        if npc.location == location:
+            return
+        # Sessions restored from JSON would otherwise each hold their own copy
+        location = sys.intern(location)
+        occupants = self._npcs_by_location.get(npc.location)
+        if occupants is not None:
+            occupants.pop(npc_id, None)
+            if not occupants:
+                del self._npcs_by_location[npc.location]
+        npc.location = location
+        self._npcs_by_location.setdefault(location, {})[npc_id] = npc
+
+    def apply_schedule(self, minute: int):
+        """Put every NPC where the schedule has them at a minute of the day"""
+        for npc_id in self.npcs:
+            self.set_location(npc_id, self.schedule.location_of(npc_id, minute))
+
+    def rule_response(self, npc_id: str, action: str, current_hour: int) -> str:
+        """Deterministic reply to an action, without changing any state"""
+        npc = self.npcs[npc_id]
+        if action == "greet":
+            return self._generate_greeting(npc, current_hour)
+        elif action == "ask_about_murder":
+            return self._generate_murder_response(npc)
+        elif action == "investigate":
+            return self._generate_investigation_response(npc)
+        return "I don't understand what you want."
 
-    def process_interaction(self, npc_id: str, action: str, game_state: Dict) -> Dict:
-        """Process an interaction with an NPC"""
+    def process_interaction(self, npc_id: str, action: str, current_time: str) -> Dict:
+        """Process an interaction with an NPC at the session's clock time ("HH:MM")"""
         npc = self.get_npc(npc_id)
         if not npc:
             return {"error": "NPC not found"}
 
-        from .time_service import TimeService
-        time_service = TimeService()
-        current_time = time_service.get_current_time()
+        current_hour = int(current_time.split(":")[0])
 
         # Different actions take different amounts of time
-        time_cost = 1  # Default time cost
-        response = ""
-
-        if action == "greet":
-            time_cost = 0.5
-            response = self._generate_greeting(npc, current_time.current_hour)
-        elif action == "ask_about_murder":
-            time_cost = 2
-            response = self._generate_murder_response(npc)
-        elif action == "investigate":
-            time_cost = 3
-            response = self._generate_investigation_response(npc)
-        else:
-            response = "I don't understand what you want."
+        time_cost = self.TIME_COSTS.get(action, 1)
+        response = self.rule_response(npc_id, action, current_hour)
 
         # Update trust based on interaction
         trust_change = self._calculate_trust_change(action)
-        npc.state["trust_level"] = max(0, min(100, npc.state["trust_level"] + trust_change))
+        npc.state.trust_level = max(0, min(100, npc.state.trust_level + trust_change))
 
         # Add memory of interaction
-        memory = f"{current_time.current_hour}:00 - Player {action}"
-        npc.state["memories"].append(memory)
+        memory = f"{current_hour}:00 - Player {action}"
+        npc.state.add_memory(memory)
+        npc_state = npc.get_state()
+        self._notify("npc_state", {"npc_id": npc_id, "state": npc_state})
 
-        # Return the interaction result with state changes
+        # Return the interaction result with state changes; the rule-based
+        # response stands in when generated dialogue is unavailable
         return {
+            "response": response,
             "state_changes": {
                 "trust_change": trust_change,
                 "memory": memory,
                 "time_cost": time_cost,
-                "npc_state": npc.get_state()
+                "npc_state": npc_state
             }
         }
 
@@ -130,28 +188,16 @@ class NPCManager:
             return f"Good evening. {npc.personality['traits'][0]}"
 
     def _generate_murder_response(self, npc: NPC) -> str:
-        if npc.state["trust_level"] < 30:
+        if npc.state.trust_level < 30:
             return "I don't know anything about that. You should ask someone else."
 
-        if npc.id == "elder":
-            return "The murder... yes, it's part of the cycle. But I cannot tell you more yet."
-        elif npc.id == "blacksmith":
-            return "I saw something strange at the forge last night. A shadowy figure..."
-        elif npc.id == "apothecary":
-            return "I heard a commotion in one of the rooms, but when I checked, no one was there."
-        return "I don't know anything about that."
+        return npc.definition.responses.get("ask_about_murder", "I don't know anything about that.")
 
     def _generate_investigation_response(self, npc: NPC) -> str:
-        if npc.state["trust_level"] < 50:
+        if npc.state.trust_level < 50:
             return "I can't let you look around here. It's not safe."
 
-        if npc.id == "elder":
-            return "You find a strange symbol carved into the wall. It looks familiar..."
-        elif npc.id == "blacksmith":
-            return "In the forge, you discover a hidden compartment with unusual weapons."
-        elif npc.id == "apothecary":
-            return "Behind a painting, you find a secret room with mysterious notes."
-        return "You don't find anything of interest."
+        return npc.definition.responses.get("investigate", "You don't find anything of interest.")
 
     def _calculate_trust_change(self, action: str) -> int:
         if action == "greet":
@@ -162,15 +208,14 @@ class NPCManager:
             return -20
         return 0
 
-    def reset_states(self) -> None:
+    def reset_states(self, finished_loop: Optional[int] = None) -> None:
         """Reset NPC states for the next loop"""
         for npc_id, npc in self.npcs.items():
-            if npc_id not in self.NPCs_WITH_MEMORY:
-                # Reload initial state from JSON
-                current_dir = os.path.dirname(os.path.abspath(__file__))
-                npc_file = os.path.join(current_dir, "npcs.json")
-                
-                with open(npc_file, 'r') as f:
-                    npc_data = json.load(f)
-                    if npc_id in npc_data:
-                        npc.state = npc_data[npc_id]["initial_state"].copy() 
\ No newline at end of file
+            if npc.definition.keeps_memories:
+                # Carry memories over, compacted so they don't grow loop after loop
+                if finished_loop is not None:
+                    npc.compact_memories(finished_loop)
+            else:
+                # Restore from the registry's initial-state snapshot
+                npc.state = self.registry.initial_state(npc_id)
+        self._notify("npcs_reset", {"loop": finished_loop}) 
\ No newline at end of file
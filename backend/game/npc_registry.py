@@ -0,0 +1,118 @@
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+import json
+from .npc_state import NPCState
+
+REQUIRED_FIELDS = ("name", "description", "location", "personality", "initial_state")
+PERSONALITY_FIELDS = ("traits", "goals", "fears", "secrets")
+STATE_FIELDS = ("mood", "trust_level", "known_secrets", "current_goal", "memories")
+
+@dataclass(frozen=True)
+class NPCDefinition:
+    """Static, shared description of an NPC as authored in the data file"""
+    id: str
+    name: str
+    description: str
+    location: str
+    personality: Dict[str, Tuple[str, ...]]
+    initial_state: NPCState
+    # Planned moves over the day as (minute of the day, location), in time order
+    schedule: Tuple[Tuple[int, str], ...] = ()
+    # Whether the NPC keeps its memories when the loop restarts
+    keeps_memories: bool = False
+    # Rule-based replies by action, for the NPC's own take on the world
+    responses: Dict[str, str] = field(default_factory=dict)
+
+class NPCRegistry:
+    """NPC definitions parsed and validated once, with a snapshot of every NPC's initial state"""
+
+    def __init__(self, definitions: Dict[str, NPCDefinition], world_id: str = "default"):
+        self._definitions = definitions
+        # World pack the definitions come from; NPC ids are only unique within one
+        self.world_id = world_id
+        self._schedule = None
+
+    @classmethod
+    def from_file(cls, path: str, world_id: str = "default") -> 'NPCRegistry':
+        """Load and validate NPC definitions from a JSON file"""
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f), world_id)
+
+    @classmethod
+    def from_dict(cls, npc_data: Dict, world_id: str = "default") -> 'NPCRegistry':
+        """Validate raw NPC data and build a registry from it"""
+        definitions = {}
+        for npc_id, npc_info in npc_data.items():
+            missing = [field for field in REQUIRED_FIELDS if field not in npc_info]
+            missing += [f"personality.{field}" for field in PERSONALITY_FIELDS if field not in npc_info.get("personality", {})]
+            missing += [f"initial_state.{field}" for field in STATE_FIELDS if field not in npc_info.get("initial_state", {})]
+            if missing:
+                raise ValueError(f"NPC '{npc_id}' is missing {', '.join(missing)}")
+            definitions[npc_id] = NPCDefinition(
+                id=npc_id,
+                name=npc_info["name"],
+                description=npc_info["description"],
+                location=npc_info["location"],
+                personality={key: tuple(values) for key, values in npc_info["personality"].items()},
+                initial_state=NPCState.from_dict(npc_info["initial_state"]),
+                schedule=_parse_schedule(npc_id, npc_info.get("schedule", [])),
+                keeps_memories=bool(npc_info.get("keeps_memories", False)),
+                responses=_parse_responses(npc_id, npc_info.get("responses", {}))
+            )
+        return cls(definitions, world_id)
+
+    def get(self, npc_id: str) -> Optional[NPCDefinition]:
+        """Get an NPC definition by ID"""
+        return self._definitions.get(npc_id)
+
+    def ids(self) -> List[str]:
+        """IDs of all defined NPCs"""
+        return list(self._definitions.keys())
+
+    def definitions(self) -> List[NPCDefinition]:
+        """All NPC definitions"""
+        return list(self._definitions.values())
+
+    def initial_state(self, npc_id: str) -> NPCState:
+        """Fresh, independently mutable copy of an NPC's initial state"""
+        return self._definitions[npc_id].initial_state.copy()
+
+    def schedule(self):
+        """The location timetable for these NPCs, compiled on first use"""
+        if self._schedule is None:
+            from .schedule import Schedule
+            self._schedule = Schedule(self)
+        return self._schedule
+
+    def locations(self) -> List[str]:
+        """Every location the NPC data mentions"""
+        return list(self.schedule().locations)
+
+    def __len__(self) -> int:
+        return len(self._definitions)
+
+def _parse_schedule(npc_id: str, entries: List[Dict]) -> Tuple[Tuple[int, str], ...]:
+    """Validate an NPC's schedule entries ({"time": "HH:MM", "location": ...})"""
+    schedule = []
+    for entry in entries:
+        try:
+            hours, minutes = entry["time"].split(":")
+            minute = int(hours) * 60 + int(minutes)
+            location = entry["location"]
+        except (KeyError, ValueError, AttributeError, TypeError):
+            raise ValueError(f"NPC '{npc_id}' has an invalid schedule entry: {entry}")
+        if not 0 <= minute < 24 * 60:
+            raise ValueError(f"NPC '{npc_id}' has a schedule time outside the day: {entry['time']}")
+        schedule.append((minute, location))
+    return tuple(sorted(schedule))
+
+def _parse_responses(npc_id: str, responses: Dict) -> Dict[str, str]:
+    """Validate an NPC's rule-based replies ({action: text})"""
+    if not isinstance(responses, dict) or not all(isinstance(text, str) for text in responses.values()):
+        raise ValueError(f"NPC '{npc_id}' has invalid responses: {responses}")
+    return dict(responses)
+
+def get_registry() -> NPCRegistry:
+    """The NPCs of the default world pack, loaded on first use"""
+    from .world_pack import get_catalog
+    return get_catalog().default().registry
@@ -0,0 +1,74 @@
+from typing import Dict, Iterable, Optional
+import sys
+from .retention import NPC_STATE_MEMORY_LIMIT
+
+class NPCState:
+    """
+    An NPC's mutable state in one session
+
+    Values are immutable (interned strings, small ints, tuples), so a fresh
+    state shares everything with the registry's initial state and a change
+    only replaces the field it touches.
+    """
+    __slots__ = ("mood", "trust_level", "known_secrets", "current_goal", "memories")
+
+    def __init__(
+        self,
+        mood: str,
+        trust_level: int,
+        known_secrets: Iterable[str] = (),
+        current_goal: Optional[str] = None,
+        memories: Iterable[str] = ()
+    ):
+        self.mood = _intern(mood)
+        self.trust_level = int(trust_level)
+        self.known_secrets = tuple(known_secrets)
+        self.current_goal = _intern(current_goal)
+        self.memories = tuple(memories)
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> 'NPCState':
+        """Build a state from its serialized form"""
+        return cls(state["mood"], state["trust_level"], state["known_secrets"], state["current_goal"], state["memories"])
+
+    def to_dict(self) -> Dict:
+        """Serializable form, as sent to clients and stored in snapshots"""
+        return {
+            "mood": self.mood,
+            "trust_level": self.trust_level,
+            "known_secrets": list(self.known_secrets),
+            "current_goal": self.current_goal,
+            "memories": list(self.memories)
+        }
+
+    def copy(self) -> 'NPCState':
+        """Independent state sharing this one's values"""
+        state = NPCState.__new__(NPCState)
+        for name in self.__slots__:
+            setattr(state, name, getattr(self, name))
+        return state
+
+    def set_mood(self, mood: str):
+        self.mood = _intern(mood)
+
+    def set_goal(self, goal: Optional[str]):
+        self.current_goal = _intern(goal)
+
+    def add_secret(self, secret: str):
+        self.known_secrets += (secret,)
+
+    def add_memory(self, memory: str):
+        """Remember something, dropping the oldest memories beyond the limit"""
+        self.memories = (self.memories + (memory,))[-NPC_STATE_MEMORY_LIMIT:]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, NPCState):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"NPCState({self.to_dict()})"
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """Share one copy of repeated strings such as moods across sessions"""
+    return sys.intern(value) if isinstance(value, str) else value
@@ -0,0 +1,187 @@
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+import threading
+
+PERSISTENCE_ENABLED = os.getenv("PERSISTENCE_ENABLED", "false").lower() == "true"
+PERSISTENCE_DIR = os.getenv("PERSISTENCE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "sessions"))
+GROUP_COMMIT_INTERVAL_SECONDS = float(os.getenv("GROUP_COMMIT_INTERVAL_SECONDS", "0.05"))
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "200"))  # Log entries between snapshots
+
+SNAPSHOT_FILE = "snapshot.json"
+LOG_FILE = "log.jsonl"
+
+_SAFE_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# (snapshot state or None, log entries after it in order)
+JournalContents = Tuple[Optional[Dict], List[Dict]]
+
+class SessionJournal:
+    """Append-only mutation log and snapshots for a single session"""
+
+    def __init__(self, engine: 'PersistenceEngine', directory: str):
+        self.engine = engine
+        self.directory = directory
+        self.sequence = 0
+        self.entries_since_snapshot = 0
+
+    def load(self) -> Optional[JournalContents]:
+        """
+        Read the latest snapshot and the log entries recorded after it
+
+        Returns:
+            None if nothing was persisted, else (snapshot state or None, log entries in order)
+        """
+        # Writes still queued from an earlier copy of this session belong in what is read back
+        self.engine.flush(self.directory)
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        log_path = os.path.join(self.directory, LOG_FILE)
+        if not os.path.exists(snapshot_path) and not os.path.exists(log_path):
+            return None
+
+        snapshot = None
+        snapshot_sequence = 0
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r') as f:
+                data = json.load(f)
+            snapshot = data["state"]
+            snapshot_sequence = data["sequence"]
+
+        entries = []
+        if os.path.exists(log_path):
+            with open(log_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final write from a crash; everything before it is intact
+                        break
+                    if entry["seq"] > snapshot_sequence:
+                        entries.append(entry)
+
+        self.sequence = entries[-1]["seq"] if entries else snapshot_sequence
+        self.entries_since_snapshot = len(entries)
+        return snapshot, entries
+
+    def append(self, op: str, payload: Dict):
+        """Queue a mutation for the next group commit"""
+        self.sequence += 1
+        self.entries_since_snapshot += 1
+        line = json.dumps({"seq": self.sequence, "op": op, "payload": payload})
+        self.engine.submit(self.directory, "log", line + "\n")
+
+    def needs_snapshot(self) -> bool:
+        """Whether enough entries have been logged to warrant a new snapshot"""
+        return self.entries_since_snapshot >= self.engine.snapshot_interval
+
+    def snapshot(self, state: Dict):
+        """Queue a snapshot covering every entry appended so far"""
+        data = json.dumps({"sequence": self.sequence, "state": state})
+        self.entries_since_snapshot = 0
+        self.engine.submit(self.directory, "snapshot", data)
+
+    def flush(self):
+        """Write and fsync this session's queued entries now"""
+        self.engine.flush(self.directory)
+
+class PersistenceEngine:
+    """Writes session journals to disk from one background thread, batching fsyncs per commit interval"""
+
+    def __init__(
+        self,
+        data_dir: str = PERSISTENCE_DIR,
+        group_commit_interval: float = GROUP_COMMIT_INTERVAL_SECONDS,
+        snapshot_interval: int = SNAPSHOT_INTERVAL
+    ):
+        self.data_dir = data_dir
+        self.group_commit_interval = group_commit_interval
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(data_dir, exist_ok=True)
+        # (directory, kind, data) in submission order
+        self._pending: List[Tuple[str, str, str]] = []
+        self._lock = threading.Lock()
+        # Held while writing, so flushes from different threads land in submission order
+        self._write_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="game-persistence", daemon=True)
+        self._thread.start()
+
+    def journal(self, session_id: str) -> SessionJournal:
+        """Get the journal for a session"""
+        if _SAFE_SESSION_ID.match(session_id):
+            name = session_id
+        else:
+            name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return SessionJournal(self, os.path.join(self.data_dir, name))
+
+    def submit(self, directory: str, kind: str, data: str):
+        """Queue a log line or snapshot for the next commit"""
+        with self._lock:
+            self._pending.append((directory, kind, data))
+
+    def pending(self) -> int:
+        """Writes queued for the next commit"""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self, directory: Optional[str] = None):
+        """Write and fsync everything queued so far, or only what is queued for one session directory"""
+        with self._write_lock:
+            with self._lock:
+                if directory is None:
+                    pending, self._pending = self._pending, []
+                else:
+                    pending = [item for item in self._pending if item[0] == directory]
+                    self._pending = [item for item in self._pending if item[0] != directory]
+            if pending:
+                self._write(pending)
+
+    def _write(self, pending: List[Tuple[str, str, str]]):
+        # Consecutive log lines per directory are written together, then fsync'd once
+        log_buffers: Dict[str, List[str]] = {}
+        for directory, kind, data in pending:
+            if kind == "log":
+                log_buffers.setdefault(directory, []).append(data)
+            else:
+                # Earlier lines must be durable before the snapshot replaces them
+                if directory in log_buffers:
+                    self._append_log(directory, log_buffers.pop(directory))
+                self._write_snapshot(directory, data)
+        for directory, lines in log_buffers.items():
+            self._append_log(directory, lines)
+
+    def close(self):
+        """Stop the writer thread after a final flush"""
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.group_commit_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error persisting game state: {e}")
+
+    def _append_log(self, directory: str, lines: List[str]):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, LOG_FILE), 'a') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_snapshot(self, directory: str, data: str):
+        os.makedirs(directory, exist_ok=True)
+        snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        temp_path = snapshot_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, snapshot_path)
+        # The snapshot covers the whole log; entries at or below its sequence are skipped on load anyway
+        with open(os.path.join(directory, LOG_FILE), 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,82 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import os
+import time
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "300"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "256"))  # Remembered keys per session
+
+class SingleFlight:
+    """Runs identical concurrent calls once and gives every caller the same result"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.shared = 0
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable]) -> Tuple[Any, bool]:
+        """
+        Run a call, or join the identical one already in flight
+
+        The call runs in its own task, so a caller that goes away does not
+        cancel it for the others.
+
+        Args:
+            key: Identity of the call
+            call: Starts the call when nothing with this key is in flight
+
+        Returns:
+            Tuple: (result, whether it was shared with an earlier caller)
+        """
+        future = self._calls.get(key)
+        shared = future is not None
+        if future is None:
+            future = asyncio.ensure_future(call())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(future), shared
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different request"""
+
+class IdempotencyCache:
+    """Results of completed requests by client-supplied key, kept for a short window"""
+
+    def __init__(self, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        # key -> (stored_at, request fingerprint, result), oldest first
+        self._results: "OrderedDict[str, Tuple[float, Hashable, Any]]" = OrderedDict()
+
+    def get(self, key: str, fingerprint: Hashable) -> Optional[Any]:
+        """
+        Look up the stored result for a key
+
+        Raises:
+            IdempotencyConflict: If the key was used for a request with a different fingerprint
+        """
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        stored_at, stored_fingerprint, result = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._results[key]
+            return None
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyConflict(key)
+        return result
+
+    def put(self, key: str, fingerprint: Hashable, result: Any):
+        """Store a request's result under its key"""
+        self._results[key] = (time.monotonic(), fingerprint, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_keys:
+            self._results.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._results)
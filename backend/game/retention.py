@@ -0,0 +1,59 @@
+from typing import Dict, List, Optional
+import os
+
+# Retention limits for history that would otherwise grow for the life of the process
+EVENT_HISTORY_LIMIT = int(os.getenv("EVENT_HISTORY_LIMIT", "50"))  # world_state["events"] per loop
+LOOP_SUMMARY_LIMIT = int(os.getenv("LOOP_SUMMARY_LIMIT", "20"))  # Compacted summaries of past loops
+NPC_STATE_MEMORY_LIMIT = int(os.getenv("NPC_STATE_MEMORY_LIMIT", "20"))  # NPCState.memories
+NPC_DIALOGUE_MEMORY_LIMIT = int(os.getenv("NPC_DIALOGUE_MEMORY_LIMIT", "500"))  # Dialogue memories per NPC
+EVENT_STORE_LIMIT = int(os.getenv("EVENT_STORE_LIMIT", "1000"))  # Queryable events per session, across loops
+CHANGE_LOG_LIMIT = int(os.getenv("CHANGE_LOG_LIMIT", "200"))  # Recent state changes served as deltas
+
+def append_bounded(items: List, item, limit: int) -> List:
+    """
+    Append an item, dropping the oldest entries beyond the limit
+
+    Args:
+        items: List to append to in place
+        item: Item to append
+        limit: Maximum number of items to keep
+
+    Returns:
+        List of the entries that were dropped, oldest first
+    """
+    items.append(item)
+    if len(items) <= limit:
+        return []
+    overflow = items[:len(items) - limit]
+    del items[:len(items) - limit]
+    return overflow
+
+def summarize_events(summary: Optional[Dict], loop: int, events: List[Dict]) -> Dict:
+    """
+    Roll events up into a per-loop summary
+
+    Args:
+        summary: Existing summary for the loop, or None to start one
+        loop: Loop the events belong to
+        events: Events to fold into the summary
+
+    Returns:
+        Dict: The updated summary
+    """
+    if summary is None:
+        summary = {
+            "loop": loop,
+            "event_count": 0,
+            "npc_interactions": {},
+            "first_time": None,
+            "last_time": None
+        }
+    for event in events:
+        summary["event_count"] += 1
+        if npc_id := event.get("npc_id"):
+            summary["npc_interactions"][npc_id] = summary["npc_interactions"].get(npc_id, 0) + 1
+        if timestamp := event.get("timestamp"):
+            if summary["first_time"] is None:
+                summary["first_time"] = timestamp
+            summary["last_time"] = timestamp
+    return summary
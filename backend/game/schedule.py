@@ -0,0 +1,76 @@
+from typing import Dict, List, Tuple
+import os
+import numpy as np
+
+SCHEDULE_SLOT_MINUTES = int(os.getenv("SCHEDULE_SLOT_MINUTES", "15"))  # Resolution of the location timetable
+DAY_MINUTES = 24 * 60
+
+class Schedule:
+    """Where every NPC is over the day, compiled from the registry into an NPC-by-time-slot table"""
+
+    def __init__(self, registry, slot_minutes: int = SCHEDULE_SLOT_MINUTES):
+        self.slot_minutes = slot_minutes
+        self.slot_count = -(-DAY_MINUTES // slot_minutes)
+        self._move_events = None
+        definitions = registry.definitions()
+        self.npc_ids: List[str] = [definition.id for definition in definitions]
+        self.npc_index: Dict[str, int] = {npc_id: row for row, npc_id in enumerate(self.npc_ids)}
+
+        # Every place mentioned in the data, in the order it first appears
+        locations: Dict[str, None] = {}
+        for definition in definitions:
+            locations[definition.location] = None
+            for _, location in definition.schedule:
+                locations[location] = None
+        self.locations: List[str] = list(locations)
+        self.location_index: Dict[str, int] = {location: code for code, location in enumerate(self.locations)}
+
+        # slots[npc, slot] is the code of the NPC's location during that slot
+        self.slots = np.empty((len(self.npc_ids), self.slot_count), dtype=np.int32)
+        for row, definition in enumerate(definitions):
+            self.slots[row, :] = self.location_index[definition.location]
+            for minute, location in definition.schedule:
+                self.slots[row, self.slot(minute):] = self.location_index[location]
+
+        # occupants[slot][location] lists the NPCs there, in registry order; slots
+        # where nobody moves share the previous slot's index
+        self._occupants: List[Dict[str, Tuple[str, ...]]] = []
+        for slot in range(self.slot_count):
+            if slot and np.array_equal(self.slots[:, slot], self.slots[:, slot - 1]):
+                self._occupants.append(self._occupants[-1])
+                continue
+            by_location: Dict[str, List[str]] = {}
+            for row, code in enumerate(self.slots[:, slot].tolist()):
+                by_location.setdefault(self.locations[code], []).append(self.npc_ids[row])
+            self._occupants.append({location: tuple(npc_ids) for location, npc_ids in by_location.items()})
+
+    def slot(self, minute: int) -> int:
+        """Time slot containing a minute of the day; times past midnight stay in the last slot"""
+        return min(max(minute, 0) // self.slot_minutes, self.slot_count - 1)
+
+    def location_of(self, npc_id: str, minute: int) -> str:
+        """Where an NPC is scheduled to be at a minute of the day"""
+        return self.locations[self.slots[self.npc_index[npc_id], self.slot(minute)]]
+
+    def npcs_at(self, location: str, minute: int) -> Tuple[str, ...]:
+        """IDs of the NPCs scheduled to be at a location at a minute of the day"""
+        return self._occupants[self.slot(minute)].get(location, ())
+
+    def moves(self) -> List[Tuple[int, str, str]]:
+        """Every scheduled change of location as (minute, npc_id, location), in time order"""
+        changed_rows, changed_slots = np.nonzero(self.slots[:, 1:] != self.slots[:, :-1])
+        moves = [
+            ((slot + 1) * self.slot_minutes, self.npc_ids[row], self.locations[self.slots[row, slot + 1]])
+            for row, slot in zip(changed_rows.tolist(), changed_slots.tolist())
+        ]
+        moves.sort(key=lambda move: move[0])
+        return moves
+
+    def move_events(self) -> Tuple[Tuple[int, str, Dict], ...]:
+        """The moves as timeline events (minute, "npc_move", data), built once and shared by every session"""
+        if self._move_events is None:
+            self._move_events = tuple(
+                (minute, "npc_move", {"npc_id": npc_id, "location": location})
+                for minute, npc_id, location in self.moves()
+            )
+        return self._move_events
@@ -0,0 +1,437 @@
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+from collections import OrderedDict
+from dataclasses import asdict
+import asyncio
+import copy
+import os
+import secrets
+import threading
+import time
+import weakref
+from .state_manager import GameState
+from .npc_manager import NPCManager
+from .npc_state import NPCState
+from .time_service import TimeService, TimeState
+from .persistence import JournalContents, PersistenceEngine, SessionJournal
+from .change_feed import ChangeFeed
+from .request_dedup import IdempotencyCache, SingleFlight
+from .state_backend import STATE_CAS_RETRIES, StateBackend, StateConflict, StoredSession
+from .world_pack import WorldPack, get_catalog
+from .work_queue import Job, WorkQueue, run_now
+
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "3600"))
+
+T = TypeVar("T")
+
+class GameSession:
+    """One player's isolated game: world state, NPC states and clock"""
+
+    def __init__(
+        self,
+        session_id: str,
+        handler_factory: Optional[Callable] = None,
+        journal: Optional[SessionJournal] = None,
+        state_backend: Optional[StateBackend] = None,
+        world: Optional[WorldPack] = None,
+        work_queue: Optional[WorkQueue] = None,
+        stored: Optional[StoredSession] = None,
+        recovered: Optional[JournalContents] = None
+    ):
+        self.session_id = session_id
+        # Runs this session's bookkeeping after responses, in order; None runs it inline
+        self.work_queue = work_queue
+        self._snapshot_queued = False
+        self.journal = journal
+        # stored is the session's state in state_backend and recovered what journal.load()
+        # returned, both read by the caller; a saved session keeps playing the world it was started in
+        saved = stored[1] if stored is not None else (recovered[0] if recovered is not None else None)
+        if saved is not None and "world" in saved:
+            world = get_catalog().get(saved["world"])
+        self.world = world or get_catalog().default()
+        self.npc_manager = NPCManager(self.world)
+        self.time_service = TimeService(self.npc_manager)
+        self.game_state = GameState(self.npc_manager, self.time_service)
+        # Sessions outside the default world are saved right away so recovery knows their world
+        record_world = saved is None and self.world.id != get_catalog().default_world
+        if handler_factory is None:
+            from ai.npc_handler import NPCHandler
+            handler_factory = lambda npc_manager: NPCHandler(npc_manager=npc_manager)
+        # Dialogue generation and memories for this session's NPCs
+        self.npc_handler = handler_factory(self.npc_manager)
+        # Memories are session state, stored along with the rest of it
+        self.npc_handler.defer = self.defer_transaction
+        if self.journal is not None:
+            if recovered is not None:
+                self._recover(*recovered)
+            elif record_world:
+                self.journal.snapshot(self.snapshot())
+            self.game_state.change_listeners.append(self._journal_change)
+        # Pushes live changes to the session's connected clients
+        self.change_feed = ChangeFeed()
+        self.game_state.change_listeners.append(self._publish_game_change)
+        self.npc_manager.change_listeners.append(self._publish_change)
+        self.time_service.change_listeners.append(self._publish_change)
+        # Guards mutation of this session's state across awaits
+        self.lock = asyncio.Lock()
+        # Collapse duplicate and retried interactions
+        self.single_flight = SingleFlight()
+        self.idempotency = IdempotencyCache()
+        self.last_access = time.monotonic()
+        # Shared with other workers; state_version is the stored version this copy matches
+        self.state_backend = state_backend
+        self.state_version = 0
+        # Ids of the newest event and memory the backend holds; later ones are still to be stored
+        self._stored_event_id = 0
+        self._stored_memory_id = 0
+        # Stored on the first sync, so other workers know the session's world
+        self._unsaved = state_backend is not None and stored is None and record_world
+        if stored is not None:
+            self._apply_stored(stored)
+
+    def touch(self):
+        """Mark the session as recently used"""
+        self.last_access = time.monotonic()
+
+    def reset(self):
+        """Start the next loop while preserving player knowledge"""
+        self.game_state.start_new_loop()
+
+    async def defer(self, name: str, job: Job, idempotent: bool = False):
+        """Run a job once this session's earlier deferred jobs are done, off the response path; see WorkQueue.put"""
+        if self.work_queue is None:
+            await run_now(name, job)
+        else:
+            await self.work_queue.put(self.session_id, name, job, idempotent)
+
+    async def settle(self):
+        """Wait for this session's deferred jobs, so the next interaction sees their effects"""
+        if self.work_queue is not None:
+            await self.work_queue.join(self.session_id)
+
+    async def defer_transaction(self, name: str, mutate: Callable[[], None]):
+        """Defer a mutation of this session's state, applied under the session lock like any other transaction"""
+        async def job():
+            async with self.lock:
+                await self.transaction(mutate)
+
+        await self.defer(name, job)
+
+    async def sync(self):
+        """Catch up with changes other workers stored for this session, storing a new session first"""
+        if self.state_backend is None:
+            return
+        async with self.lock:
+            if self._unsaved:
+                self._unsaved = False
+                await self.transaction(lambda: None)
+            else:
+                await self._sync()
+
+    async def _sync(self):
+        if await asyncio.to_thread(self.state_backend.version, self.session_id) == self.state_version:
+            return
+        stored = await asyncio.to_thread(self.state_backend.load, self.session_id, self._stored_event_id, self._stored_memory_id)
+        if stored is None:
+            return
+        self._apply_stored(stored)
+        # Clients watching this copy missed the changes made elsewhere
+        self.change_feed.publish("resync", {}, self.game_state.version)
+
+    async def transaction(self, mutate: Callable[[], T]) -> T:
+        """
+        Apply a mutation and store the result with compare-and-swap
+
+        Call this while holding the session lock. If another worker stored a
+        newer version first, the session reloads it and the mutation runs
+        again, so mutate must read state through the session each time. Only
+        the events and memories added since the last stored version are written.
+
+        Raises:
+            StateConflict: If every attempt lost the race
+        """
+        if self.state_backend is None:
+            return mutate()
+        for _ in range(STATE_CAS_RETRIES):
+            await self._sync()
+            result = mutate()
+            events = self.game_state.events
+            memories = self.npc_handler.memories_after(self._stored_memory_id)
+            try:
+                version = await asyncio.to_thread(
+                    self.state_backend.compare_and_swap,
+                    self.session_id,
+                    self.state_version,
+                    self.snapshot(history=False),
+                    events.to_list(self._stored_event_id),
+                    events.first_id,
+                    memories,
+                    {npc_id: self.npc_handler.oldest_memory_id(npc_id) for _, npc_id, _ in memories}
+                )
+            except Exception:
+                # The write may or may not have landed; reload before the next mutation
+                self.state_version = -1
+                raise
+            if version is not None:
+                self.state_version = version
+                self._stored_event_id = events.last_id
+                self._stored_memory_id = self.npc_handler.last_memory_id
+                return result
+            # Drop the local change; the next sync always reloads after a lost race
+            self.state_version = -1
+        raise StateConflict(self.session_id)
+
+    def _apply_stored(self, stored: StoredSession):
+        """Load a stored version, keeping the events and memories this copy already has and appending the newer ones"""
+        version, snapshot, events, memories = stored
+        history = self.game_state.events
+        self.restore(snapshot)
+        # Events and memories this copy added without storing them lost the race to the stored ones
+        history.discard_after(self._stored_event_id)
+        history.extend(events)
+        self.game_state.events = history
+        self.npc_handler.discard_memories_after(self._stored_memory_id)
+        self.npc_handler.extend_memories(memories)
+        self._stored_event_id = snapshot["last_event_id"]
+        self._stored_memory_id = self.npc_handler.last_memory_id
+        self.state_version = version
+
+    def snapshot(self, history: bool = True) -> Dict:
+        """
+        Serializable copy of the whole session state
+
+        Args:
+            history: Include the event history and dialogue memories; otherwise
+                only the ids of the newest of each, for backends that store them apart
+        """
+        snapshot = {
+            "world": self.world.id,
+            "game_state": self.game_state.to_dict(),
+            "npcs": {
+                npc_id: {"location": npc.location, "state": npc.state.to_dict()}
+                for npc_id, npc in self.npc_manager.npcs.items()
+            },
+            "time_state": asdict(self.time_service.get_current_time()),
+            "timeline": self.time_service.pending_events()
+        }
+        if history:
+            snapshot["event_history"] = self.game_state.events.to_list()
+            snapshot["memories"] = self.npc_handler.export_memories()
+        else:
+            snapshot["last_event_id"] = self.game_state.events.last_id
+            snapshot["last_memory_id"] = self.npc_handler.last_memory_id
+        return snapshot
+
+    def restore(self, snapshot: Dict):
+        """Load session state from a snapshot"""
+        snapshot = copy.deepcopy(snapshot)
+        for npc_id, npc_data in snapshot["npcs"].items():
+            if npc := self.npc_manager.get_npc(npc_id):
+                npc.state = NPCState.from_dict(npc_data["state"])
+        # NPC locations follow the restored clock
+        self.time_service.restore(TimeState(**snapshot["time_state"]), snapshot.get("timeline"))
+        listeners = self.game_state.change_listeners
+        self.game_state = GameState.from_dict(snapshot["game_state"], self.npc_manager, self.time_service)
+        self.game_state.change_listeners = listeners
+        if "memories" in snapshot:
+            self.npc_handler.import_memories(snapshot["memories"])
+        if "event_history" in snapshot:
+            self.game_state.events.load(snapshot["event_history"])
+        elif "last_event_id" in snapshot:
+            # The events are stored apart from the snapshot; the caller brings them up to date
+            pass
+        else:
+            # Snapshots from before the event store only hold the current loop's events
+            for event in self.game_state.world_state["events"]:
+                hours, minutes = event.get("timestamp", "06:00").split(":")
+                self.game_state.events.add(event, self.game_state.current_loop, int(hours) * 60 + int(minutes))
+
+    def _recover(self, snapshot: Optional[Dict], entries: List[Dict]):
+        """Rebuild state from the latest snapshot plus the log entries after it"""
+        if snapshot is not None:
+            self.restore(snapshot)
+        for entry in entries:
+            self.game_state.apply_change(entry["op"], entry["payload"])
+
+    def _publish_game_change(self, op: str, payload: Dict, top_level: bool):
+        self._publish_change(op, payload)
+
+    def _publish_change(self, op: str, payload: Dict):
+        self.change_feed.publish(op, payload, self.game_state.version, self._coalesce_key(op, payload))
+
+    @staticmethod
+    def _coalesce_key(op: str, payload: Dict) -> Optional[Hashable]:
+        """Changes that only matter in their latest form share a key"""
+        if op in ("npc_state", "update_npc_state"):
+            return ("npc", payload["npc_id"])
+        if op == "npc_moved":
+            return ("npc_location", payload["npc_id"])
+        if op in ("time_advanced", "advance_time"):
+            return ("clock", op)
+        return None
+
+    def _journal_change(self, op: str, payload: Dict, top_level: bool):
+        """Log top-level mutations; nested ones are replayed by their parent"""
+        if not top_level:
+            return
+        self.journal.append(op, payload)
+        if self.journal.needs_snapshot() and not self._snapshot_queued:
+            if self.work_queue is not None and self.work_queue.offer(self.session_id, "journal_snapshot", self._snapshot_journal, idempotent=True):
+                self._snapshot_queued = True
+            else:
+                self.journal.snapshot(self.snapshot())
+
+    def _snapshot_journal(self):
+        """Snapshot whatever the state is by the time the job runs; it covers every entry logged until then"""
+        self._snapshot_queued = False
+        self.journal.snapshot(self.snapshot())
+
+class SessionStore:
+    """Bounded store of game sessions keyed by session token, evicting idle and least recently used sessions"""
+
+    def __init__(
+        self,
+        handler_factory: Optional[Callable] = None,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        idle_seconds: float = SESSION_IDLE_SECONDS,
+        persistence: Optional[PersistenceEngine] = None,
+        state_backend: Optional[StateBackend] = None,
+        work_queue: Optional[WorkQueue] = None
+    ):
+        # Builds a session's NPCHandler from its NPCManager, wiring in shared services
+        self.handler_factory = handler_factory
+        # Evicted sessions are recovered from disk when they come back
+        self.persistence = persistence
+        # Sessions shared with other workers load from and commit to it
+        self.state_backend = state_backend
+        # Shared by every session for work done after responses
+        self.work_queue = work_queue
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        # Ordered from least to most recently used
+        self._sessions: "OrderedDict[str, GameSession]" = OrderedDict()
+        # Evicted sessions still referenced, e.g. by their queued deferred jobs; revived rather than rebuilt
+        self._evicted: "weakref.WeakValueDictionary[str, GameSession]" = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def create(self, world: Optional[WorldPack] = None) -> GameSession:
+        """Create a session under a new random token, playing the given world or the default one"""
+        return self.get_or_create(secrets.token_urlsafe(16), world)
+
+    def get(self, session_id: str) -> Optional[GameSession]:
+        """Get an existing session, or None if it does not exist or has expired"""
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(session_id)
+            if session:
+                session.touch()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def get_or_create(self, session_id: str, world: Optional[WorldPack] = None) -> GameSession:
+        """
+        Get the session for a token, creating it in the given world if needed
+
+        Reads saved state on the calling thread; async code should use open().
+        """
+        with self._lock:
+            session = self._lookup(session_id)
+            if session is None:
+                session = self._add(session_id, world, *self._read(session_id))
+            return session
+
+    async def open(self, session_id: Optional[str] = None, world: Optional[WorldPack] = None) -> GameSession:
+        """
+        Get the session for a token, or create one under a new token if none is given
+
+        Stored state and journals are read off the event loop, and a new
+        session is stored before it is returned.
+        """
+        session_id = session_id or secrets.token_urlsafe(16)
+        with self._lock:
+            session = self._lookup(session_id)
+        if session is not None:
+            return session
+        saved = await asyncio.to_thread(self._read, session_id)
+        with self._lock:
+            session = self._lookup(session_id) or self._add(session_id, world, *saved)
+        await session.sync()
+        return session
+
+    def remove(self, session_id: str) -> bool:
+        """Drop a session"""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def sessions(self) -> List[GameSession]:
+        """The live sessions"""
+        with self._lock:
+            return list(self._sessions.values())
+
+    def session_ids(self) -> List[str]:
+        """Ids of the live sessions"""
+        with self._lock:
+            return list(self._sessions.keys())
+
+    def _lookup(self, session_id: str) -> Optional[GameSession]:
+        """A session held in memory, marked as used; call with the lock held"""
+        self._evict_idle()
+        session = self._sessions.get(session_id) or self._revive(session_id)
+        if session is not None:
+            session.touch()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def _read(self, session_id: str) -> Tuple[Optional[StoredSession], Optional[SessionJournal], Optional[JournalContents]]:
+        """A session's saved state: (stored state, journal, what the journal holds); blocks on I/O"""
+        stored = self.state_backend.load(session_id) if self.state_backend is not None else None
+        journal = self.persistence.journal(session_id) if self.persistence is not None else None
+        recovered = journal.load() if journal is not None else None
+        return stored, journal, recovered
+
+    def _add(
+        self,
+        session_id: str,
+        world: Optional[WorldPack],
+        stored: Optional[StoredSession],
+        journal: Optional[SessionJournal],
+        recovered: Optional[JournalContents]
+    ) -> GameSession:
+        """Build a session and make it the most recently used; call with the lock held"""
+        self._make_room()
+        session = GameSession(
+            session_id, self.handler_factory, journal, self.state_backend, world, self.work_queue, stored, recovered
+        )
+        self._sessions[session_id] = session
+        return session
+
+    def _evict_idle(self):
+        """Drop sessions idle for longer than the timeout, oldest first"""
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_access >= cutoff:
+                break
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        """Drop the least recently used session, writing out its journal first"""
+        session_id, session = self._sessions.popitem(last=False)
+        if session.journal is not None:
+            session.journal.flush()
+        self._evicted[session_id] = session
+
+    def _revive(self, session_id: str) -> Optional[GameSession]:
+        """Take back an evicted session that is still in memory, making room for it"""
+        session = self._evicted.pop(session_id, None)
+        if session is not None:
+            self._make_room()
+            self._sessions[session_id] = session
+        return session
+
+    def _make_room(self):
+        while len(self._sessions) >= self.max_sessions:
+            self._evict_oldest()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
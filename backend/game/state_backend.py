@@ -0,0 +1,248 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+from abc import ABC, abstractmethod
+import json
+import os
+import sqlite3
+import threading
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "")  # "" keeps state in this process only; "memory" or "sqlite"
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "state.db"))
+STATE_CAS_RETRIES = int(os.getenv("STATE_CAS_RETRIES", "5"))  # Attempts per mutation before giving up on a busy session
+
+# (version, snapshot, events in id order, memories in id order)
+StoredSession = Tuple[int, Dict, List[List], List[List]]
+
+class StateConflict(Exception):
+    """A session kept changing underneath a mutation until it ran out of retries"""
+
+class StateBackend(ABC):
+    """
+    Shared, versioned storage of session snapshots
+
+    Every write names the version it was based on and only succeeds if the
+    stored session is still at that version, so workers that share a backend
+    never overwrite each other's changes. Version 0 means no stored state.
+
+    A session's event history is kept apart from its snapshot, as entries
+    [id, loop, minute, event] with increasing ids. A write appends only the
+    events added since the last one, and a load returns only the events after
+    those the reader already has, so neither grows with the whole history.
+    NPC dialogue memories are kept the same way, as entries [id, npc_id,
+    memory], each NPC's trimmed to the ones its holder still keeps.
+    """
+
+    @abstractmethod
+    def version(self, session_id: str) -> int:
+        """The stored version of a session, or 0 if it has none"""
+
+    @abstractmethod
+    def load(self, session_id: str, after_event_id: int = 0, after_memory_id: int = 0) -> Optional[StoredSession]:
+        """
+        The stored state of a session
+
+        Args:
+            session_id: The session
+            after_event_id: Only return events with a higher id, as the caller holds the rest
+            after_memory_id: Only return memories with a higher id, likewise
+
+        Returns:
+            (version, snapshot, events in id order, memories in id order), or None if the session has no stored state
+        """
+
+    @abstractmethod
+    def compare_and_swap(
+        self,
+        session_id: str,
+        expected_version: int,
+        state: Dict,
+        events: Sequence[List] = (),
+        oldest_event_id: int = 0,
+        memories: Sequence[List] = (),
+        oldest_memory_ids: Optional[Dict[str, int]] = None
+    ) -> Optional[int]:
+        """
+        Store a snapshot, new events and new memories if the session is still at the expected version
+
+        Args:
+            session_id: The session
+            expected_version: The stored version the snapshot was based on
+            state: The snapshot
+            events: Events added since that version, in id order
+            oldest_event_id: Events older than this have been dropped and need not be kept
+            memories: Memories added since that version, in id order
+            oldest_memory_ids: Per NPC, memories older than this id have been dropped and need not be kept
+
+        Returns:
+            The new version, or None if another writer got there first
+        """
+
+    def close(self):
+        """Release the backend's resources"""
+
+class InMemoryStateBackend(StateBackend):
+    """Keeps snapshots in this process; for a single worker and for trying out the interface"""
+
+    def __init__(self):
+        # session_id -> (version, JSON snapshot); stored as text so callers can't share mutable state
+        self._sessions: Dict[str, Tuple[int, str]] = {}
+        # session_id -> [(event id, JSON entry)] in id order
+        self._events: Dict[str, List[Tuple[int, str]]] = {}
+        # session_id -> [(memory id, npc_id, JSON entry)] in id order
+        self._memories: Dict[str, List[Tuple[int, str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def version(self, session_id: str) -> int:
+        with self._lock:
+            return self._sessions.get(session_id, (0, None))[0]
+
+    def load(self, session_id: str, after_event_id: int = 0, after_memory_id: int = 0) -> Optional[StoredSession]:
+        with self._lock:
+            stored = self._sessions.get(session_id)
+            events = [entry for event_id, entry in self._events.get(session_id, []) if event_id > after_event_id]
+            memories = [entry for memory_id, _, entry in self._memories.get(session_id, []) if memory_id > after_memory_id]
+        if stored is None:
+            return None
+        return stored[0], json.loads(stored[1]), [json.loads(entry) for entry in events], [json.loads(entry) for entry in memories]
+
+    def compare_and_swap(
+        self,
+        session_id: str,
+        expected_version: int,
+        state: Dict,
+        events: Sequence[List] = (),
+        oldest_event_id: int = 0,
+        memories: Sequence[List] = (),
+        oldest_memory_ids: Optional[Dict[str, int]] = None
+    ) -> Optional[int]:
+        data = json.dumps(state)
+        entries = [(entry[0], json.dumps(entry)) for entry in events]
+        memory_entries = [(entry[0], entry[1], json.dumps(entry)) for entry in memories]
+        oldest_memory_ids = oldest_memory_ids or {}
+        with self._lock:
+            if self._sessions.get(session_id, (0, None))[0] != expected_version:
+                return None
+            self._sessions[session_id] = (expected_version + 1, data)
+            stored = self._events.setdefault(session_id, [])
+            stored.extend(entries)
+            while stored and stored[0][0] < oldest_event_id:
+                stored.pop(0)
+            if memory_entries or oldest_memory_ids:
+                kept = self._memories.get(session_id, []) + memory_entries
+                self._memories[session_id] = [
+                    entry for entry in kept if entry[0] >= oldest_memory_ids.get(entry[1], 0)
+                ]
+            return expected_version + 1
+
+class SQLiteStateBackend(StateBackend):
+    """Snapshots in a SQLite database file that every worker on the host opens"""
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        # WAL lets readers in other workers proceed while one writes
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, state TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS session_events "
+            "(session_id TEXT NOT NULL, event_id INTEGER NOT NULL, entry TEXT NOT NULL, PRIMARY KEY (session_id, event_id))"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS session_memories "
+            "(session_id TEXT NOT NULL, memory_id INTEGER NOT NULL, npc_id TEXT NOT NULL, entry TEXT NOT NULL, "
+            "PRIMARY KEY (session_id, memory_id))"
+        )
+        self._lock = threading.Lock()
+
+    def version(self, session_id: str) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def load(self, session_id: str, after_event_id: int = 0, after_memory_id: int = 0) -> Optional[StoredSession]:
+        with self._lock:
+            # One read transaction, so the events and memories match the snapshot's version
+            self._connection.execute("BEGIN")
+            try:
+                row = self._connection.execute("SELECT version, state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                events = self._connection.execute(
+                    "SELECT entry FROM session_events WHERE session_id = ? AND event_id > ? ORDER BY event_id",
+                    (session_id, after_event_id)
+                ).fetchall()
+                memories = self._connection.execute(
+                    "SELECT entry FROM session_memories WHERE session_id = ? AND memory_id > ? ORDER BY memory_id",
+                    (session_id, after_memory_id)
+                ).fetchall()
+            finally:
+                self._connection.execute("COMMIT")
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), [json.loads(entry) for entry, in events], [json.loads(entry) for entry, in memories]
+
+    def compare_and_swap(
+        self,
+        session_id: str,
+        expected_version: int,
+        state: Dict,
+        events: Sequence[List] = (),
+        oldest_event_id: int = 0,
+        memories: Sequence[List] = (),
+        oldest_memory_ids: Optional[Dict[str, int]] = None
+    ) -> Optional[int]:
+        data = json.dumps(state)
+        entries = [(session_id, entry[0], json.dumps(entry)) for entry in events]
+        memory_entries = [(session_id, entry[0], entry[1], json.dumps(entry)) for entry in memories]
+        trimmed = [(session_id, npc_id, memory_id) for npc_id, memory_id in (oldest_memory_ids or {}).items()]
+        with self._lock:
+            # Take the write lock up front so the version check and the writes are one step
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                if expected_version == 0:
+                    cursor = self._connection.execute(
+                        "INSERT OR IGNORE INTO sessions (session_id, version, state) VALUES (?, 1, ?)",
+                        (session_id, data)
+                    )
+                else:
+                    cursor = self._connection.execute(
+                        "UPDATE sessions SET version = version + 1, state = ? WHERE session_id = ? AND version = ?",
+                        (data, session_id, expected_version)
+                    )
+                if cursor.rowcount != 1:
+                    self._connection.execute("ROLLBACK")
+                    return None
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO session_events (session_id, event_id, entry) VALUES (?, ?, ?)", entries
+                )
+                self._connection.execute(
+                    "DELETE FROM session_events WHERE session_id = ? AND event_id < ?", (session_id, oldest_event_id)
+                )
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO session_memories (session_id, memory_id, npc_id, entry) VALUES (?, ?, ?, ?)",
+                    memory_entries
+                )
+                self._connection.executemany(
+                    "DELETE FROM session_memories WHERE session_id = ? AND npc_id = ? AND memory_id < ?", trimmed
+                )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                if self._connection.in_transaction:
+                    self._connection.execute("ROLLBACK")
+                raise
+        return expected_version + 1
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+def create_state_backend(name: str = STATE_BACKEND) -> Optional[StateBackend]:
+    """Build the configured state backend, or None to keep sessions in this process only"""
+    if not name:
+        return None
+    if name == "memory":
+        return InMemoryStateBackend()
+    if name == "sqlite":
+        return SQLiteStateBackend()
+    raise ValueError(f"Unknown state backend: {name}")
@@ -1,53 +1,124 @@
-from typing import Dict, List, Set
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+from collections import deque
 from datetime import datetime, timedelta
+import functools
+import itertools
 import json
+from dataclasses import asdict
+from .retention import (
+    CHANGE_LOG_LIMIT,
+    EVENT_HISTORY_LIMIT,
+    LOOP_SUMMARY_LIMIT,
+    NPC_DIALOGUE_MEMORY_LIMIT,
+    append_bounded,
+    summarize_events
+)
+from .time_service import TimeState
+from .npc_state import NPCState
+from .event_store import EventStore
+
+def mutation(method):
+    """Mark a GameState method as a mutation so nested mutations can be told apart"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._mutation_depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._mutation_depth -= 1
+    return wrapper
 
 class GameState:
-    def __init__(self):
+    def __init__(self, npc_manager=None, time_service=None):
+        if npc_manager is None:
+            from .npc_manager import NPCManager
+            npc_manager = NPCManager()
+        if time_service is None:
+            from .time_service import TimeService
+            time_service = TimeService(npc_manager)
+        # NPC and time state owned by the same session as this game state
+        self.npc_manager = npc_manager
+        self.time_service = time_service
+        # The setting being played: clues to find and where each loop starts
+        self.world = npc_manager.world
         self.current_loop = 1
         self.player_knowledge: Set[str] = set()
         self.discovered_clues: Set[str] = set()
         self.world_state: Dict = {
             "time": "06:00",  # Start at 6 AM
-            "location": "village_square",
+            "location": self.world.start_location,
             "events": [],
             "inventory": [],
             "npc_states": {}
         }
         self.npc_memories: Dict[str, List[Dict]] = {}
+        # Compacted history of earlier events, one entry per loop
+        self.loop_summaries: List[Dict] = []
+        # Queryable history of events across loops
+        self.events = EventStore()
         self.is_game_over = False
         self.victory = False
+        # Called as listener(op, payload, top_level) after every mutation
+        self.change_listeners: List[Callable[[str, Dict, bool], None]] = []
+        self._mutation_depth = 0
+        # Incremented on every mutation; recent changes are kept for delta queries
+        self.version = 0
+        # Entries are (version, op, payload), expanded to dicts only when served
+        self.change_log: Deque[Tuple[int, str, Dict]] = deque(maxlen=CHANGE_LOG_LIMIT)
 
-        # Define the clues needed to solve the mystery
-        self.CLUES = {
-            "murder_weapon": "The murder weapon was a blacksmith's hammer",
-            "last_seen": "The victim was last seen at the inn",
-            "guard_report": "The guard's report mentions a suspicious figure",
-            "elder_knowledge": "The Elder knows more than he lets on",
-            "time_loop": "The time loop is connected to the murder"
-        }
+    def _record(self, op: str, payload: Dict):
+        """Report a completed mutation to the change listeners"""
+        self.version += 1
+        self.change_log.append((self.version, op, payload))
+        # Mutations made from inside another one are replayed by their parent
+        top_level = self._mutation_depth <= 1
+        for listener in self.change_listeners:
+            listener(op, payload, top_level)
+
+    def changes_since(self, version: int) -> Optional[List[Dict]]:
+        """
+        Get the changes made after a version
 
+        Args:
+            version: Last version the caller has seen
+
+        Returns:
+            Changes in order, or None if the change log no longer reaches back to that version
+        """
+        if version == self.version:
+            return []
+        if version > self.version or not self.change_log or self.change_log[0][0] > version + 1:
+            return None
+        start = version + 1 - self.change_log[0][0]
+        return [
+            {"version": entry_version, "op": op, "payload": payload}
+            for entry_version, op, payload in itertools.islice(self.change_log, start, None)
+        ]
+
+    @mutation
     def add_player_knowledge(self, knowledge: str):
         """Add new knowledge to player's memory"""
         self.player_knowledge.add(knowledge)
+        self._record("add_player_knowledge", {"knowledge": knowledge})
 
+    @mutation
     def discover_clue(self, clue_id: str) -> bool:
         """Discover a new clue and check for victory condition"""
-        if clue_id in self.CLUES and clue_id not in self.discovered_clues:
+        if clue_id in self.world.clues and clue_id not in self.discovered_clues:
             self.discovered_clues.add(clue_id)
-            self.add_player_knowledge(self.CLUES[clue_id])
+            self.add_player_knowledge(self.world.clues[clue_id])
 
             # Check for victory condition
-            if len(self.discovered_clues) == len(self.CLUES):
+            if len(self.discovered_clues) == len(self.world.clues):
                 self.victory = True
                 self.is_game_over = True
-                from .time_service import TimeService
-                time_service = TimeService()
-                time_service.mark_murderer_discovered()
+                self.time_service.mark_murderer_discovered()
 
+            self._record("discover_clue", {"clue_id": clue_id})
             return True
         return False
 
+    @mutation
     def handle_death(self, death_reason: str):
         """Handle player death and prepare for next loop"""
         self.add_player_knowledge(f"Died in loop {self.current_loop}: {death_reason}")
@@ -59,40 +130,91 @@ class GameState:
         # Reset for next loop
         self._prepare_next_loop()
 
+    def close_loop(self):
+        """Roll the current loop's remaining events into its summary"""
+        self._compact_events(self.world_state["events"])
+        self.world_state["events"] = []
+
+    def _compact_events(self, events: List[Dict]):
+        """Fold events of the current loop into its summary"""
+        if not events:
+            return
+        summary = None
+        if self.loop_summaries and self.loop_summaries[-1]["loop"] == self.current_loop:
+            summary = self.loop_summaries.pop()
+        summary = summarize_events(summary, self.current_loop, events)
+        append_bounded(self.loop_summaries, summary, LOOP_SUMMARY_LIMIT)
+
     def _prepare_next_loop(self):
         """Prepare the game state for the next loop"""
+        self.close_loop()
         self.current_loop += 1
         self.is_game_over = False
         self.victory = False
 
         # Reset time and location
         self.world_state["time"] = "06:00"
-        self.world_state["location"] = "village_square"
-        self.world_state["events"] = []
+        self.world_state["location"] = self.world.start_location
 
         # Reset NPC states (except for those with memory retention)
-        from .npc_manager import NPCManager
-        npc_manager = NPCManager()
-        npc_manager.reset_states()
+        self.npc_manager.reset_states(self.current_loop - 1)
 
         # Reset time service
-        from .time_service import TimeService
-        time_service = TimeService()
-        time_service.reset()
+        self.time_service.reset()
+        self._record("loop_reset", {"loop": self.current_loop})
 
-    def add_event(self, event: Dict):
-        """Add a new event to the world state"""
-        self.world_state["events"].append(event)
+    @mutation
+    def start_new_loop(self):
+        """Start the next loop from scratch, keeping only player knowledge and loop summaries"""
+        self.close_loop()
+        self.npc_manager.reset_states(self.current_loop)
+        self.time_service.reset()
+        self.current_loop += 1
+        self.discovered_clues = set()
+        self.world_state = {
+            "time": "06:00",
+            "location": self.world.start_location,
+            "events": [],
+            "inventory": [],
+            "npc_states": {}
+        }
+        self.npc_memories = {}
+        self.is_game_over = False
+        self.victory = False
+        self._record("reset_game", {"loop": self.current_loop})
+
+    @mutation
+    def add_event(self, event: Dict, loop: Optional[int] = None, minute: Optional[int] = None):
+        """
+        Add a new event to the world state
+
+        Args:
+            event: The event
+            loop: Loop it happened in, if not the current one
+            minute: Game clock minute it happened at, if not the current one
+        """
+        loop = self.current_loop if loop is None else loop
+        minute = self.time_service.get_current_time().current_minute if minute is None else minute
+        if loop == self.current_loop:
+            # world_state only lists the current loop's events
+            overflow = append_bounded(self.world_state["events"], event, EVENT_HISTORY_LIMIT)
+            self._compact_events(overflow)
+        self.events.add(event, loop, minute)
+        self._record("add_event", {"event": event, "loop": loop, "minute": minute})
 
+    @mutation
     def update_npc_state(self, npc_id: str, state: Dict):
         """Update an NPC's state"""
         self.world_state["npc_states"][npc_id] = state
+        self._record("update_npc_state", {"npc_id": npc_id, "state": state})
 
+    @mutation
     def add_npc_memory(self, npc_id: str, memory: Dict):
         """Add a memory for a specific NPC"""
         if npc_id not in self.npc_memories:
             self.npc_memories[npc_id] = []
-        self.npc_memories[npc_id].append(memory)
+        append_bounded(self.npc_memories[npc_id], memory, NPC_DIALOGUE_MEMORY_LIMIT)
+        self._record("add_npc_memory", {"npc_id": npc_id, "memory": memory})
 
     def get_npc_memories(self, npc_id: str) -> List[Dict]:
         """Get all memories for a specific NPC"""
@@ -101,40 +223,83 @@ class GameState:
     def to_dict(self) -> Dict:
         """Convert game state to dictionary for storage"""
         return {
+            "version": self.version,
             "current_loop": self.current_loop,
             "player_knowledge": list(self.player_knowledge),
             "discovered_clues": list(self.discovered_clues),
             "world_state": self.world_state,
             "npc_memories": self.npc_memories,
+            "loop_summaries": self.loop_summaries,
             "is_game_over": self.is_game_over,
             "victory": self.victory
         }
 
     @classmethod
-    def from_dict(cls, data: Dict) -> 'GameState':
+    def from_dict(cls, data: Dict, npc_manager=None, time_service=None) -> 'GameState':
         """Create game state from dictionary"""
-        state = cls()
+        state = cls(npc_manager, time_service)
         state.current_loop = data["current_loop"]
         state.player_knowledge = set(data["player_knowledge"])
         state.discovered_clues = set(data["discovered_clues"])
         state.world_state = data["world_state"]
         state.npc_memories = data["npc_memories"]
+        state.loop_summaries = data.get("loop_summaries", [])
+        state.version = data.get("version", 0)
         state.is_game_over = data["is_game_over"]
         state.victory = data["victory"]
         return state
 
+    @mutation
     def advance_time(self, minutes: int = 5) -> None:
         """Advance the game time by the specified number of minutes"""
-        from .time_service import TimeService
-        time_service = TimeService()
-        
-        # Convert minutes to hours (rounding up)
-        hours = (minutes + 59) // 60
-        time_service.advance_time(hours)
+        time_service = self.time_service
+        time_service.advance_minutes(round(minutes))
         
         # Update world state time
         self.world_state["time"] = time_service.get_time_string()
+        # The resulting clock is recorded so a replay doesn't depend on NPC trust
+        time_state = asdict(time_service.get_current_time())
         
         # Check if player died during time advancement
         if time_service.get_current_time().is_dead:
-            self.handle_death(time_service.get_current_time().death_reason) 
\ No newline at end of file
+            self.handle_death(time_service.get_current_time().death_reason)
+
+        self._record("advance_time", {"minutes": minutes, "time_state": time_state})
+
+    def apply_change(self, op: str, payload: Dict):
+        """
+        Re-apply a recorded top-level mutation, e.g. when replaying a journal
+
+        Args:
+            op: Mutation name as passed to the change listeners
+            payload: Mutation payload as passed to the change listeners
+        """
+        if op == "add_player_knowledge":
+            self.add_player_knowledge(payload["knowledge"])
+        elif op == "discover_clue":
+            self.discover_clue(payload["clue_id"])
+        elif op == "add_event":
+            self.add_event(payload["event"], payload.get("loop"), payload.get("minute"))
+        elif op == "update_npc_state":
+            self.update_npc_state(payload["npc_id"], payload["state"])
+            # The live NPC manager already held this state when it was recorded
+            if npc := self.npc_manager.get_npc(payload["npc_id"]):
+                self.npc_manager.set_location(npc.id, payload["state"]["location"])
+                npc.state = NPCState.from_dict(payload["state"]["state"])
+        elif op == "add_npc_memory":
+            self.add_npc_memory(payload["npc_id"], payload["memory"])
+        elif op == "advance_time":
+            self._replay_advance_time(payload)
+        elif op == "reset_game":
+            self.start_new_loop()
+        else:
+            raise ValueError(f"Unknown game state change: {op}")
+
+    @mutation
+    def _replay_advance_time(self, payload: Dict):
+        """Restore a recorded clock result, including any death it caused"""
+        self.time_service.restore(TimeState(**payload["time_state"]))
+        self.world_state["time"] = self.time_service.get_time_string()
+        if self.time_service.state.is_dead:
+            self.handle_death(self.time_service.state.death_reason)
+        self._record("advance_time", payload) 
\ No newline at end of file
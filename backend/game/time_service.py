@@ -1,6 +1,7 @@
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from dataclasses import dataclass
 from datetime import datetime, timedelta
+from .timeline import ScheduledEvent, Timeline
 
 @dataclass
 class TimeState:
@@ -8,69 +9,178 @@ class TimeState:
     is_dead: bool
     death_reason: Optional[str]
     discovered_murderer: bool
+    # Minutes since midnight; current_hour is kept in step with it
+    current_minute: Optional[int] = None
+
+    def __post_init__(self):
+        if self.current_minute is None:
+            self.current_minute = self.current_hour * 60
 
 class TimeService:
-    _instance = None
     TOTAL_HOURS = 24
-    DEATH_EVENTS = {
-        12: {"npc_id": "guard", "reason": "Captain Roderick caught you investigating the murder scene"},
-        15: {"npc_id": "blacksmith", "reason": "Gorrik discovered you snooping in his forge"},
-        18: {"npc_id": "innkeeper", "reason": "Mara found you in her secret room"},
-        21: {"npc_id": "elder", "reason": "The Elder caught you trying to break the time loop"}
-    }
-
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(TimeService, cls).__new__(cls)
-            cls._instance.state = TimeState(
-                current_hour=6,  # Start at 6 AM
-                is_dead=False,
-                death_reason=None,
-                discovered_murderer=False
-            )
-        return cls._instance
+    START_HOUR = 6
+
+    def __init__(self, npc_manager=None):
+        if npc_manager is None:
+            from .npc_manager import NPCManager
+            npc_manager = NPCManager()
+        # NPC states whose trust levels decide the death events
+        self.npc_manager = npc_manager
+        self.state = self._initial_state()
+        # Called as listener(op, payload) after the clock changes
+        self.change_listeners: List[Callable[[str, Dict], None]] = []
+        # Handlers for scheduled events, by kind
+        self.event_handlers: Dict[str, Callable[[ScheduledEvent], None]] = {
+            "death_check": self._handle_death_check,
+            "end_of_day": self._handle_end_of_day,
+            "npc_move": self._handle_npc_move,
+            "world_event": self._handle_world_event
+        }
+        # Events put back on the timeline at the start of every loop, as (minute, kind, data)
+        self.recurring_events: List[Tuple[int, str, Dict]] = [
+            (event.minute, "death_check", {"npc_id": event.npc_id, "reason": event.reason})
+            for event in npc_manager.world.death_events
+        ]
+        self.recurring_events.extend(npc_manager.schedule.move_events())
+        self.timeline = Timeline()
+        self._schedule_loop()
+        npc_manager.apply_schedule(self.state.current_minute)
+
+    def _initial_state(self) -> TimeState:
+        return TimeState(
+            current_hour=self.START_HOUR,  # Start at 6 AM
+            is_dead=False,
+            death_reason=None,
+            discovered_murderer=False
+        )
+
+    def _notify(self, op: str, payload: Dict):
+        for listener in self.change_listeners:
+            listener(op, payload)
+
+    def _schedule_loop(self):
+        """Fill the timeline with this loop's events that are still ahead of the clock"""
+        self.timeline.clear()
+        self.timeline.schedule(self.TOTAL_HOURS * 60, "end_of_day")
+        for minute, kind, data in self.recurring_events:
+            self.timeline.schedule(minute, kind, data)
+        self.timeline.discard_until(self.state.current_minute)
+
+    def schedule(self, minute: int, kind: str, data: Optional[Dict] = None, recurring: bool = False) -> Optional[ScheduledEvent]:
+        """
+        Schedule a world event
+
+        Args:
+            minute: Minutes since midnight at which the event is due
+            kind: One of the event_handlers kinds
+            data: Event payload for the handler
+            recurring: Repeat the event in every later loop as well
+
+        Returns:
+            The event scheduled in the current loop, or None if its time has already passed
+        """
+        if kind not in self.event_handlers:
+            raise ValueError(f"Unknown timeline event kind: {kind}")
+        data = data or {}
+        if recurring:
+            self.recurring_events.append((minute, kind, data))
+        if minute <= self.state.current_minute:
+            return None
+        return self.timeline.schedule(minute, kind, data)
 
     def get_current_time(self) -> TimeState:
         return self.state
 
-    def advance_time(self, hours: int = 1) -> None:
+    def advance_time(self, hours: float = 1) -> None:
+        """Advance the clock by a number of hours"""
+        self.advance_minutes(round(hours * 60))
+
+    def advance_minutes(self, minutes: int) -> None:
+        """
+        Advance the clock, running every scheduled event in the elapsed interval in time order
+
+        The clock stops at the moment the player dies.
+        """
         if self.state.is_dead:
             return
 
-        self.state.current_hour += hours
-        
-        # Check for death events
-        if self.state.current_hour in self.DEATH_EVENTS:
-            death_event = self.DEATH_EVENTS[self.state.current_hour]
-            from .npc_manager import NPCManager
-            npc_manager = NPCManager()
-            npc = npc_manager.get_npc(death_event["npc_id"])
-            
-            # Only trigger death if trust level is too low
-            if npc and npc.state["trust_level"] < 50:
-                self.state.is_dead = True
-                self.state.death_reason = death_event["reason"]
-
-        # Check for end of day
-        if self.state.current_hour >= self.TOTAL_HOURS:
-            if not self.state.discovered_murderer:
-                self.state.is_dead = True
-                self.state.death_reason = "The day ended without discovering the murderer"
+        target = self.state.current_minute + minutes
+        for event in self.timeline.pop_due(target):
+            self._set_minute(event.minute)
+            self.event_handlers[event.kind](event)
+            if self.state.is_dead:
+                break
+        else:
+            self._set_minute(target)
+
+        self._notify("time_advanced", {
+            "hour": self.state.current_hour,
+            "minute": self.state.current_minute,
+            "minutes": minutes
+        })
+        if self.state.is_dead:
+            self._notify("death", {"hour": self.state.current_hour, "reason": self.state.death_reason})
+
+    def _set_minute(self, minute: int):
+        self.state.current_minute = minute
+        self.state.current_hour = minute // 60
+
+    def _handle_death_check(self, event: ScheduledEvent):
+        npc = self.npc_manager.get_npc(event.data["npc_id"])
+        # Only trigger death if trust level is too low
+        if npc and npc.state.trust_level < 50:
+            self.state.is_dead = True
+            self.state.death_reason = event.data["reason"]
+
+    def _handle_end_of_day(self, event: ScheduledEvent):
+        if not self.state.discovered_murderer:
+            self.state.is_dead = True
+            self.state.death_reason = "The day ended without discovering the murderer"
+
+    def _handle_npc_move(self, event: ScheduledEvent):
+        self.npc_manager.update_npc_location(event.data["npc_id"], event.data["location"])
+
+    def _handle_world_event(self, event: ScheduledEvent):
+        self._notify("world_event", dict(event.data, minute=event.minute))
 
     def reset(self) -> None:
-        self.state = TimeState(
-            current_hour=6,
-            is_dead=False,
-            death_reason=None,
-            discovered_murderer=False
-        )
+        self.state = self._initial_state()
+        self._schedule_loop()
+        self.npc_manager.apply_schedule(self.state.current_minute)
+        self._notify("time_reset", {"hour": self.state.current_hour})
+
+    def pending_events(self) -> List[Dict]:
+        """The events still scheduled in this loop, earliest first, in a form restore() accepts"""
+        return [{"minute": event.minute, "kind": event.kind, "data": event.data} for event in self.timeline.pending()]
+
+    def restore(self, state: TimeState, pending_events: Optional[List[Dict]] = None) -> None:
+        """
+        Load a saved clock
+
+        Args:
+            state: The clock to resume from
+            pending_events: The saved timeline, as from pending_events(). Without
+                one, a clock later in the same loop keeps the events still ahead of
+                it, and an earlier one reschedules the loop's recurring events
+        """
+        previous_minute = self.state.current_minute
+        self.state = state
+        if pending_events is not None:
+            self.timeline.clear()
+            for event in pending_events:
+                self.timeline.schedule(event["minute"], event["kind"], event["data"])
+        elif state.current_minute >= previous_minute:
+            self.timeline.discard_until(state.current_minute)
+        else:
+            self._schedule_loop()
+        self.npc_manager.apply_schedule(state.current_minute)
 
     def mark_murderer_discovered(self) -> None:
         self.state.discovered_murderer = True
 
     def get_time_string(self) -> str:
-        """Convert current hour to time string (e.g., '08:00')"""
-        return f"{self.state.current_hour:02d}:00"
+        """Convert current time to time string (e.g., '08:30')"""
+        return f"{self.state.current_minute // 60:02d}:{self.state.current_minute % 60:02d}"
 
     def is_night(self) -> bool:
         """Check if it's night time (between 20:00 and 06:00)"""
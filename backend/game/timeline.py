@@ -0,0 +1,58 @@
+from typing import Dict, Iterator, List, NamedTuple, Optional
+import heapq
+import itertools
+
+class ScheduledEvent(NamedTuple):
+    """A world event due at a minute of the day"""
+    minute: int
+    # Unique, so events order by (minute, sequence): those due at the same minute run in the order they were scheduled
+    sequence: int
+    kind: str
+    data: Dict
+
+class Timeline:
+    """Min-heap of scheduled world events, taken in time order as the clock advances"""
+
+    def __init__(self):
+        self._heap: List[ScheduledEvent] = []
+        self._sequence = itertools.count()
+
+    def schedule(self, minute: int, kind: str, data: Optional[Dict] = None) -> ScheduledEvent:
+        """
+        Add an event to the timeline
+
+        Args:
+            minute: Minutes since midnight at which the event is due
+            kind: Event kind, used to pick its handler
+            data: Event payload
+
+        Returns:
+            ScheduledEvent: The scheduled event
+        """
+        event = ScheduledEvent(minute, next(self._sequence), kind, data or {})
+        heapq.heappush(self._heap, event)
+        return event
+
+    def pop_due(self, until_minute: int) -> Iterator[ScheduledEvent]:
+        """Take events due at or before a minute, earliest first; stopping early leaves the rest scheduled"""
+        while self._heap and self._heap[0].minute <= until_minute:
+            yield heapq.heappop(self._heap)
+
+    def discard_until(self, minute: int) -> int:
+        """Drop events due at or before a minute without running them; returns how many were dropped"""
+        return sum(1 for _ in self.pop_due(minute))
+
+    def next_minute(self) -> Optional[int]:
+        """When the earliest pending event is due, or None if nothing is scheduled"""
+        return self._heap[0].minute if self._heap else None
+
+    def pending(self) -> List[ScheduledEvent]:
+        """Every scheduled event, earliest first"""
+        return sorted(self._heap)
+
+    def clear(self):
+        """Remove every scheduled event"""
+        self._heap.clear()
+
+    def __len__(self) -> int:
+        return len(self._heap)
@@ -0,0 +1,172 @@
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple, Union
+from collections import deque
+import asyncio
+import contextvars
+import inspect
+import os
+
+WORK_QUEUE_SESSION_LIMIT = int(os.getenv("WORK_QUEUE_SESSION_LIMIT", "64"))  # Queued jobs per session before callers wait
+WORK_QUEUE_MAX_PENDING = int(os.getenv("WORK_QUEUE_MAX_PENDING", "2000"))  # Queued jobs across all sessions
+WORK_QUEUE_RETRIES = int(os.getenv("WORK_QUEUE_RETRIES", "3"))  # Extra attempts for a failing idempotent job
+WORK_QUEUE_RETRY_DELAY_SECONDS = float(os.getenv("WORK_QUEUE_RETRY_DELAY_SECONDS", "0.05"))  # Doubles per attempt
+WORK_QUEUE_DRAIN_SECONDS = float(os.getenv("WORK_QUEUE_DRAIN_SECONDS", "10"))  # Time allowed to finish queued work on shutdown
+
+# A job is a plain or async function taking no arguments
+Job = Callable[[], Union[None, Awaitable[None]]]
+
+async def run_now(name: str, job: Job):
+    """Run a job immediately; the stand-in when there is no work queue"""
+    result = job()
+    if inspect.isawaitable(result):
+        await result
+
+class WorkQueue:
+    """
+    Runs bookkeeping after a response has been sent, in order per session
+
+    Each key (a session id) has its own lane of jobs run one after another,
+    so a session's memory, event and persistence updates land in the order
+    they were queued while different sessions proceed independently. Failing
+    jobs marked idempotent are retried with backoff, holding up only their own
+    lane; any other job may have partly applied before it failed, so it is
+    logged and dropped rather than run twice. Lanes are bounded: put() waits
+    for room, and offer() declines so the caller can do the work itself.
+    """
+
+    def __init__(
+        self,
+        session_limit: int = WORK_QUEUE_SESSION_LIMIT,
+        max_pending: int = WORK_QUEUE_MAX_PENDING,
+        retries: int = WORK_QUEUE_RETRIES,
+        retry_delay: float = WORK_QUEUE_RETRY_DELAY_SECONDS
+    ):
+        self.session_limit = session_limit
+        self.max_pending = max_pending
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # key -> (name, job, idempotent) in order; a lane's running job stays at its head until it finishes
+        self._lanes: Dict[Hashable, Deque[Tuple[str, Job, bool]]] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+        self._pending = 0
+        # Woken whenever a job finishes or the queue closes, to re-check what they wait for
+        self._waiters: List[asyncio.Future] = []
+        self.closed = False
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def put(self, key: Hashable, name: str, job: Job, idempotent: bool = False):
+        """
+        Queue a job behind the key's earlier jobs, waiting while the queue is full
+
+        Pass idempotent=True only for a job that is safe to run again after it
+        failed part way; only those are retried. Don't call this while holding
+        a lock that queued jobs take.
+        """
+        await self._wait_until(lambda: self.closed or not self._full(key))
+        if self.closed and key not in self._workers:
+            # Shutting down with nothing queued for this key: no reason to defer
+            await self._execute(name, job, idempotent)
+            return
+        self._enqueue(key, name, job, idempotent)
+
+    def offer(self, key: Hashable, name: str, job: Job, idempotent: bool = False) -> bool:
+        """
+        Queue a job if there is room, without waiting; idempotent as for put()
+
+        Returns:
+            bool: False if the job was not queued and should be run by the caller
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self.closed or self._full(key):
+            return False
+        self._enqueue(key, name, job, idempotent)
+        return True
+
+    async def join(self, key: Optional[Hashable] = None):
+        """Wait until everything queued for a key, or for every key, has run"""
+        if key is None:
+            await self._wait_until(lambda: not self._workers)
+        else:
+            await self._wait_until(lambda: key not in self._workers)
+
+    async def close(self, timeout: float = WORK_QUEUE_DRAIN_SECONDS):
+        """Stop deferring new work and finish what is queued, giving up after the timeout"""
+        self.closed = True
+        self._wake()
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Error draining background work: {self._pending} jobs dropped after {timeout}s")
+            for worker in list(self._workers.values()):
+                worker.cancel()
+
+    def pending(self) -> int:
+        """Jobs queued or running"""
+        return self._pending
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self._pending,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+
+    def _full(self, key: Hashable) -> bool:
+        return self._pending >= self.max_pending or len(self._lanes.get(key, ())) >= self.session_limit
+
+    def _enqueue(self, key: Hashable, name: str, job: Job, idempotent: bool):
+        self._lanes.setdefault(key, deque()).append((name, job, idempotent))
+        self._pending += 1
+        if key not in self._workers:
+            # Start from an empty context so jobs aren't attributed to the request that queued them
+            self._workers[key] = contextvars.Context().run(asyncio.ensure_future, self._run_lane(key))
+
+    async def _run_lane(self, key: Hashable):
+        lane = self._lanes[key]
+        try:
+            while lane:
+                # Let the request that queued the job respond first
+                await asyncio.sleep(0)
+                name, job, idempotent = lane[0]
+                await self._execute(name, job, idempotent)
+                lane.popleft()
+                self._pending -= 1
+                self._wake()
+        finally:
+            self._pending -= len(lane)
+            del self._lanes[key]
+            del self._workers[key]
+            self._wake()
+
+    async def _execute(self, name: str, job: Job, idempotent: bool):
+        """Run a job, retrying an idempotent one with exponential backoff; a job that keeps failing is logged and dropped"""
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            try:
+                await run_now(name, job)
+                self.completed += 1
+                return
+            except Exception as e:
+                if attempt == attempts - 1:
+                    self.failed += 1
+                    print(f"Error in background job {name} after {attempt + 1} attempts: {e}")
+                    return
+                self.retried += 1
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    async def _wait_until(self, condition: Callable[[], bool]):
+        while not condition():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
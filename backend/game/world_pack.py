@@ -0,0 +1,356 @@
+"""
+World packs: a setting's NPCs, locations, clues and timeline in one directory
+
+A pack is a directory under WORLD_PACKS_DIR holding world.json (locations,
+clues, death events, start location) and npcs.json. Packs are validated once
+and cached as plain JSON named by the hash of their source files, so later
+loads, in this process or the next, skip validation. The cache holds only
+data, so a tampered cache file can at worst fail to load.
+Packs load on first use and are reloaded when their files change; sessions
+already running keep the pack they started with.
+"""
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from .npc_registry import NPCDefinition, NPCRegistry
+from .npc_state import NPCState
+
+GAME_DIR = os.path.dirname(os.path.abspath(__file__))
+WORLD_PACKS_DIR = os.getenv("WORLD_PACKS_DIR", os.path.join(GAME_DIR, "worlds"))
+WORLD_CACHE_DIR = os.getenv("WORLD_CACHE_DIR", os.path.join(os.path.dirname(GAME_DIR), "data", "world_cache"))
+DEFAULT_WORLD = os.getenv("DEFAULT_WORLD", "default")
+WORLD_RELOAD_CHECK_SECONDS = float(os.getenv("WORLD_RELOAD_CHECK_SECONDS", "2"))  # 0 checks on every use
+
+WORLD_FILE = "world.json"
+NPCS_FILE = "npcs.json"
+# Bump when the compiled form changes so stale caches are ignored
+PACK_FORMAT_VERSION = 3
+
+class WorldPackError(ValueError):
+    """A world pack is missing or invalid"""
+
+@dataclass(frozen=True)
+class DeathEvent:
+    """The player dies at this minute of the day unless the NPC trusts them enough"""
+    minute: int
+    npc_id: str
+    reason: str
+
+@dataclass(frozen=True)
+class WorldPack:
+    """A compiled setting, shared by every session playing it"""
+    id: str
+    name: str
+    description: str
+    # Hash of the pack's source files; names the compiled cache
+    content_hash: str
+    registry: NPCRegistry
+    # Location ids in display order, and their names
+    locations: Tuple[str, ...]
+    location_names: Dict[str, str]
+    start_location: str
+    clues: Dict[str, str]
+    death_events: Tuple[DeathEvent, ...]
+
+def compile_pack(world_id: str, directory: str, content_hash: str) -> WorldPack:
+    """
+    Validate a pack's source files and build the pack
+
+    Raises:
+        WorldPackError: If a file is missing or malformed, or names an unknown NPC or location
+    """
+    world = _read_json(world_id, os.path.join(directory, WORLD_FILE))
+    npc_data = _read_json(world_id, os.path.join(directory, NPCS_FILE))
+    try:
+        registry = NPCRegistry.from_dict(npc_data, world_id)
+        locations = [(entry["id"], entry.get("name", entry["id"])) for entry in world["locations"]]
+        location_ids = [location_id for location_id, _ in locations]
+        start_location = world["start_location"]
+        clues = dict(world["clues"])
+        death_events = tuple(sorted(
+            (DeathEvent(_parse_minute(event["time"]), event["npc_id"], event["reason"]) for event in world.get("death_events", [])),
+            key=lambda event: event.minute
+        ))
+    except (KeyError, TypeError, ValueError) as e:
+        raise WorldPackError(f"World pack '{world_id}' is invalid: {e}")
+
+    problems = []
+    if len(set(location_ids)) != len(location_ids):
+        problems.append("locations has duplicate ids")
+    if start_location not in location_ids:
+        problems.append(f"start_location '{start_location}' is not a declared location")
+    for location in registry.locations():
+        if location not in location_ids:
+            problems.append(f"NPC data mentions undeclared location '{location}'")
+    for event in death_events:
+        if registry.get(event.npc_id) is None:
+            problems.append(f"death event at {event.minute // 60:02d}:{event.minute % 60:02d} names unknown NPC '{event.npc_id}'")
+    if not clues:
+        problems.append("clues is empty")
+    if problems:
+        raise WorldPackError(f"World pack '{world_id}' is invalid: " + "; ".join(problems))
+
+    return WorldPack(
+        id=world_id,
+        name=world.get("name", world_id),
+        description=world.get("description", ""),
+        content_hash=content_hash,
+        registry=registry,
+        locations=tuple(location_ids),
+        location_names=dict(locations),
+        start_location=start_location,
+        clues=clues,
+        death_events=death_events
+    )
+
+def pack_to_dict(pack: WorldPack) -> Dict:
+    """Plain, JSON-serializable form of a compiled pack"""
+    return {
+        "format": PACK_FORMAT_VERSION,
+        "id": pack.id,
+        "name": pack.name,
+        "description": pack.description,
+        "content_hash": pack.content_hash,
+        "locations": [[location_id, pack.location_names[location_id]] for location_id in pack.locations],
+        "start_location": pack.start_location,
+        "clues": pack.clues,
+        "death_events": [[event.minute, event.npc_id, event.reason] for event in pack.death_events],
+        "npcs": [
+            {
+                "id": definition.id,
+                "name": definition.name,
+                "description": definition.description,
+                "location": definition.location,
+                "personality": {key: list(values) for key, values in definition.personality.items()},
+                "initial_state": definition.initial_state.to_dict(),
+                "schedule": [list(move) for move in definition.schedule],
+                "keeps_memories": definition.keeps_memories,
+                "responses": definition.responses
+            }
+            for definition in pack.registry.definitions()
+        ]
+    }
+
+def pack_from_dict(data: Dict) -> WorldPack:
+    """
+    Rebuild a pack from pack_to_dict() output, without validating it again
+
+    Raises:
+        KeyError, TypeError, ValueError: If the data is not in the current format
+    """
+    if data["format"] != PACK_FORMAT_VERSION:
+        raise ValueError(f"world pack format {data['format']}")
+    definitions = {
+        npc["id"]: NPCDefinition(
+            id=npc["id"],
+            name=npc["name"],
+            description=npc["description"],
+            location=npc["location"],
+            personality={key: tuple(values) for key, values in npc["personality"].items()},
+            initial_state=NPCState.from_dict(npc["initial_state"]),
+            schedule=tuple((minute, location) for minute, location in npc["schedule"]),
+            keeps_memories=npc["keeps_memories"],
+            responses=dict(npc["responses"])
+        )
+        for npc in data["npcs"]
+    }
+    return WorldPack(
+        id=data["id"],
+        name=data["name"],
+        description=data["description"],
+        content_hash=data["content_hash"],
+        registry=NPCRegistry(definitions, data["id"]),
+        locations=tuple(location_id for location_id, _ in data["locations"]),
+        location_names={location_id: name for location_id, name in data["locations"]},
+        start_location=data["start_location"],
+        clues=dict(data["clues"]),
+        death_events=tuple(DeathEvent(minute, npc_id, reason) for minute, npc_id, reason in data["death_events"])
+    )
+
+def _read_json(world_id: str, path: str) -> Dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise WorldPackError(f"World pack '{world_id}' has no {os.path.basename(path)}")
+    except json.JSONDecodeError as e:
+        raise WorldPackError(f"World pack '{world_id}' has malformed {os.path.basename(path)}: {e}")
+
+def _parse_minute(value: str) -> int:
+    """Minutes since midnight for a time given as HH:MM"""
+    hours, minutes = value.split(":")
+    minute = int(hours) * 60 + int(minutes)
+    if not 0 <= minute < 24 * 60:
+        raise ValueError(f"time outside the day: {value}")
+    return minute
+
+class _Loaded:
+    """A loaded pack and what its source files looked like when it was loaded"""
+    __slots__ = ("pack", "signature", "checked_at")
+
+    def __init__(self, pack: WorldPack, signature: Tuple, checked_at: float):
+        self.pack = pack
+        self.signature = signature
+        self.checked_at = checked_at
+
+class WorldCatalog:
+    """The available world packs, each loaded on first use and reloaded when its files change"""
+
+    def __init__(
+        self,
+        root: str = WORLD_PACKS_DIR,
+        cache_dir: Optional[str] = WORLD_CACHE_DIR,
+        default_world: str = DEFAULT_WORLD,
+        reload_check_seconds: float = WORLD_RELOAD_CHECK_SECONDS
+    ):
+        self.root = root
+        # None disables the compiled cache
+        self.cache_dir = cache_dir
+        self.default_world = default_world
+        self.reload_check_seconds = reload_check_seconds
+        self._loaded: Dict[str, _Loaded] = {}
+        self._lock = threading.Lock()
+        self.compiles = 0
+        self.cache_loads = 0
+
+    def ids(self) -> List[str]:
+        """Ids of the packs on disk, without loading any of them"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name, WORLD_FILE))
+        )
+
+    def default(self) -> WorldPack:
+        return self.get(self.default_world)
+
+    def get(self, world_id: str) -> WorldPack:
+        """
+        The current version of a pack, loading or reloading it if needed
+
+        Raises:
+            WorldPackError: If there is no such pack or it is invalid
+        """
+        with self._lock:
+            loaded = self._loaded.get(world_id)
+            now = time.monotonic()
+            if loaded is not None and now - loaded.checked_at < self.reload_check_seconds:
+                return loaded.pack
+            directory = self._directory(world_id)
+            signature = self._signature(world_id, directory)
+            if loaded is not None and signature == loaded.signature:
+                loaded.checked_at = now
+                return loaded.pack
+            try:
+                pack = self._load(world_id, directory)
+            except WorldPackError as e:
+                if loaded is None:
+                    raise
+                # A half-finished edit shouldn't take the setting down; retry once the files change again
+                print(f"Error reloading world pack {world_id}, keeping the loaded version: {e}")
+                loaded.signature = signature
+                loaded.checked_at = now
+                return loaded.pack
+            self._loaded[world_id] = _Loaded(pack, signature, now)
+            return pack
+
+    def _directory(self, world_id: str) -> str:
+        directory = os.path.join(self.root, world_id)
+        if os.path.basename(world_id) != world_id or world_id.startswith(".") or not os.path.isfile(os.path.join(directory, WORLD_FILE)):
+            raise WorldPackError(f"Unknown world pack '{world_id}'")
+        return directory
+
+    @staticmethod
+    def _signature(world_id: str, directory: str) -> Tuple:
+        """Modification times and sizes of a pack's files; cheap to check on every use"""
+        signature = []
+        for name in (WORLD_FILE, NPCS_FILE):
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+                raise WorldPackError(f"World pack '{world_id}' has no {name}")
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _load(self, world_id: str, directory: str) -> WorldPack:
+        """Load a pack from the compiled cache, compiling and caching it on a miss"""
+        content_hash = self._content_hash(directory)
+        pack = None
+        cache_path = None
+        if self.cache_dir is not None:
+            cache_path = os.path.join(self.cache_dir, f"{world_id}-{content_hash[:16]}.json")
+            try:
+                with open(cache_path, 'r') as f:
+                    pack = pack_from_dict(json.load(f))
+                if pack.id != world_id or pack.content_hash != content_hash:
+                    pack = None
+            except FileNotFoundError:
+                pass
+            except (OSError, KeyError, TypeError, ValueError):
+                # Damaged or written by an incompatible version; recompile over it
+                pack = None
+
+        if pack is not None:
+            self.cache_loads += 1
+        else:
+            pack = compile_pack(world_id, directory, content_hash)
+            self.compiles += 1
+            if cache_path is not None:
+                self._write_cache(cache_path, pack)
+        # Compile the schedule now rather than in the first session that needs it
+        pack.registry.schedule()
+        return pack
+
+    @staticmethod
+    def _content_hash(directory: str) -> str:
+        digest = hashlib.sha256(f"world-pack-v{PACK_FORMAT_VERSION}".encode("utf-8"))
+        for name in (WORLD_FILE, NPCS_FILE):
+            with open(os.path.join(directory, name), 'rb') as f:
+                data = f.read()
+            digest.update(f"{name}:{len(data)}:".encode("utf-8"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _write_cache(self, cache_path: str, pack: WorldPack):
+        """Write atomically so other workers never read half a file, then drop the pack's older versions"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                json.dump(pack_to_dict(pack), f)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            print(f"Error caching world pack {pack.id}: {e}")
+            return
+        self._prune_cache(pack.id, os.path.basename(cache_path))
+
+    def _prune_cache(self, world_id: str, keep: str):
+        """Remove cached versions of a pack other than the current one, including old pickles"""
+        stale = re.compile(re.escape(world_id) + r"-[0-9a-f]{16}\.(json|pickle)")
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if name != keep and stale.fullmatch(name):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    # Another worker got there first
+                    pass
+
+_default_catalog: Optional[WorldCatalog] = None
+
+def get_catalog() -> WorldCatalog:
+    """The catalog of packs in WORLD_PACKS_DIR, created on first use"""
+    global _default_catalog
+    if _default_catalog is None:
+        _default_catalog = WorldCatalog()
+    return _default_catalog
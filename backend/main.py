@@ -1,16 +1,46 @@
-from fastapi import FastAPI, HTTPException, Depends, Body
+from fastapi import FastAPI, HTTPException, Depends, Body, Header, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional, Dict
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Optional, Dict, Tuple
 import os
+import json
+import logging
+import secrets
+import asyncio
+import re
+import time
+import weakref
 from dotenv import load_dotenv
-from game.state_manager import GameState
-from game.npc_manager import NPCManager
+from game.session_store import SessionStore, GameSession
+from game.persistence import PersistenceEngine, PERSISTENCE_ENABLED
+from game.request_dedup import IdempotencyConflict
+from game.state_backend import StateConflict, create_state_backend
+from game.npc_registry import NPCRegistry
+from game.world_pack import WorldPackError, get_catalog
+from game.work_queue import WorkQueue
+from ai.model_provider import create_provider
 from ai.npc_handler import NPCHandler
+from ai.response_cache import ResponseCache
+from ai.prompt_builder import PromptBuilder
+from ai.prefetcher import Prefetcher, PREFETCH_ENABLED, PREFETCH_OPENERS
+from ai.intent_router import Intent, IntentRouter, INTENT_ROUTER_ENABLED
+from metrics import (
+    HTTP_REQUEST_SECONDS,
+    PROFILING_ENABLED,
+    REGISTRY,
+    SamplingProfiler,
+    request_trace,
+    server_timing,
+    span
+)
 from pydantic import BaseModel
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(
     title="ReRe API",
     description="Backend API for the ReRe game",
@@ -24,25 +54,226 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Session-Id", "ETag", "Server-Timing", "X-Profile-Id"],
 )
 
 # Initialize game components
-game_state = GameState()
-npc_manager = NPCManager()
-npc_handler = NPCHandler()
+worlds = get_catalog()  # World packs are compiled or loaded from cache when a session first needs one
+model_provider = create_provider()  # MODEL_PROVIDER picks the OpenAI-compatible client or a local stub
+response_cache = ResponseCache()
+# Prompt templates per loaded world pack, dropped when no session uses that version any more
+prompt_builders: "weakref.WeakKeyDictionary[NPCRegistry, PromptBuilder]" = weakref.WeakKeyDictionary()
+
+def prompt_builder_for(registry: NPCRegistry) -> PromptBuilder:
+    builder = prompt_builders.get(registry)
+    if builder is None:
+        builder = prompt_builders[registry] = PromptBuilder(registry)
+    return builder
+
+# STATE_BACKEND shares sessions between workers; it then takes over from the local journal
+state_backend = create_state_backend()
+persistence = PersistenceEngine() if PERSISTENCE_ENABLED and state_backend is None else None
+# Maps free-text input onto the rule actions, answering the clear-cut ones without the model
+intent_router = IntentRouter() if INTENT_ROUTER_ENABLED else None
+
+def create_prefetcher() -> Optional[Prefetcher]:
+    """The greeting prefetcher, if enabled and left with openers that need the model"""
+    if not PREFETCH_ENABLED:
+        return None
+    # Openers the router answers by rule need no prefetch
+    openers = [opener for opener in PREFETCH_OPENERS if intent_router is None or not intent_router.route(opener).direct]
+    if len(openers) < len(PREFETCH_OPENERS):
+        skipped = ", ".join(opener for opener in PREFETCH_OPENERS if opener not in openers)
+        logger.info("Prefetch skips openers answered by rule: %s", skipped)
+    if not openers:
+        logger.warning(
+            "Every PREFETCH_OPENERS entry is answered by rule, so prefetching is off; list free-text openers to prefetch"
+        )
+        return None
+    return Prefetcher(openers=openers)
+
+prefetcher = create_prefetcher()
+# Memory indexing, event logging and snapshots run here after the response is sent
+work_queue = WorkQueue()
+session_store = SessionStore(
+    lambda npc_manager: NPCHandler(
+        model_provider,
+        npc_manager,
+        response_cache=response_cache,
+        prompt_builder=prompt_builder_for(npc_manager.registry)
+    ),
+    persistence=persistence,
+    state_backend=state_backend,
+    work_queue=work_queue
+)
+
+# Gauges read from the live components at scrape time
+REGISTRY.gauge("rere_sessions", "Live game sessions", callback=lambda: {(): len(session_store)})
+REGISTRY.gauge("rere_websocket_subscribers", "Connected live-update clients", callback=lambda: {
+    (): sum(len(session.change_feed) for session in session_store.sessions())
+})
+REGISTRY.gauge("rere_llm_in_flight", "Model calls holding a concurrency slot", callback=lambda: {(): model_provider.in_flight})
+REGISTRY.gauge("rere_llm_waiting", "Model calls queued for a concurrency slot", callback=lambda: {(): model_provider.waiting})
+REGISTRY.gauge("rere_response_cache", "NPC response cache counters", ("stat",), callback=lambda: {
+    (name,): value for name, value in response_cache.stats().items()
+})
+REGISTRY.gauge("rere_persistence_pending_writes", "Journal writes queued for the next commit", callback=lambda: {
+    (): persistence.pending() if persistence is not None else 0
+})
+REGISTRY.gauge("rere_background_jobs", "Work queued after responses", ("stat",), callback=lambda: {
+    (name,): value for name, value in work_queue.stats().items()
+})
+REGISTRY.gauge("rere_prefetch", "Greeting prefetch counters", ("stat",), callback=lambda: {
+    (name,): value for name, value in (prefetcher.stats().items() if prefetcher is not None else [])
+})
+
+INTENTS = REGISTRY.counter("rere_intents_total", "Interactions by recognized rule action and who answered them", ("action", "answered_by"))
+DEDUPLICATED = REGISTRY.counter("rere_interactions_deduplicated_total", "Interaction requests served without running again", ("kind",))
+
+_UNSAFE_FILENAME = re.compile(r"[^A-Za-z0-9_-]+")
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """Time every request, with a per-stage Server-Timing breakdown and optional profiling"""
+    profiler = None
+    if PROFILING_ENABLED and request.headers.get("X-Profile") == "1":
+        profiler = SamplingProfiler().start()
+    start = time.perf_counter()
+    with request_trace() as trace:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    # The matched route template keeps label cardinality bounded
+    route = request.scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=route_path, status=response.status_code)
+    if trace:
+        response.headers["Server-Timing"] = server_timing(trace + [("total", elapsed)])
+    if profiler is not None:
+        name = _UNSAFE_FILENAME.sub("_", f"{request.method}{request.url.path}").strip("_")
+
+        def finish_profile() -> str:
+            # Joins the sampler thread and writes to disk, so it runs off the event loop
+            profiler.stop()
+            return profiler.write(name)
+
+        path = await asyncio.to_thread(finish_profile)
+        logger.info("Profile of %s %s written to %s", request.method, request.url.path, path)
+        # The file's name identifies it in PROFILE_DIR without revealing where that is
+        response.headers["X-Profile-Id"] = os.path.splitext(os.path.basename(path))[0]
+    return response
+
+def build_context(game_state, npc_id: str) -> Dict:
+    """Game context for an NPC prompt"""
+    # Most recent first; the prompt builder keeps as many as fit its budget
+    latest, _ = game_state.events.query(loop=game_state.current_loop, limit=5, newest_first=True)
+    recent_events = [
+        f"{stored.event.get('timestamp')} - the player spoke with {stored.event['npc_id']}"
+        for stored in latest
+        if stored.event.get("npc_id") and stored.event["npc_id"] != npc_id
+    ]
+    return {
+        "current_loop": game_state.current_loop,
+        "time": game_state.world_state.get("time", "08:00"),
+        "location": game_state.world_state.get("location", "village_square"),
+        "recent_events": recent_events
+    }
+
+# Distinguishes state versions issued by this process from those of a previous run
+INSTANCE_ID = secrets.token_hex(4)
+# Clients that can't take a message within this many seconds are disconnected
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+# Limits for /interactions/batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "20"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+# Largest page served by /game/events
+EVENTS_MAX_PAGE_SIZE = int(os.getenv("EVENTS_MAX_PAGE_SIZE", "200"))
 
 class InteractionRequest(BaseModel):
     player_input: str
 
+class BatchInteraction(BaseModel):
+    npc_id: str
+    player_input: str
+
+class BatchInteractionRequest(BaseModel):
+    interactions: List[BatchInteraction]
+
+def parse_clock(value: str) -> int:
+    """Minutes since midnight for a time of day given as HH:MM"""
+    try:
+        hours, minutes = value.split(":")
+        return int(hours) * 60 + int(minutes)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Time must be given as HH:MM")
+
+async def get_session(response: Response, x_session_id: Optional[str] = Header(None)) -> GameSession:
+    """
+    Resolve the caller's game session from the X-Session-Id header
+
+    A request without one starts a new session rather than sharing one with
+    other clients; its token comes back in the X-Session-Id response header.
+    """
+    session = await session_store.open(x_session_id)
+    # Finish the work left over from the previous request, so this one sees its effects
+    await session.settle()
+    # Pick up changes made through other workers; mutations sync again under the lock
+    await session.sync()
+    response.headers["X-Session-Id"] = session.session_id
+    return session
+
+@app.exception_handler(StateConflict)
+async def state_conflict(request: Request, exc: StateConflict):
+    """The session was changed through other workers too often for a mutation to commit"""
+    return JSONResponse(status_code=409, content={"detail": "The game state changed concurrently; retry the request"})
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Finish background work, then release pooled connections to the model API and flush pending game state"""
+    await work_queue.close()
+    await model_provider.aclose()
+    if persistence is not None:
+        persistence.close()
+    if state_backend is not None:
+        state_backend.close()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to ReRe API"}
 
+@app.post("/session")
+async def create_session(response: Response, world: Optional[str] = None):
+    """Start a new isolated game session, in the given world pack or the default one"""
+    try:
+        pack = worlds.get(world) if world is not None else None
+    except WorldPackError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    session = await session_store.open(world=pack)
+    response.headers["X-Session-Id"] = session.session_id
+    return {"session_id": session.session_id, "world": session.world.id}
+
+@app.get("/worlds")
+async def list_worlds():
+    """Ids of the available world packs"""
+    return {"worlds": worlds.ids(), "default": worlds.default_world}
+
+def state_etag(session: GameSession) -> str:
+    """ETag for a session's state at its current version"""
+    return f'"{INSTANCE_ID}-{session.game_state.version}"'
+
 @app.get("/game/state")
-async def get_game_state():
+async def get_game_state(
+    session: GameSession = Depends(get_session),
+    if_none_match: Optional[str] = Header(None)
+):
     """Get the current game state"""
+    etag = state_etag(session)
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        # Unchanged since the client's copy; skip building the payload
+        return Response(status_code=304, headers={"ETag": etag, "X-Session-Id": session.session_id})
+
     # Ensure the game state has all required fields
-    state = game_state.to_dict()
+    state = session.game_state.to_dict()
     if "worldState" not in state:
         state["worldState"] = {
             "time": "08:00",
@@ -53,98 +284,439 @@ async def get_game_state():
         }
     if "npcMemories" not in state:
         state["npcMemories"] = {}
-    return state
+    return JSONResponse(jsonable_encoder(state), headers={"ETag": etag, "X-Session-Id": session.session_id})
+
+@app.get("/game/state/changes")
+async def get_game_state_changes(since: int, session: GameSession = Depends(get_session)):
+    """Get the state changes made after a version, or the full state if they are no longer available"""
+    game_state = session.game_state
+    changes = game_state.changes_since(since)
+    if changes is None:
+        return {"version": game_state.version, "reset": True, "state": game_state.to_dict()}
+    return {"version": game_state.version, "reset": False, "changes": changes}
+
+@app.get("/game/events")
+async def get_events(
+    npc_id: Optional[str] = None,
+    type: Optional[str] = None,
+    loop: Optional[int] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = 50,
+    order: str = "asc",
+    session: GameSession = Depends(get_session)
+):
+    """
+    Page through the session's event history across loops
+
+    Filters combine: e.g. npc_id=blacksmith&loop=2, or start=12:00&end=15:00
+    for events in that window of every loop. Pass next_cursor back as cursor
+    for the following page; it is null on the last page.
+    """
+    if not 1 <= limit <= EVENTS_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {EVENTS_MAX_PAGE_SIZE}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    events, next_cursor = session.game_state.events.query(
+        npc_id=npc_id,
+        event_type=type,
+        loop=loop,
+        start_minute=parse_clock(start) if start is not None else None,
+        end_minute=parse_clock(end) if end is not None else None,
+        cursor=cursor,
+        limit=limit,
+        newest_first=order == "desc"
+    )
+    return {"events": [stored.to_dict() for stored in events], "next_cursor": next_cursor}
+
+@app.get("/game/events/{event_id}")
+async def get_event(event_id: int, session: GameSession = Depends(get_session)):
+    """Get one event from the session's history"""
+    stored = session.game_state.events.get(event_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return stored.to_dict()
+
+@app.websocket("/ws")
+async def state_updates(websocket: WebSocket, session_id: Optional[str] = None):
+    """Push the session's world, NPC and clock changes as they happen"""
+    session = session_store.get(session_id) if session_id else None
+    if session is None:
+        # Policy violation: only an existing session can be watched
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = session.change_feed.subscribe()
+
+    async def send_changes():
+        await websocket.send_json({"type": "hello", "session_id": session.session_id, "version": session.game_state.version})
+        while True:
+            for message in await subscription.next_batch():
+                if message["type"] == "resync":
+                    message["version"] = session.game_state.version
+                await asyncio.wait_for(websocket.send_json(message), WS_SEND_TIMEOUT_SECONDS)
+
+    async def wait_for_disconnect():
+        # Clients don't send anything; this only notices when they go away
+        while True:
+            await websocket.receive_text()
+
+    sender = asyncio.ensure_future(send_changes())
+    receiver = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait([sender, receiver], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
+        session.change_feed.unsubscribe(subscription)
+        if sender.done() and not sender.cancelled() and isinstance(sender.exception(), asyncio.TimeoutError):
+            await websocket.close(code=1013)  # Try again later: the client fell behind
 
 @app.post("/game/reset")
-async def reset_game():
+async def reset_game(session: GameSession = Depends(get_session)):
     """Reset the game state while preserving player knowledge"""
-    preserved_knowledge = game_state.player_knowledge.copy()
-    game_state.__init__()
-    game_state.player_knowledge = preserved_knowledge
-    game_state.current_loop += 1
-    return {"message": "Game reset", "new_loop": game_state.current_loop}
+    async with session.lock:
+        with span("loop_reset"):
+            await session.transaction(session.reset)
+    return {"message": "Game reset", "new_loop": session.game_state.current_loop}
 
 @app.get("/game/locations")
-async def get_locations():
+async def get_locations(session: GameSession = Depends(get_session)):
     """Get all available locations in the game"""
-    return {
-        "locations": [
-            "village_square",
-            "forge",
-            "apothecary_shop",
-            "tavern",
-            "temple",
-            "market"
-        ]
-    }
+    return {"locations": list(session.world.locations)}
 
 @app.get("/game/location/{location_id}/npcs")
-async def get_npcs_at_location(location_id: str):
-    """Get all NPCs at a specific location"""
-    npcs = npc_manager.get_npcs_at_location(location_id)
+async def get_npcs_at_location(location_id: str, at: Optional[str] = None, session: GameSession = Depends(get_session)):
+    """Get all NPCs at a specific location, now or at a time of day ("HH:MM") according to their schedules"""
+    if at is not None:
+        npcs = session.npc_manager.get_scheduled_npcs_at_location(location_id, parse_clock(at))
+        return {
+            "location": location_id,
+            "time": at,
+            "npcs": [npc.get_state() for npc in npcs]
+        }
+
+    npcs = session.npc_manager.get_npcs_at_location(location_id)
+    if prefetcher is not None:
+        # The player will most likely talk to one of these next
+        prefetcher.on_location(
+            session.npc_handler,
+            location_id,
+            {npc.id: build_context(session.game_state, npc.id) for npc in npcs}
+        )
     return {
         "location": location_id,
         "npcs": [npc.get_state() for npc in npcs]
     }
 
 @app.get("/npc/{npc_id}")
-async def get_npc(npc_id: str):
+async def get_npc(npc_id: str, session: GameSession = Depends(get_session)):
     """Get information about a specific NPC"""
-    npc = npc_manager.get_npc(npc_id)
+    npc = session.npc_manager.get_npc(npc_id)
     if not npc:
         raise HTTPException(status_code=404, detail="NPC not found")
     return npc.get_state()
 
-@app.post("/npc/{npc_id}/interact")
-async def interact_with_npc(npc_id: str, request: InteractionRequest = Body(...)):
-    """Handle player interaction with an NPC"""
-    # Process the interaction through the NPC manager
-    interaction_result = npc_manager.process_interaction(npc_id, request.player_input, game_state.to_dict())
-    
-    if "error" in interaction_result:
-        raise HTTPException(status_code=404, detail=interaction_result["error"])
+def classify(player_input: str) -> Intent:
+    """The rule action a player input asks for, if the router is confident enough to say"""
+    if intent_router is None:
+        return Intent(None, 0.0, False)
+    with span("intent"):
+        return intent_router.route(player_input)
 
-    # Get AI-generated response
-    ai_response = npc_handler.get_npc_response(
-        npc_id=npc_id,
-        player_input=request.player_input,
-        context={
-            "current_loop": game_state.current_loop,
-            "time": game_state.world_state.get("time", "08:00"),
-            "location": game_state.world_state.get("location", "village_square")
-        }
-    )
+async def reply(
+    session: GameSession,
+    npc_id: str,
+    player_input: str,
+    context: Dict,
+    intent: Intent,
+    rule_response: str
+) -> Tuple[str, str]:
+    """The NPC's reply and its source; clear-cut rule actions get the rule-based reply without a model call"""
+    if intent.direct:
+        INTENTS.inc(action=intent.action, answered_by="rules")
+        await session.npc_handler.record_response(npc_id, player_input, rule_response, context)
+        return rule_response, "rules"
+    INTENTS.inc(action=intent.action or "none", answered_by="model")
+    # Past the deadline the rule-based response is used instead
+    return await session.npc_handler.get_npc_reply(npc_id, player_input, context, fallback=rule_response)
 
-    # Update game state with interaction results
-    game_state.advance_time(interaction_result["state_changes"]["time_cost"] * 60)  # Convert hours to minutes
-    game_state.add_event({
-        "type": "npc_interaction",
-        "npc_id": npc_id,
-        "player_input": request.player_input,
-        "npc_response": ai_response,
-        "timestamp": game_state.world_state.get("time", "08:00")
-    })
+def apply_interaction(session: GameSession, npc_id: str, player_input: str, intent: Intent) -> Tuple[Dict, Optional[Dict], Optional[str]]:
+    """
+    Apply an interaction's rule-side effects: the NPC's state, then the clock
+
+    Call inside a session transaction. Everything the interaction changes is
+    applied here, so the model call that follows only produces text and the
+    stored state always matches some sequential run of the interactions.
+
+    Returns:
+        Tuple: (interaction result, prompt context, time afterwards); the
+        context and time are None when the result is an error
+    """
+    game_state = session.game_state
+    # Process the interaction through the NPC manager, as the recognized action if there is one
+    with span("process_interaction"):
+        result = session.npc_manager.process_interaction(npc_id, intent.rule_action or player_input, game_state.world_state["time"])
+    if "error" in result:
+        return result, None, None
+    context = build_context(game_state, npc_id)
+    # Update NPC state in game state before the clock moves, so death checks
+    # and the persisted log see the same trust levels
+    game_state.update_npc_state(npc_id, result["state_changes"]["npc_state"])
+    with span("advance_time"):
+        game_state.advance_time(result["state_changes"]["time_cost"] * 60)  # Convert hours to minutes
+    return result, context, game_state.world_state.get("time", "08:00")
 
-    # Update NPC state in game state
-    game_state.update_npc_state(npc_id, interaction_result["state_changes"]["npc_state"])
+async def run_interaction(session: GameSession, npc_id: str, player_input: str) -> Dict:
+    """Apply one player interaction to a session and generate the NPC's reply"""
+    intent = classify(player_input)
+
+    async with session.lock:
+        interaction_result, context, current_time = await session.transaction(
+            lambda: apply_interaction(session, npc_id, player_input, intent)
+        )
+        loop = session.game_state.current_loop
+
+    if "error" in interaction_result:
+        raise HTTPException(status_code=404, detail=interaction_result["error"])
+
+    # Get the response outside the lock so other requests can proceed
+    ai_response, source = await reply(session, npc_id, player_input, context, intent, interaction_result["response"])
+    await log_interactions(session, loop, [interaction_event(npc_id, player_input, ai_response, current_time)])
 
     return {
         "response": ai_response,
+        "fallback": source == "fallback",
+        "intent": intent.to_dict(),
         "state_changes": interaction_result["state_changes"],
         "time_advanced": True,
-        "current_time": game_state.world_state.get("time", "08:00")
+        "current_time": current_time
     }
 
+def interaction_event(npc_id: str, player_input: str, npc_response: str, timestamp: str) -> Dict:
+    return {
+        "type": "npc_interaction",
+        "npc_id": npc_id,
+        "player_input": player_input,
+        "npc_response": npc_response,
+        "timestamp": timestamp
+    }
+
+async def log_interactions(session: GameSession, loop: int, events: List[Dict]):
+    """
+    Add interaction events to the session's history after the response has been sent
+
+    The events are filed under the loop and time they happened at, which
+    the clock may have moved past by the time the deferred job runs.
+    """
+    def add_events():
+        for event in events:
+            session.game_state.add_event(event, loop, parse_clock(event["timestamp"]))
+
+    await session.defer_transaction("event_log", add_events)
+
+def stored_result(session: GameSession, idempotency_key: Optional[str], fingerprint, response: Response) -> Optional[Dict]:
+    """The stored result for a repeated Idempotency-Key, if there is one"""
+    if not idempotency_key:
+        return None
+    try:
+        result = session.idempotency.get(idempotency_key, fingerprint)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if result is not None:
+        DEDUPLICATED.inc(kind="idempotency_replay")
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+@app.post("/npc/{npc_id}/interact")
+async def interact_with_npc(
+    npc_id: str,
+    response: Response,
+    request: InteractionRequest = Body(...),
+    session: GameSession = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Handle player interaction with an NPC
+
+    Identical requests in flight at the same time share one execution, and a
+    request repeating an earlier Idempotency-Key gets the stored result, so
+    double-clicks and retries neither call the model nor advance time twice.
+    """
+    fingerprint = ("interact", npc_id, request.player_input)
+    if (result := stored_result(session, idempotency_key, fingerprint, response)) is not None:
+        return result
+
+    flight_key = ("idempotency", idempotency_key, fingerprint) if idempotency_key else fingerprint
+    result, shared = await session.single_flight.run(
+        flight_key, lambda: run_interaction(session, npc_id, request.player_input)
+    )
+    if shared:
+        DEDUPLICATED.inc(kind="coalesced")
+    if idempotency_key:
+        session.idempotency.put(idempotency_key, fingerprint, result)
+    return result
+
+@app.post("/npc/{npc_id}/interact/stream")
+async def interact_with_npc_stream(npc_id: str, request: InteractionRequest = Body(...), session: GameSession = Depends(get_session)):
+    """Handle player interaction with an NPC, streaming the response as server-sent events"""
+    intent = classify(request.player_input)
+
+    # Trust and time change together before streaming, so a client that
+    # disconnects mid-stream can't keep one without the other
+    async with session.lock:
+        interaction_result, context, current_time = await session.transaction(
+            lambda: apply_interaction(session, npc_id, request.player_input, intent)
+        )
+        loop = session.game_state.current_loop
+
+    if "error" in interaction_result:
+        raise HTTPException(status_code=404, detail=interaction_result["error"])
+
+    async def rule_reply():
+        yield interaction_result["response"]
+
+    async def event_stream():
+        chunks = []
+        if intent.direct:
+            INTENTS.inc(action=intent.action, answered_by="rules")
+            tokens = rule_reply()
+        else:
+            INTENTS.inc(action=intent.action or "none", answered_by="model")
+            tokens = session.npc_handler.stream_npc_response(
+                npc_id, request.player_input, context, fallback=interaction_result["response"]
+            )
+        async for token in tokens:
+            chunks.append(token)
+            yield f"data: {json.dumps({'token': token})}\n\n"
+        ai_response = "".join(chunks)
+
+        # Queued before the final frame so they run even if the client hangs up after it;
+        # a stream cut short records neither
+        await session.npc_handler.record_response(npc_id, request.player_input, ai_response, context)
+        await log_interactions(session, loop, [interaction_event(npc_id, request.player_input, ai_response, current_time)])
+
+        done = {
+            "response": ai_response,
+            "intent": intent.to_dict(),
+            "state_changes": interaction_result["state_changes"],
+            "time_advanced": True,
+            "current_time": current_time
+        }
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Session-Id": session.session_id}
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Metrics in the Prometheus text format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/cache")
+async def get_cache_stats():
+    """Get NPC response cache statistics"""
+    stats = response_cache.stats()
+    if prefetcher is not None:
+        stats["prefetch"] = prefetcher.stats()
+    return stats
+
+@app.post("/interactions/batch")
+async def interact_batch(
+    request: BatchInteractionRequest,
+    response: Response,
+    session: GameSession = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Handle several NPC interactions, generating their responses concurrently"""
+    if len(request.interactions) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} interactions per batch")
+
+    fingerprint = ("batch", tuple((item.npc_id, item.player_input) for item in request.interactions))
+    if (result := stored_result(session, idempotency_key, fingerprint, response)) is not None:
+        return result
+    if not idempotency_key:
+        return await run_batch(session, request)
+
+    result, shared = await session.single_flight.run(
+        ("idempotency", idempotency_key, fingerprint), lambda: run_batch(session, request)
+    )
+    if shared:
+        DEDUPLICATED.inc(kind="coalesced")
+    session.idempotency.put(idempotency_key, fingerprint, result)
+    return result
+
+async def run_batch(session: GameSession, request: BatchInteractionRequest) -> Dict:
+    """Apply a batch of interactions to a session and generate the replies"""
+    # Apply rule-side effects and time strictly in request order, so the
+    # outcome matches making the calls one after another
+    intents = [classify(item.player_input) for item in request.interactions]
+
+    def begin():
+        results: List[Dict] = []
+        pending = []
+        for index, item in enumerate(request.interactions):
+            intent = intents[index]
+            interaction_result, context, current_time = apply_interaction(session, item.npc_id, item.player_input, intent)
+            if "error" in interaction_result:
+                results.append({"index": index, "npc_id": item.npc_id, "error": interaction_result["error"]})
+                continue
+            result = {
+                "index": index,
+                "npc_id": item.npc_id,
+                "intent": intent.to_dict(),
+                "state_changes": interaction_result["state_changes"],
+                "current_time": current_time
+            }
+            results.append(result)
+            pending.append((item, context, result, intent, interaction_result["response"]))
+        return results, pending
+
+    async with session.lock:
+        results, pending = await session.transaction(begin)
+        loop = session.game_state.current_loop
+
+    # Generate every response at once, with bounded fan-out
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def generate(item: BatchInteraction, context: Dict, intent: Intent, rule_response: str):
+        async with semaphore:
+            return await reply(session, item.npc_id, item.player_input, context, intent, rule_response)
+
+    replies = await asyncio.gather(
+        *(generate(item, context, intent, rule_response) for item, context, _, intent, rule_response in pending),
+        return_exceptions=True
+    )
+
+    events = []
+    for (item, _, result, _, _), outcome in zip(pending, replies):
+        if isinstance(outcome, Exception):
+            result["error"] = f"Response generation failed: {outcome}"
+            continue
+        response, source = outcome
+        result["response"] = response
+        result["fallback"] = source == "fallback"
+        events.append(interaction_event(item.npc_id, item.player_input, response, result["current_time"]))
+    await log_interactions(session, loop, events)
+
+    return {"results": results, "current_time": session.game_state.world_state.get("time", "08:00")}
+
 @app.post("/game/player/knowledge")
-async def add_player_knowledge(knowledge: str):
+async def add_player_knowledge(knowledge: str, session: GameSession = Depends(get_session)):
     """Add new knowledge to player's memory"""
-    game_state.add_player_knowledge(knowledge)
+    async with session.lock:
+        await session.transaction(lambda: session.game_state.add_player_knowledge(knowledge))
     return {"message": "Knowledge added", "knowledge": knowledge}
 
 @app.get("/game/player/knowledge")
-async def get_player_knowledge():
+async def get_player_knowledge(session: GameSession = Depends(get_session)):
     """Get all player knowledge"""
-    return {"knowledge": list(game_state.player_knowledge)}
+    return {"knowledge": list(session.game_state.player_knowledge)}
 
 if __name__ == "__main__":
     import uvicorn
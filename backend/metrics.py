@@ -0,0 +1,243 @@
+"""
+In-process metrics, per-request timing spans and an opt-in sampling profiler
+
+Metrics are rendered in the Prometheus text format for /metrics. Spans time a
+stage of request handling; they feed a per-stage histogram and, while a
+request trace is active, the request's Server-Timing breakdown.
+"""
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from contextlib import contextmanager
+import contextvars
+import math
+import os
+import sys
+import threading
+import time
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "profiles"))
+
+# Latency buckets in seconds, from cache hits to slow model calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2000, 4000)
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A named metric family with optional labels"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        return []
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+class Gauge(Metric):
+    """A value set directly, or read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), callback: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        # Returns {label values tuple: value}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def _samples(self) -> List[str]:
+        values = self.callback() if self.callback else self._values
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (per-bucket counts, sum)
+        self._series: Dict[Tuple, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+                break
+        series[1] += value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound) if math.isinf(bound) else bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Every metric exposed on /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), callback=None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram("rere_stage_duration_seconds", "Time spent in each stage of request handling", ("stage",))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram("rere_http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+LLM_REQUEST_SECONDS = REGISTRY.histogram("rere_llm_request_duration_seconds", "Model call latency, excluding time queued for a slot", ("mode",))
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram("rere_llm_first_token_seconds", "Time to the first streamed token")
+LLM_QUEUE_SECONDS = REGISTRY.histogram("rere_llm_queue_wait_seconds", "Time model calls wait for a concurrency slot")
+LLM_TOKENS = REGISTRY.histogram("rere_llm_tokens", "Tokens per model call", ("type",), TOKEN_BUCKETS)
+LLM_REQUESTS = REGISTRY.counter("rere_llm_requests_total", "Model calls by outcome", ("mode", "outcome"))
+
+# Stage timings of the current request, as (stage, seconds)
+_request_trace: "contextvars.ContextVar[Optional[List[Tuple[str, float]]]]" = contextvars.ContextVar("request_trace", default=None)
+
+@contextmanager
+def request_trace() -> Iterator[List[Tuple[str, float]]]:
+    """Collect the spans of everything run in this context, e.g. one HTTP request"""
+    trace: List[Tuple[str, float]] = []
+    token = _request_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _request_trace.reset(token)
+
+@contextmanager
+def span(stage: str):
+    """Time a stage of request handling"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _request_trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+def server_timing(trace: List[Tuple[str, float]]) -> str:
+    """Server-Timing header value for a trace; repeated stages are summed"""
+    totals: Dict[str, float] = {}
+    for stage, elapsed in trace:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={1000 * elapsed:.2f}" for stage, elapsed in totals.items())
+
+class SamplingProfiler:
+    """
+    Samples one thread's Python stack at a fixed interval and counts the stacks
+
+    The event loop thread runs every request, so a profile taken during one
+    request also contains samples from any request handled concurrently.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples: Dict[str, int] = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> 'SamplingProfiler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> Dict[str, int]:
+        """Stop sampling; returns sample counts per folded stack (root first, ';'-separated)"""
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                folded = ";".join(reversed(stack))
+                self.samples[folded] = self.samples.get(folded, 0) + 1
+
+    def write(self, name: str, directory: str = PROFILE_DIR) -> str:
+        """Write the samples in folded-stack format (for flame graph tools); returns the file path"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{int(time.time() * 1000)}-{name}.folded")
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        return path
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The backend is run from its own directory; make its packages importable the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configuration is read at import time; tests run against the stub model with nothing written to disk
+os.environ.setdefault("MODEL_PROVIDER", "stub")
+os.environ.setdefault("PERSISTENCE_ENABLED", "false")
+os.environ.setdefault("OPENAI_API_KEY", "test")
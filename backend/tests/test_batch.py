@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from ai.model_provider import ModelProvider
+import main
+
+class TrackingProvider(ModelProvider):
+    """Answers after a short delay, recording the most calls it had running at once"""
+
+    def __init__(self, delay=0.02, fail_for=None):
+        self.delay = delay
+        self.fail_for = fail_for
+        self.running = 0
+        self.peak = 0
+
+    async def complete(self, messages, timeout=None, **kwargs):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running -= 1
+        prompt = messages[-1]["content"]
+        if self.fail_for and self.fail_for in prompt:
+            raise RuntimeError("model unavailable")
+        return f"reply to {prompt}"
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+def open_session(client, provider=None):
+    session_id = client.post("/session").json()["session_id"]
+    session = main.session_store.get(session_id)
+    if provider is not None:
+        session.npc_handler.model_provider = provider
+        session.npc_handler.response_cache = None
+        session.npc_handler.deadline = 0
+        session.npc_handler.hedge_after = 0
+    return {"X-Session-Id": session_id}, session
+
+def batch(client, headers, *interactions):
+    return client.post("/interactions/batch", json={"interactions": [
+        {"npc_id": npc_id, "player_input": player_input} for npc_id, player_input in interactions
+    ]}, headers=headers)
+
+def npc_state(session, npc_id):
+    return session.game_state.world_state["npc_states"][npc_id]["state"]
+
+def test_batch_ends_where_the_same_calls_made_one_by_one_would(client):
+    interactions = [("elder", "greet"), ("apothecary", "greet"), ("elder", "Where were you last night?")]
+    batch_headers, batch_session = open_session(client)
+    results = batch(client, batch_headers, *interactions).json()
+    sequential_headers, sequential_session = open_session(client)
+    times = [
+        client.post(f"/npc/{npc_id}/interact", json={"player_input": player_input}, headers=sequential_headers).json()["current_time"]
+        for npc_id, player_input in interactions
+    ]
+
+    assert [result["index"] for result in results["results"]] == [0, 1, 2]
+    assert [result["current_time"] for result in results["results"]] == times
+    assert results["current_time"] == times[-1]
+    for npc_id in ("elder", "apothecary"):
+        assert npc_state(batch_session, npc_id) == npc_state(sequential_session, npc_id)
+
+def test_replies_are_generated_concurrently_up_to_the_limit(client, monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX_CONCURRENCY", 2)
+    provider = TrackingProvider()
+    headers, _ = open_session(client, provider)
+    results = batch(client, headers, *[(npc_id, "Seen anything odd?") for npc_id in ("elder", "apothecary", "blacksmith")]).json()
+    assert all("Seen anything odd?" in result["response"] for result in results["results"])
+    assert provider.peak == 2
+
+def test_failed_items_do_not_fail_the_batch(client):
+    headers, _ = open_session(client, TrackingProvider(delay=0, fail_for="curse"))
+    results = batch(client, headers, ("elder", "Tell me about the curse"), ("nobody", "greet"), ("apothecary", "greet")).json()["results"]
+    assert results[0]["error"].startswith("Response generation failed")
+    assert "response" not in results[0]
+    assert "error" in results[1]
+    assert "reply to" in results[2]["response"]
+
+def test_oversized_batch_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX_ITEMS", 2)
+    headers, _ = open_session(client)
+    assert batch(client, headers, *[("elder", "greet")] * 3).status_code == 400
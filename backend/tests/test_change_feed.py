@@ -0,0 +1,69 @@
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from game.change_feed import ChangeFeed
+import main
+
+def drain(subscription):
+    return asyncio.run(subscription.next_batch())
+
+def test_messages_with_a_key_collapse_to_the_latest():
+    feed = ChangeFeed()
+    subscription = feed.subscribe()
+    feed.publish("time_advanced", {"time": "06:30"}, 1, ("clock", "time_advanced"))
+    feed.publish("add_event", {"n": 1}, 2)
+    feed.publish("time_advanced", {"time": "07:00"}, 3, ("clock", "time_advanced"))
+    feed.publish("add_event", {"n": 2}, 4)
+    batch = drain(subscription)
+    assert [(message["type"], message["version"]) for message in batch] == [
+        ("add_event", 2), ("time_advanced", 3), ("add_event", 4)
+    ]
+
+def test_every_subscriber_gets_each_message():
+    feed = ChangeFeed()
+    first, second = feed.subscribe(), feed.subscribe()
+    feed.publish("add_event", {"n": 1}, 1)
+    feed.unsubscribe(second)
+    feed.publish("add_event", {"n": 2}, 2)
+    assert len(drain(first)) == 2
+    assert len(drain(second)) == 1
+    assert len(feed) == 1
+
+def test_subscriber_that_falls_behind_is_told_to_resync():
+    feed = ChangeFeed(max_pending=3)
+    subscription = feed.subscribe()
+    for number in range(4):
+        feed.publish("add_event", {"n": number}, number)
+    assert drain(subscription) == [{"type": "resync"}]
+    assert subscription.dropped == 4
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+def test_socket_for_an_unknown_session_is_refused(client):
+    for url in ("/ws", "/ws?session_id=nobody"):
+        with pytest.raises(WebSocketDisconnect) as closed:
+            with client.websocket_connect(url) as websocket:
+                websocket.receive_json()
+        assert closed.value.code == 1008
+    assert main.session_store.get("nobody") is None
+
+def test_socket_pushes_the_session_changes(client):
+    session_id = client.post("/session").json()["session_id"]
+    with client.websocket_connect(f"/ws?session_id={session_id}") as websocket:
+        hello = websocket.receive_json()
+        assert hello["type"] == "hello"
+        client.post("/npc/elder/interact", json={"player_input": "greet"}, headers={"X-Session-Id": session_id})
+        message = websocket.receive_json()
+        assert (message["type"], message["data"]["npc_id"]) == ("update_npc_state", "elder")
+        assert message["version"] > hello["version"]
+        websocket.close()
+        # Let the server finish with the socket before the test client tears it down
+        session = main.session_store.get(session_id)
+        deadline = time.monotonic() + 5
+        while len(session.change_feed) and time.monotonic() < deadline:
+            time.sleep(0.01)
@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from ai.model_provider import ModelProvider
+from ai.npc_handler import NPCHandler
+from game.npc_manager import NPCManager
+from game.state_backend import StateBackend
+
+CONTEXT = {"time": "06:00", "current_loop": 1, "location": "village_square", "recent_events": []}
+
+class ScriptedProvider(ModelProvider):
+    """Answers call n after delays[n] seconds, or raises if that delay is None"""
+
+    def __init__(self, *delays):
+        self.delays = delays
+        self.calls = 0
+
+    async def complete(self, messages, timeout=None, **kwargs):
+        number = self.calls
+        self.calls += 1
+        delay = self.delays[min(number, len(self.delays) - 1)]
+        if delay is None:
+            raise RuntimeError("model unavailable")
+        await asyncio.sleep(delay)
+        return f"reply {number}"
+
+def reply(provider, deadline=0.0, hedge_after=0.0, fallback=None):
+    handler = NPCHandler(model_provider=provider, npc_manager=NPCManager(), deadline=deadline, hedge_after=hedge_after)
+    return asyncio.run(handler.get_npc_reply("elder", "greet", CONTEXT, fallback=fallback))
+
+def test_interfaces_cannot_be_used_without_an_implementation():
+    with pytest.raises(TypeError):
+        ModelProvider()
+    with pytest.raises(TypeError):
+        StateBackend()
+
+def test_reply_within_the_deadline_comes_from_the_model():
+    assert reply(ScriptedProvider(0), deadline=1) == ("reply 0", "model")
+
+def test_missed_deadline_falls_back_to_the_rule_reply():
+    content, source = reply(ScriptedProvider(5), deadline=0.05)
+    assert source == "fallback"
+    assert content == NPCManager().rule_response("elder", "greet", 6)
+
+def test_model_error_falls_back_to_the_given_reply():
+    assert reply(ScriptedProvider(None), deadline=1, fallback="Hm?") == ("Hm?", "fallback")
+
+def test_without_a_deadline_model_errors_propagate():
+    with pytest.raises(RuntimeError):
+        reply(ScriptedProvider(None))
+
+def test_slow_request_is_hedged_and_the_faster_one_wins():
+    provider = ScriptedProvider(5, 0)
+    assert reply(provider, deadline=1, hedge_after=0.02) == ("reply 1", "hedge")
+    assert provider.calls == 2
+
+def test_fast_request_is_not_hedged():
+    provider = ScriptedProvider(0)
+    assert reply(provider, hedge_after=0.5) == ("reply 0", "model")
+    assert provider.calls == 1
+
+def test_stream_falls_back_when_the_first_token_is_late():
+    handler = NPCHandler(model_provider=ScriptedProvider(5), npc_manager=NPCManager(), deadline=0.05)
+
+    async def collect():
+        return [delta async for delta in handler.stream_npc_response("elder", "greet", CONTEXT, fallback="Later.")]
+
+    assert asyncio.run(collect()) == ["Later."]
@@ -0,0 +1,83 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+from game.event_store import EventStore
+import main
+
+def talk(npc_id, number):
+    return {"type": "npc_interaction", "npc_id": npc_id, "player_input": str(number)}
+
+@pytest.fixture
+def store():
+    store = EventStore()
+    for number, (loop, minute, npc_id) in enumerate([
+        (1, 480, "elder"), (1, 540, "blacksmith"), (1, 600, "elder"),
+        (2, 480, "apothecary"), (2, 660, "elder"), (2, 720, "blacksmith"),
+    ]):
+        store.add(talk(npc_id, number), loop, minute)
+    return store
+
+def ids(events):
+    return [stored.id for stored in events]
+
+def test_pages_follow_the_cursor_to_the_end(store):
+    first, cursor = store.query(limit=4)
+    assert ids(first) == [1, 2, 3, 4]
+    rest, cursor = store.query(cursor=cursor, limit=4)
+    assert ids(rest) == [5, 6]
+    assert cursor is None
+
+def test_pages_backwards_from_the_newest(store):
+    first, cursor = store.query(npc_id="elder", limit=2, newest_first=True)
+    assert ids(first) == [5, 3]
+    rest, cursor = store.query(npc_id="elder", cursor=cursor, limit=2, newest_first=True)
+    assert ids(rest) == [1]
+    assert cursor is None
+
+def test_time_range_spans_every_loop_unless_one_is_given(store):
+    events, _ = store.query(start_minute=480, end_minute=540)
+    assert ids(events) == [1, 2, 4]
+    events, _ = store.query(loop=2, start_minute=600)
+    assert ids(events) == [5, 6]
+
+def test_filters_combine(store):
+    events, _ = store.query(npc_id="elder", loop=1, end_minute=540)
+    assert ids(events) == [1]
+
+def test_oldest_events_are_dropped_past_the_limit():
+    store = EventStore(limit=3)
+    for number in range(5):
+        store.add(talk("elder", number), 1, 480 + number)
+    assert store.get(2) is None
+    assert ids(store.query(npc_id="elder")[0]) == [3, 4, 5]
+    assert ids(store.query(start_minute=0)[0]) == [3, 4, 5]
+
+def test_round_trips_and_discards_after_an_id(store):
+    copy = EventStore()
+    copy.load(store.to_list())
+    copy.discard_after(4)
+    assert copy.last_id == 4
+    copy.extend(store.to_list(after_id=4))
+    assert copy.to_list() == store.to_list()
+
+def wait_for_events(session, count):
+    deadline = time.monotonic() + 5
+    while len(session.game_state.events) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def test_batch_events_keep_the_time_of_each_interaction():
+    with TestClient(main.app) as client:
+        session_id = client.post("/session").json()["session_id"]
+        headers = {"X-Session-Id": session_id}
+        session = main.session_store.get(session_id)
+        response = client.post("/interactions/batch", json={"interactions": [
+            {"npc_id": "elder", "player_input": "greet"},
+            {"npc_id": "apothecary", "player_input": "greet"},
+        ]}, headers=headers)
+        results = response.json()["results"]
+        wait_for_events(session, 2)
+
+        for result, npc_id in zip(results, ["elder", "apothecary"]):
+            at = result["current_time"]
+            events = client.get("/game/events", params={"start": at, "end": at}, headers=headers).json()["events"]
+            assert [event["npc_id"] for event in events] == [npc_id]
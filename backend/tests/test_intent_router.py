@@ -0,0 +1,50 @@
+import pytest
+from ai.intent_router import INTENT_ROUTER_ENABLED, IntentRouter
+
+@pytest.fixture(scope="module")
+def router():
+    return IntentRouter()
+
+def test_router_is_off_by_default():
+    assert not INTENT_ROUTER_ENABLED
+
+@pytest.mark.parametrize("player_input", ["greet", "ask_about_murder", "investigate", "Tell me about the murder."])
+def test_action_names_and_curated_phrasings_are_direct(router, player_input):
+    intent = router.route(player_input)
+    assert intent.direct
+    assert intent.rule_action == intent.action
+
+@pytest.mark.parametrize("player_input, action", [
+    ("Hey", "greet"),
+    ("hi", "greet"),
+    ("Good morning", "greet"),
+    ("Hello there, how are you?", "greet"),
+    ("Who is the murderer?", "ask_about_murder"),
+    ("I want to investigate", "investigate"),
+    ("Search", "investigate")
+])
+def test_inputs_made_of_keywords_are_direct(router, player_input, action):
+    intent = router.route(player_input)
+    assert intent.action == action
+    assert intent.direct
+
+@pytest.mark.parametrize("player_input", [
+    "Can you search for my lost dog?",
+    "Have a look at this sword I made",
+    "Tell me about yourself",
+    "What do you know?",
+    "hello, who killed the mayor?",
+    "What's your favourite colour?",
+    ""
+])
+def test_free_text_gets_no_rule_effects(router, player_input):
+    intent = router.route(player_input)
+    assert not intent.direct
+    assert intent.rule_action is None
+    assert intent.confidence < router.min_confidence
+
+def test_partial_matches_are_reported_but_not_applied(router):
+    # Fully explained by a keyword, but unlike every example phrasing
+    intent = router.route("look around")
+    assert intent.action == "investigate"
+    assert intent.rule_action is None
@@ -0,0 +1,41 @@
+import pytest
+from fastapi.testclient import TestClient
+import main
+
+class FailingProvider:
+    in_flight = 0
+    waiting = 0
+
+    async def complete(self, messages, timeout=None, **kwargs):
+        raise RuntimeError("model unavailable")
+
+@pytest.fixture
+def client():
+    with TestClient(main.app, raise_server_exceptions=False) as client:
+        yield client
+
+def open_session(client):
+    session_id = client.post("/session").json()["session_id"]
+    return {"X-Session-Id": session_id}, main.session_store.get(session_id)
+
+def test_interaction_applies_trust_and_time_before_the_model_call(client):
+    headers, session = open_session(client)
+    session.npc_handler.model_provider = FailingProvider()
+    # Other tests may have cached a reply to the same greeting
+    session.npc_handler.response_cache = None
+    session.npc_handler.deadline = 0
+    session.npc_handler.hedge_after = 0
+    before = session.game_state.world_state["time"]
+
+    response = client.post("/npc/elder/interact", json={"player_input": "greet"}, headers=headers)
+    assert response.status_code == 500
+    # The model failing only loses the text: trust and time were applied together
+    assert session.game_state.world_state["time"] != before
+    assert session.game_state.world_state["npc_states"]["elder"]["state"]["trust_level"] > 0
+
+def test_interaction_result_matches_the_applied_state(client):
+    headers, session = open_session(client)
+    result = client.post("/npc/elder/interact", json={"player_input": "greet"}, headers=headers).json()
+    assert result["current_time"] == session.game_state.world_state["time"]
+    stored = session.game_state.world_state["npc_states"]["elder"]
+    assert stored["state"] == result["state_changes"]["npc_state"]["state"]
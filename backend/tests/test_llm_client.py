@@ -0,0 +1,56 @@
+import asyncio
+import json
+import httpx
+from ai.llm_client import LLMClient
+from ai.npc_handler import NPCHandler
+from game.npc_manager import NPCManager
+
+CONTEXT = {"time": "06:00", "current_loop": 1, "location": "village_square", "recent_events": []}
+
+def completion(content):
+    """Handler for a model server that answers every completion with this content"""
+    def handle(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/v1/chat/completions"
+        assert json.loads(request.content)["model"] == "test-model"
+        return httpx.Response(200, json={
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "test-model",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}
+        })
+    return handle
+
+def model_client(content) -> LLMClient:
+    return LLMClient(api_key="test", base_url="http://model.test/v1", model="test-model", transport=httpx.MockTransport(completion(content)))
+
+def complete(content):
+    async def run():
+        client = model_client(content)
+        try:
+            return await client.complete([{"role": "user", "content": "Hello"}])
+        finally:
+            await client.aclose()
+    return asyncio.run(run())
+
+def npc_reply(content):
+    async def run():
+        client = model_client(content)
+        handler = NPCHandler(model_provider=client, npc_manager=NPCManager())
+        try:
+            return await handler.get_npc_reply("elder", "greet", CONTEXT)
+        finally:
+            await client.aclose()
+    return asyncio.run(run())
+
+def test_reply_text_comes_from_the_message_content():
+    assert complete("Good morning.") == "Good morning."
+
+def test_missing_content_is_an_empty_reply():
+    assert complete(None) == ""
+
+def test_npc_without_model_content_gets_the_rule_reply():
+    content, source = npc_reply(None)
+    assert source == "fallback"
+    assert content == NPCManager().rule_response("elder", "greet", 6)
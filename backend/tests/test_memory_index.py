@@ -0,0 +1,83 @@
+import numpy as np
+from ai.memory_index import HashingEmbedder, MemoryIndex
+from ai.model_provider import StubProvider
+from ai.npc_handler import NPCHandler
+from game.npc_manager import NPCManager
+
+CONTEXT = {"time": "06:00", "current_loop": 1, "location": "village_square", "recent_events": []}
+
+def index_of(*texts, **kwargs):
+    index = MemoryIndex(HashingEmbedder(), **kwargs)
+    for number, text in enumerate(texts):
+        index.add(text, {"n": number, "text": text})
+    return index
+
+def test_embeddings_are_unit_length_and_empty_text_is_zero():
+    vectors = HashingEmbedder(dim=64).embed(["the old well", "The OLD well!", ""])
+    assert vectors.shape == (3, 64)
+    assert np.allclose(np.linalg.norm(vectors[:2], axis=1), 1)
+    assert np.allclose(vectors[0], vectors[1])
+    assert not vectors[2].any()
+
+def test_search_ranks_the_most_similar_memories_first():
+    index = index_of(
+        "Where were you last night? At the tavern until late",
+        "Did you see the well? The well has been dry for weeks",
+        "Nice weather today. Good for the harvest"
+    )
+    assert [item["n"] for item in index.search("what happened to the well", k=2)][0] == 1
+    assert [item["n"] for item in index.search("tavern last night", k=1)] == [0]
+    assert len(index.search("anything", k=10)) == 3
+    assert index.search("anything", k=0) == []
+    assert MemoryIndex(HashingEmbedder()).search("anything") == []
+
+def test_newer_memories_win_ties():
+    index = index_of("the well", "the well", "the well")
+    assert [item["n"] for item in index.search("the well", k=3)] == [2, 1, 0]
+
+def test_index_grows_past_its_initial_capacity():
+    texts = [f"memory number {number}" for number in range(10)]
+    index = index_of(*texts, initial_capacity=2)
+    assert len(index) == 10
+    assert [item["n"] for item in index.items()] == list(range(10))
+    assert index.search("memory number 7", k=1)[0]["n"] == 7
+
+def test_full_index_replaces_its_oldest_memories():
+    index = index_of("alpha", "bravo", "charlie", "delta", "echo", max_items=3)
+    assert len(index) == 3
+    assert [item["text"] for item in index.items()] == ["charlie", "delta", "echo"]
+    assert index.search("alpha", k=3)[0]["text"] != "alpha"
+    assert index.revision == 5
+
+def handler_with(*exchanges):
+    handler = NPCHandler(model_provider=StubProvider(), npc_manager=NPCManager())
+    for npc_id, player_input, reply in exchanges:
+        handler._store_memory(npc_id, player_input, reply, CONTEXT)
+    return handler
+
+def test_handler_retrieves_relevant_memories_per_npc():
+    handler = handler_with(
+        ("elder", "Tell me about the well", "The well ran dry after the storm"),
+        ("elder", "Any news from the market?", "Prices are up again"),
+        ("blacksmith", "Tell me about the well", "Ask the elder")
+    )
+    assert handler._get_relevant_memories("elder", "the well")[0] == "The well ran dry after the storm"
+    assert "Ask the elder" not in handler._get_relevant_memories("elder", "the well")
+    assert handler._get_relevant_memories("merchant", "the well") == []
+
+def test_memory_deltas_round_trip_between_handlers():
+    source = handler_with(
+        ("elder", "Hello", "Morning"),
+        ("blacksmith", "Hello", "Busy")
+    )
+    copy = NPCHandler(model_provider=StubProvider(), npc_manager=NPCManager())
+    copy.extend_memories(source.memories_after(0))
+    source._store_memory("elder", "The well?", "Dry", CONTEXT)
+    copy.extend_memories(source.memories_after(copy.last_memory_id))
+    assert copy.export_memories() == source.export_memories()
+    assert copy._get_relevant_memories("elder", "the well")[0] == "Dry"
+
+    copy.discard_memories_after(2)
+    assert copy.last_memory_id == 2
+    assert [memory["content"] for memory in copy.export_memories()["elder"]] == ["Morning"]
+    assert copy._get_relevant_memories("elder", "the well") == ["Morning"]
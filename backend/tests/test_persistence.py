@@ -0,0 +1,84 @@
+import asyncio
+import os
+import pytest
+from game.persistence import LOG_FILE, PersistenceEngine
+from game.session_store import SessionStore
+
+@pytest.fixture
+def engine(tmp_path):
+    # A long interval, so nothing is written until a flush
+    engine = PersistenceEngine(str(tmp_path), group_commit_interval=60, snapshot_interval=3)
+    yield engine
+    engine.close()
+
+def test_appends_wait_for_the_group_commit(engine):
+    journal = engine.journal("s")
+    journal.append("advance_time", {"minutes": 30})
+    journal.append("advance_time", {"minutes": 15})
+    assert engine.pending() == 2
+    assert not os.path.exists(os.path.join(journal.directory, LOG_FILE))
+
+    engine.flush()
+    assert engine.pending() == 0
+    snapshot, entries = engine.journal("s").load()
+    assert snapshot is None
+    assert [(entry["seq"], entry["payload"]["minutes"]) for entry in entries] == [(1, 30), (2, 15)]
+
+def test_snapshot_replaces_the_log_it_covers(engine):
+    journal = engine.journal("s")
+    for minutes in (1, 2, 3):
+        journal.append("advance_time", {"minutes": minutes})
+    assert journal.needs_snapshot()
+    journal.snapshot({"n": 3})
+    journal.append("advance_time", {"minutes": 4})
+    engine.flush()
+
+    reloaded = engine.journal("s")
+    snapshot, entries = reloaded.load()
+    assert snapshot == {"n": 3}
+    assert [entry["seq"] for entry in entries] == [4]
+    assert reloaded.sequence == 4
+    assert not reloaded.needs_snapshot()
+
+def test_torn_final_line_is_dropped(engine):
+    journal = engine.journal("s")
+    journal.append("advance_time", {"minutes": 30})
+    journal.append("advance_time", {"minutes": 15})
+    engine.flush()
+    with open(os.path.join(journal.directory, LOG_FILE), "a") as f:
+        f.write('{"seq": 3, "op": "advance_ti')
+
+    _, entries = engine.journal("s").load()
+    assert [entry["seq"] for entry in entries] == [1, 2]
+
+def test_unsafe_session_ids_get_a_hashed_directory(engine):
+    assert os.path.dirname(engine.journal("../../etc").directory) == engine.data_dir
+
+def test_restarted_store_replays_the_session(tmp_path):
+    async def play(store):
+        session = await store.open("player")
+        session.game_state.advance_time(90)
+        session.game_state.add_event({"type": "note", "timestamp": session.game_state.world_state["time"]})
+        return session.snapshot()
+
+    engine = PersistenceEngine(str(tmp_path), group_commit_interval=60, snapshot_interval=1000)
+    before = asyncio.run(play(SessionStore(persistence=engine)))
+    # Stopping flushes the queued entries, as a shutdown would
+    engine.close()
+
+    engine = PersistenceEngine(str(tmp_path), group_commit_interval=60, snapshot_interval=1000)
+    try:
+        session = asyncio.run(SessionStore(persistence=engine).open("player"))
+        assert session.game_state.world_state["time"] == before["game_state"]["world_state"]["time"]
+        assert session.game_state.events.to_list() == before["event_history"]
+    finally:
+        engine.close()
+
+def test_sessions_without_changes_write_nothing(tmp_path):
+    engine = PersistenceEngine(str(tmp_path), group_commit_interval=60)
+    try:
+        asyncio.run(SessionStore(persistence=engine).open())
+        engine.flush()
+        assert os.listdir(tmp_path) == []
+    finally:
+        engine.close()
@@ -0,0 +1,111 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from game import request_dedup
+from game.request_dedup import IdempotencyCache, IdempotencyConflict, SingleFlight
+import main
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(request_dedup.time, "monotonic", clock)
+    return clock
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+def counting_call(calls, result="done", delay=0.01):
+    async def call():
+        calls.append(result)
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return call
+
+def test_concurrent_identical_calls_run_once():
+    async def run():
+        flight, calls = SingleFlight(), []
+        results = await asyncio.gather(*(flight.run("k", counting_call(calls)) for _ in range(3)))
+        return flight, calls, results
+    flight, calls, results = asyncio.run(run())
+    assert calls == ["done"]
+    assert results == [("done", False), ("done", True), ("done", True)]
+    assert flight.shared == 2
+    assert len(flight) == 0
+
+def test_calls_after_completion_or_with_other_keys_run_again():
+    async def run():
+        flight, calls = SingleFlight(), []
+        await asyncio.gather(flight.run("a", counting_call(calls, "a")), flight.run("b", counting_call(calls, "b")))
+        await flight.run("a", counting_call(calls, "a"))
+        return calls
+    assert asyncio.run(run()) == ["a", "b", "a"]
+
+def test_a_cancelled_caller_does_not_cancel_the_call_for_others():
+    async def run():
+        flight, calls = SingleFlight(), []
+        first = asyncio.ensure_future(flight.run("k", counting_call(calls, delay=0.05)))
+        second = asyncio.ensure_future(flight.run("k", counting_call(calls)))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, calls
+    assert asyncio.run(run()) == (("done", True), ["done"])
+
+def test_a_failed_call_fails_every_caller_and_is_forgotten():
+    async def run():
+        flight, calls = SingleFlight(), []
+        results = await asyncio.gather(
+            *(flight.run("k", counting_call(calls, RuntimeError("model unavailable"))) for _ in range(2)),
+            return_exceptions=True
+        )
+        return flight, calls, results
+    flight, calls, results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(flight) == 0
+
+def test_stored_results_replay_until_they_expire(clock):
+    cache = IdempotencyCache(ttl_seconds=60)
+    assert cache.get("key", "request") is None
+    cache.put("key", "request", {"reply": "Hello"})
+    clock.now += 60
+    assert cache.get("key", "request") == {"reply": "Hello"}
+    clock.now += 1
+    assert cache.get("key", "request") is None
+    assert len(cache) == 0
+
+def test_a_key_reused_for_another_request_conflicts(clock):
+    cache = IdempotencyCache()
+    cache.put("key", "request", "result")
+    with pytest.raises(IdempotencyConflict):
+        cache.get("key", "other request")
+
+def test_only_the_newest_keys_are_kept(clock):
+    cache = IdempotencyCache(max_keys=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, "request", key)
+    assert cache.get("a", "request") is None
+    assert cache.get("c", "request") == "c"
+    assert len(cache) == 2
+
+def test_repeated_idempotency_key_replays_the_interaction(client):
+    headers = {"X-Session-Id": client.post("/session").json()["session_id"], "Idempotency-Key": "click-1"}
+    first = client.post("/npc/elder/interact", json={"player_input": "greet"}, headers=headers)
+    time_after_first = client.get("/game/state", headers=headers).json()["worldState"]["time"]
+    second = client.post("/npc/elder/interact", json={"player_input": "greet"}, headers=headers)
+    assert second.json() == first.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert client.get("/game/state", headers=headers).json()["worldState"]["time"] == time_after_first
+
+    other = client.post("/npc/elder/interact", json={"player_input": "Who are you?"}, headers=headers)
+    assert other.status_code == 422
@@ -0,0 +1,71 @@
+import pytest
+from ai import response_cache
+from ai.response_cache import ResponseCache
+
+CONTEXT = {"time": "06:15", "current_loop": 1, "location": "village_square", "recent_events": []}
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "monotonic", clock)
+    return clock
+
+def key(player_input="Hello there!", trust_level=10, context=CONTEXT, memories=()):
+    return ResponseCache.make_key("elder", player_input, trust_level, context, "village_square", "default@1", memories)
+
+def test_key_ignores_case_punctuation_and_spacing():
+    assert key("Hello there!") == key("  hello,   THERE ")
+
+def test_key_shares_a_trust_band_and_an_hour():
+    assert key(trust_level=0) == key(trust_level=24)
+    assert key(trust_level=24) != key(trust_level=25)
+    assert key(context=dict(CONTEXT, time="06:59")) == key()
+    assert key(context=dict(CONTEXT, time="07:00")) != key()
+
+def test_key_separates_session_history():
+    assert key(memories=["Player asked about the well"]) != key()
+    assert key(context=dict(CONTEXT, recent_events=["The bell rang"])) != key()
+
+def test_lookups_miss_until_every_variant_is_generated(clock):
+    cache = ResponseCache(variants_per_key=2)
+    cache.put("k", "first")
+    assert cache.get("k") is None
+    cache.put("k", "second")
+    cache.put("k", "third")
+    assert {cache.get("k") for _ in range(50)} == {"first", "second"}
+    assert cache.stats()["misses"] == 1
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResponseCache(ttl_seconds=60, variants_per_key=1)
+    cache.put("k", "reply")
+    clock.now += 60
+    assert cache.get("k") == "reply"
+    clock.now += 1
+    assert cache.get("k") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["entries"] == 0
+
+def test_later_variants_do_not_extend_the_ttl(clock):
+    cache = ResponseCache(ttl_seconds=60, variants_per_key=2)
+    cache.put("k", "first")
+    clock.now += 50
+    cache.put("k", "second")
+    clock.now += 11
+    assert cache.get("k") is None
+
+def test_least_recently_used_key_is_evicted(clock):
+    cache = ResponseCache(max_entries=2, variants_per_key=1)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,54 @@
+import asyncio
+import gc
+import time
+from game.persistence import PersistenceEngine
+from game.session_store import SessionStore
+
+def test_least_recently_used_session_is_evicted_first():
+    store = SessionStore(max_sessions=2)
+    store.get_or_create("a")
+    store.get_or_create("b")
+    store.get("a")
+    store.get_or_create("c")
+    assert store.session_ids() == ["a", "c"]
+    assert store.get("b") is None
+
+def test_idle_sessions_expire():
+    store = SessionStore(idle_seconds=60)
+    store.get_or_create("old").last_access = time.monotonic() - 61
+    store.get_or_create("new")
+    assert store.get("old") is None
+    assert store.session_ids() == ["new"]
+
+def test_evicted_session_still_referenced_is_revived():
+    store = SessionStore(max_sessions=1)
+    first = store.get_or_create("a")
+    first.game_state.advance_time(30)
+    store.get_or_create("b")
+    assert store.session_ids() == ["b"]
+    # Its queued jobs could still be changing it, so the same copy comes back
+    assert store.get_or_create("a") is first
+    assert store.session_ids() == ["a"]
+
+def test_evicted_session_is_recovered_from_its_journal(tmp_path):
+    engine = PersistenceEngine(str(tmp_path), group_commit_interval=60)
+    try:
+        store = SessionStore(max_sessions=1, persistence=engine)
+        session = store.get_or_create("a")
+        session.game_state.advance_time(30)
+        time_after = session.game_state.world_state["time"]
+        del session
+        store.get_or_create("b")
+        gc.collect()
+
+        recovered = asyncio.run(store.open("a"))
+        assert recovered.game_state.world_state["time"] == time_after
+    finally:
+        engine.close()
+
+def test_open_without_a_token_creates_a_new_session():
+    store = SessionStore()
+    first = asyncio.run(store.open())
+    second = asyncio.run(store.open())
+    assert first.session_id != second.session_id
+    assert asyncio.run(store.open(first.session_id)) is first
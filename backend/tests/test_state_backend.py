@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+from game.session_store import GameSession
+from game.state_backend import InMemoryStateBackend, SQLiteStateBackend
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    backend = InMemoryStateBackend() if request.param == "memory" else SQLiteStateBackend(str(tmp_path / "state.db"))
+    yield backend
+    backend.close()
+
+def event(event_id):
+    return [event_id, 1, 480 + event_id, {"type": "npc_interaction", "npc_id": "elder"}]
+
+def memory(memory_id, npc_id):
+    return [memory_id, npc_id, {"id": memory_id, "player_input": "hi", "content": str(memory_id)}]
+
+def test_write_based_on_a_stale_version_is_rejected(backend):
+    assert backend.compare_and_swap("s", 0, {"n": 1}) == 1
+    assert backend.compare_and_swap("s", 0, {"n": 2}) is None
+    assert backend.compare_and_swap("s", 1, {"n": 2}) == 2
+    assert backend.compare_and_swap("s", 1, {"n": 3}) is None
+    version, snapshot, _, _ = backend.load("s")
+    assert (version, snapshot) == (2, {"n": 2})
+    assert backend.version("s") == 2
+    assert backend.load("other") is None
+    assert backend.version("other") == 0
+
+def test_rejected_write_stores_none_of_its_events(backend):
+    backend.compare_and_swap("s", 0, {}, [event(1)])
+    assert backend.compare_and_swap("s", 0, {}, [event(2)], memories=[memory(1, "elder")]) is None
+    _, _, events, memories = backend.load("s")
+    assert [entry[0] for entry in events] == [1]
+    assert memories == []
+
+def test_load_returns_only_newer_events_and_drops_old_ones(backend):
+    backend.compare_and_swap("s", 0, {}, [event(1), event(2)])
+    backend.compare_and_swap("s", 1, {}, [event(3)], oldest_event_id=2)
+    _, _, events, _ = backend.load("s")
+    assert [entry[0] for entry in events] == [2, 3]
+    _, _, events, _ = backend.load("s", after_event_id=2)
+    assert events == [event(3)]
+
+def test_memories_are_stored_as_deltas_and_trimmed_per_npc(backend):
+    backend.compare_and_swap("s", 0, {}, memories=[memory(1, "elder"), memory(2, "blacksmith")])
+    backend.compare_and_swap("s", 1, {}, memories=[memory(3, "elder")], oldest_memory_ids={"elder": 3})
+    _, _, _, memories = backend.load("s")
+    assert [(entry[0], entry[1]) for entry in memories] == [(2, "blacksmith"), (3, "elder")]
+    _, _, _, memories = backend.load("s", after_memory_id=2)
+    assert memories == [memory(3, "elder")]
+
+def test_sessions_share_memories_without_storing_them_in_snapshots(backend):
+    async def scenario():
+        first = GameSession("s", state_backend=backend)
+        await first.transaction(lambda: first.npc_handler._store_memory("elder", "who are you", "the elder", {"time": "07:00"}))
+        second = GameSession("s", state_backend=backend, stored=backend.load("s"))
+        await first.transaction(lambda: first.npc_handler._store_memory("elder", "and the mayor?", "dead", {"time": "07:30"}))
+        async with second.lock:
+            await second._sync()
+        return second
+
+    second = asyncio.run(scenario())
+    assert [memory["content"] for memory in second.npc_handler.npc_memories["elder"]] == ["the elder", "dead"]
+    _, snapshot, _, memories = backend.load("s")
+    assert "memories" not in snapshot
+    assert snapshot["last_memory_id"] == 2
+    assert len(memories) == 2
+
+def test_session_reloads_after_losing_a_race(backend):
+    async def scenario():
+        first = GameSession("s", state_backend=backend)
+        await first.transaction(lambda: None)
+        second = GameSession("s", state_backend=backend, stored=backend.load("s"))
+        await second.transaction(lambda: second.game_state.add_event({"type": "note", "timestamp": "06:00"}))
+        # first is a version behind: its write is retried on top of second's
+        await first.transaction(lambda: first.game_state.add_event({"type": "clue", "timestamp": "06:10"}))
+        return first
+
+    first = asyncio.run(scenario())
+    assert [stored.event["type"] for stored in first.game_state.events.query()[0]] == ["note", "clue"]
+    _, _, events, _ = backend.load("s")
+    assert [entry[3]["type"] for entry in events] == ["note", "clue"]
@@ -0,0 +1,62 @@
+from collections import deque
+import pytest
+from fastapi.testclient import TestClient
+from game.state_manager import GameState
+import main
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+def open_session(client):
+    return {"X-Session-Id": client.post("/session").json()["session_id"]}
+
+def test_changes_since_returns_the_changes_after_a_version():
+    state = GameState()
+    start = state.version
+    state.add_player_knowledge("the well is dry")
+    state.add_player_knowledge("the elder lied")
+    changes = state.changes_since(start)
+    assert [change["version"] for change in changes] == [start + 1, start + 2]
+    assert [change["payload"]["knowledge"] for change in changes] == ["the well is dry", "the elder lied"]
+    assert state.changes_since(state.version) == []
+
+def test_changes_since_a_trimmed_or_unknown_version_needs_the_full_state():
+    state = GameState()
+    state.change_log = deque(maxlen=2)
+    start = state.version
+    for number in range(3):
+        state.add_player_knowledge(f"fact {number}")
+    assert state.changes_since(start) is None
+    assert len(state.changes_since(start + 1)) == 2
+    assert state.changes_since(state.version + 1) is None
+
+def test_unchanged_state_is_not_modified(client):
+    headers = open_session(client)
+    first = client.get("/game/state", headers=headers)
+    etag = first.headers["ETag"]
+    assert client.get("/game/state", headers=dict(headers, **{"If-None-Match": etag})).status_code == 304
+    assert client.get("/game/state", headers=dict(headers, **{"If-None-Match": f'"other", {etag}'})).status_code == 304
+    assert client.get("/game/state", headers=dict(headers, **{"If-None-Match": "*"})).status_code == 304
+
+def test_changed_state_gets_a_new_etag(client):
+    headers = open_session(client)
+    etag = client.get("/game/state", headers=headers).headers["ETag"]
+    client.post("/npc/elder/interact", json={"player_input": "greet"}, headers=headers)
+    response = client.get("/game/state", headers=dict(headers, **{"If-None-Match": etag}))
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+def test_changes_endpoint_serves_deltas_until_they_run_out(client):
+    headers = open_session(client)
+    version = client.get("/game/state/changes", params={"since": 0}, headers=headers).json()["version"]
+    client.post("/npc/elder/interact", json={"player_input": "greet"}, headers=headers)
+    delta = client.get("/game/state/changes", params={"since": version}, headers=headers).json()
+    assert delta["reset"] is False
+    assert delta["changes"] and delta["version"] > version
+    assert [change["version"] for change in delta["changes"]] == list(range(version + 1, delta["version"] + 1))
+
+    ahead = client.get("/game/state/changes", params={"since": delta["version"] + 10}, headers=headers).json()
+    assert ahead["reset"] is True
+    assert ahead["state"]["version"] == delta["version"]
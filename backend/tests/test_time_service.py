@@ -0,0 +1,22 @@
+from game.time_service import TimeService, TimeState
+
+def world_events(time_service):
+    return [event for event in time_service.pending_events() if event["kind"] == "world_event"]
+
+def test_restore_keeps_pending_one_off_events():
+    saved = TimeService()
+    saved.schedule(7 * 60, "world_event", {"name": "bell"})
+    saved.advance_minutes(30)
+
+    restored = TimeService()
+    restored.restore(TimeState(**vars(saved.state)), saved.pending_events())
+    assert world_events(restored) == [{"minute": 420, "kind": "world_event", "data": {"name": "bell"}}]
+    assert restored.pending_events() == saved.pending_events()
+
+def test_restore_later_in_the_loop_keeps_the_timeline():
+    time_service = TimeService()
+    time_service.schedule(9 * 60, "world_event", {"name": "bell"})
+    time_service.restore(TimeState(current_hour=8, is_dead=False, death_reason=None, discovered_murderer=False))
+    assert len(world_events(time_service)) == 1
+    time_service.restore(TimeState(current_hour=10, is_dead=False, death_reason=None, discovered_murderer=False))
+    assert world_events(time_service) == []
@@ -0,0 +1,28 @@
+import asyncio
+from game.work_queue import WorkQueue
+
+def run_failing_job(idempotent: bool):
+    calls = []
+
+    def job():
+        calls.append(1)
+        raise RuntimeError("failed part way")
+
+    async def main():
+        queue = WorkQueue(retries=2, retry_delay=0)
+        await queue.put("session", "job", job, idempotent=idempotent)
+        await queue.join()
+        return queue.stats()
+
+    stats = asyncio.run(main())
+    return len(calls), stats
+
+def test_failing_job_is_not_retried_by_default():
+    calls, stats = run_failing_job(idempotent=False)
+    assert calls == 1
+    assert (stats["retried"], stats["failed"]) == (0, 1)
+
+def test_failing_idempotent_job_is_retried():
+    calls, stats = run_failing_job(idempotent=True)
+    assert calls == 3
+    assert (stats["retried"], stats["failed"]) == (2, 1)
@@ -0,0 +1,60 @@
+import json
+import os
+import shutil
+import pytest
+from game.npc_manager import NPCManager
+from game.world_pack import WORLD_PACKS_DIR, WorldCatalog, pack_to_dict
+
+@pytest.fixture
+def root(tmp_path):
+    shutil.copytree(os.path.join(WORLD_PACKS_DIR, "default"), str(tmp_path / "worlds" / "default"))
+    return str(tmp_path / "worlds")
+
+def test_cached_pack_matches_the_compiled_one(root, tmp_path):
+    cache = str(tmp_path / "cache")
+    compiled = WorldCatalog(root, cache).get("default")
+    catalog = WorldCatalog(root, cache)
+    cached = catalog.get("default")
+    assert (catalog.compiles, catalog.cache_loads) == (0, 1)
+    assert pack_to_dict(cached) == pack_to_dict(compiled)
+
+def test_old_versions_and_pickles_are_pruned_not_loaded(root, tmp_path):
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    # Unpickling this would run a shell command
+    (cache / "default-0123456789abcdef.pickle").write_bytes(b"cos\nsystem\n(S'exit 1'\ntR.")
+    (cache / "default-fedcba9876543210.json").write_text("{}")
+    (cache / "default-extra-0123456789abcdef.json").write_text("{}")
+    catalog = WorldCatalog(root, str(cache))
+    pack = catalog.get("default")
+    assert catalog.compiles == 1
+    assert sorted(os.listdir(str(cache))) == [f"default-{pack.content_hash[:16]}.json", "default-extra-0123456789abcdef.json"]
+
+def test_damaged_cache_is_recompiled(root, tmp_path):
+    cache = str(tmp_path / "cache")
+    pack = WorldCatalog(root, cache).get("default")
+    with open(os.path.join(cache, f"default-{pack.content_hash[:16]}.json"), "w") as f:
+        f.write('{"format": 3}')
+    catalog = WorldCatalog(root, cache)
+    assert pack_to_dict(catalog.get("default")) == pack_to_dict(pack)
+    assert catalog.compiles == 1
+
+def test_npc_memory_and_replies_come_from_the_pack(root, tmp_path):
+    path = os.path.join(root, "default", "npcs.json")
+    with open(path) as f:
+        npcs = json.load(f)
+    npcs["blacksmith"]["keeps_memories"] = True
+    npcs["blacksmith"]["responses"] = {"investigate": "Nothing but soot."}
+    npcs["elder"].pop("keeps_memories")
+    with open(path, "w") as f:
+        json.dump(npcs, f)
+
+    manager = NPCManager(WorldCatalog(root, str(tmp_path / "cache")).get("default"))
+    for npc_id in ("elder", "blacksmith"):
+        manager.get_npc(npc_id).state.trust_level = 60
+        manager.process_interaction(npc_id, "greet", "08:00")
+    assert manager.rule_response("blacksmith", "investigate", 8) == "Nothing but soot."
+    assert manager.rule_response("blacksmith", "ask_about_murder", 8) == "I don't know anything about that."
+    manager.reset_states(finished_loop=1)
+    assert manager.get_npc("blacksmith").state.memories
+    assert not manager.get_npc("elder").state.memories
@@ -1,6 +1,7 @@
 import { useState, useEffect, useRef } from 'react'
 import './App.css'
 import { GameState, NPC, InteractionResult } from './types/game'
+import { apiFetch } from './services/session'
 
 const initialGameState: GameState = {
   currentLoop: 1,
@@ -45,7 +46,7 @@ function App() {
 
   const fetchGameState = async () => {
     try {
-      const response = await fetch('http://localhost:8000/game/state');
+      const response = await apiFetch('/game/state');
       const data = await response.json();
       // Ensure all required fields are present
       const state: GameState = {
@@ -70,7 +71,7 @@ function App() {
 
   const fetchLocations = async () => {
     try {
-      const response = await fetch('http://localhost:8000/game/locations');
+      const response = await apiFetch('/game/locations');
       const data = await response.json();
       setLocations(data.locations);
     } catch (error) {
@@ -81,7 +82,7 @@ function App() {
 
   const fetchLocationNPCs = async (location: string) => {
     try {
-      const response = await fetch(`http://localhost:8000/game/location/${location}/npcs`);
+      const response = await apiFetch(`/game/location/${location}/npcs`);
       const data = await response.json();
       setLocationNPCs(data.npcs);
     } catch (error) {
@@ -103,7 +104,7 @@ function App() {
     }
     
     try {
-      const response = await fetch(`http://localhost:8000/npc/${npcId}/interact`, {
+      const response = await apiFetch(`/npc/${npcId}/interact`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -127,7 +128,7 @@ function App() {
 
   const resetGame = async () => {
     try {
-      const response = await fetch('http://localhost:8000/game/reset', {
+      const response = await apiFetch('/game/reset', {
         method: 'POST',
       });
       const data = await response.json();
@@ -0,0 +1,33 @@
+const API_URL = 'http://localhost:8000';
+const SESSION_STORAGE_KEY = 'rere.sessionId';
+
+let sessionRequest: Promise<string> | null = null;
+
+// The player's game session token, created on first use and kept across reloads
+function getSessionId(): Promise<string> {
+  const stored = localStorage.getItem(SESSION_STORAGE_KEY);
+  if (stored) {
+    return Promise.resolve(stored);
+  }
+  // Requests fired together on first load all wait for the same new session
+  if (!sessionRequest) {
+    sessionRequest = fetch(`${API_URL}/session`, { method: 'POST' })
+      .then(response => response.json())
+      .then(data => {
+        localStorage.setItem(SESSION_STORAGE_KEY, data.session_id);
+        return data.session_id as string;
+      })
+      .finally(() => {
+        sessionRequest = null;
+      });
+  }
+  return sessionRequest;
+}
+
+// fetch() against the API, within the player's own game session
+export async function apiFetch(path: string, init: RequestInit = {}): Promise<Response> {
+  const sessionId = await getSessionId();
+  const headers = new Headers(init.headers);
+  headers.set('X-Session-Id', sessionId);
+  return fetch(`${API_URL}${path}`, { ...init, headers });
+}